@@ -0,0 +1,127 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+# priorities of tracker calls, lower runs first
+SYNC = 0  # event code messages and tracker clock reads, whose timing matters
+KEY = 1  # key presses, which a running calibration is waiting for
+COMMAND = 2  # connecting, calibration, drift correction, recording, ending the session
+STATUS = 3  # trial status labels on the Host PC display
+POLL = 4  # link sample reads
+_STOP = 5  # after everything that was queued before it
+
+
+class TrackerActor:
+    """Owns a tracker and makes every call on it from one thread.
+
+    pylink isn't safe to call from several threads at once, and handlers, sample tasks,
+    the message writer and the session worker all used to call it from their own. Now
+    they submit calls to the actor and get a Future back. Calls run one at a time in
+    priority order (SYNC, KEY, COMMAND, STATUS, POLL), in submission order within a
+    priority, so an event code never waits behind a status update or a sample read.
+
+    Calibration and drift correction block the actor for as long as they run, so the
+    custom display calls `pump` once per tracker frame: it runs every queued call except
+    other commands (which would change the tracker's mode underneath the running one),
+    which keeps event codes, keys and sample reads going during a calibration.
+
+    Calls submitted from the actor's own thread (from inside another call) run right away.
+    """
+
+    def __init__(self, name="tracker"):
+        self.queue = queue.PriorityQueue()
+        self.seq = itertools.count()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.stopped = False
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, priority, fn, *args):
+        """Queues `fn(*args)`, returns a Future of its result."""
+        future = Future()
+        if threading.current_thread() is self.thread:
+            self._call(future, fn, args)
+        elif self.stopped:
+            future.set_exception(RuntimeError("The tracker has been closed."))
+        else:
+            self.queue.put((priority, next(self.seq), future, fn, args))
+        return future
+
+    def call(self, priority, fn, *args):
+        """Runs `fn(*args)` on the actor and waits for its result."""
+        return self.submit(priority, fn, *args).result()
+
+    @staticmethod
+    def _call(future, fn, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _run(self):
+        while True:
+            priority, _, future, fn, args = self.queue.get()
+            if priority == _STOP:
+                return
+            self._call(future, fn, args)
+
+    def pump(self):
+        """Runs the queued calls that can't wait for the running command to finish."""
+        if threading.current_thread() is not self.thread:
+            return
+        deferred = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] in (COMMAND, _STOP):
+                deferred.append(item)
+            else:
+                self._call(*item[2:])
+        for item in deferred:
+            self.queue.put(item)
+
+    def stop(self, wait=True):
+        """Stops the actor once the calls queued so far have run."""
+        self.stopped = True
+        self.queue.put((_STOP, next(self.seq), None, None, ()))
+        if wait and threading.current_thread() is not self.thread:
+            self.thread.join()
+
+
+class ActorBound:
+    """A tracker whose methods raise when called from any thread but its actor's.
+
+    Handlers and tasks have to hand tracker calls to the actor; a call that slips past it
+    would race the actor on the link. This turns such a call into an error where it is
+    made. Attributes that aren't methods are passed through, and isinstance sees the
+    tracker's class.
+    """
+
+    def __init__(self, tracker, actor):
+        object.__setattr__(self, "_tracker", tracker)
+        object.__setattr__(self, "_actor", actor)
+
+    @property
+    def __class__(self):
+        return type(self._tracker)
+
+    def __getattr__(self, name):
+        value = getattr(self._tracker, name)
+        if not callable(value):
+            return value
+        thread = self._actor.thread
+
+        def call(*args, **kwargs):
+            if threading.current_thread() is not thread:
+                raise RuntimeError("tracker.%s called outside the session's tracker actor." % name)
+            return value(*args, **kwargs)
+
+        return call
@@ -0,0 +1,164 @@
+import math
+from collections import defaultdict
+
+
+class Rect:
+    def __init__(self, id, x, y, width, height):
+        self.id = id
+        self.x0, self.y0 = x, y
+        self.x1, self.y1 = x + width, y + height
+
+    def bounds(self):
+        return self.x0, self.y0, self.x1, self.y1
+
+    def contains(self, x, y):
+        return self.x0 <= x <= self.x1 and self.y0 <= y <= self.y1
+
+
+class Circle:
+    def __init__(self, id, x, y, radius):
+        self.id = id
+        self.x, self.y = x, y
+        self.radius = radius
+        self.radius_sq = radius**2
+
+    def bounds(self):
+        return self.x - self.radius, self.y - self.radius, self.x + self.radius, self.y + self.radius
+
+    def contains(self, x, y):
+        return (x - self.x) ** 2 + (y - self.y) ** 2 <= self.radius_sq
+
+
+class Polygon:
+    def __init__(self, id, points):
+        if len(points) < 3:
+            raise ValueError("AOI %r: a polygon needs at least 3 points." % id)
+        self.id = id
+        self.points = [(float(x), float(y)) for x, y in points]
+        xs, ys = zip(*self.points)
+        self._bounds = min(xs), min(ys), max(xs), max(ys)
+
+    def bounds(self):
+        return self._bounds
+
+    def contains(self, x, y):
+        # even-odd ray casting
+        inside = False
+        x1, y1 = self.points[-1]
+        for x2, y2 in self.points:
+            if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+            x1, y1 = x2, y2
+        return inside
+
+
+SHAPES = {"rect": Rect, "circle": Circle, "polygon": Polygon}
+
+
+def aoi_from_spec(spec):
+    """Builds an AOI from the dict sent by the client.
+
+    Rectangles are {"id", "shape": "rect", "x", "y", "width", "height"} with x, y the top
+    left corner, circles {"id", "shape": "circle", "x", "y", "radius"} and polygons
+    {"id", "shape": "polygon", "points": [[x, y], ...]}, all in screen pixels.
+    """
+    spec = dict(spec)
+    shape = spec.pop("shape", "rect")
+    spec.pop("dwell", None)
+    if shape not in SHAPES:
+        raise ValueError("Unknown AOI shape %r, expected one of %s." % (shape, ", ".join(SHAPES)))
+    if "id" not in spec:
+        raise ValueError("Every AOI needs an id.")
+    try:
+        return SHAPES[shape](**spec)
+    except TypeError as e:
+        raise ValueError("Bad parameters for %s AOI %r: %s" % (shape, spec["id"], e)) from e
+
+
+class AoiIndex:
+    """Uniform grid over the screen mapping each cell to the AOIs whose bounds overlap it.
+
+    Hit-testing a point only looks at the AOIs registered in its cell, so the cost per
+    sample stays roughly constant however many AOIs there are.
+    """
+
+    def __init__(self, aois, cell_size=64):
+        self.aois = list(aois)
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+
+        for aoi in self.aois:
+            x0, y0, x1, y1 = aoi.bounds()
+            for cx in range(math.floor(x0 / cell_size), math.floor(x1 / cell_size) + 1):
+                for cy in range(math.floor(y0 / cell_size), math.floor(y1 / cell_size) + 1):
+                    self.cells[cx, cy].append(aoi)
+
+    def hits(self, x, y):
+        """Ids of every AOI containing (x, y)."""
+        cell = self.cells.get((math.floor(x / self.cell_size), math.floor(y / self.cell_size)))
+        if not cell:
+            return frozenset()
+        return frozenset(aoi.id for aoi in cell if aoi.contains(x, y))
+
+
+class AoiTracker:
+    """Follows gaze through a set of AOIs and reports enter, exit and dwell events.
+
+    Samples with no eye data keep the current state, so a blink does not count as leaving
+    an AOI.
+    """
+
+    def __init__(self, specs, cell_size=64, default_dwell=None):
+        aois = [aoi_from_spec(spec) for spec in specs]
+        ids = [aoi.id for aoi in aois]
+        if len(set(ids)) != len(ids):
+            raise ValueError("AOI ids must be unique.")
+
+        self.index = AoiIndex(aois, cell_size)
+        # dwell time (ms) after which an aoiDwell event fires, per AOI
+        self.dwell = {spec["id"]: spec.get("dwell", default_dwell) for spec in specs}
+        self.entered = {}  # id -> time gaze entered it
+        self.dwell_sent = set()
+        self.current = frozenset()
+
+    def update(self, times, gaze):
+        """Runs a block of samples through the AOIs.
+
+        Args:
+            times (np.ndarray): (N,) sample times in ms.
+            gaze (np.ndarray): (N, 2) gaze in screen pixels, NaN where no eye data.
+
+        Returns:
+            list of (event, data) tuples, in sample order.
+        """
+        events = []
+        hits = self.index.hits
+        for t, (x, y) in zip(times.tolist(), gaze.tolist()):
+            if x != x or y != y:  # NaN
+                continue
+
+            current = hits(x, y)
+            if current != self.current:
+                for aoi_id in self.current - current:
+                    start = self.entered.pop(aoi_id)
+                    self.dwell_sent.discard(aoi_id)
+                    events.append(("aoiExit", {"id": aoi_id, "time": t, "dwell": t - start}))
+                for aoi_id in current - self.current:
+                    self.entered[aoi_id] = t
+                    events.append(("aoiEnter", {"id": aoi_id, "time": t}))
+                self.current = current
+
+            for aoi_id in current:
+                dwell = self.dwell[aoi_id]
+                if dwell is not None and aoi_id not in self.dwell_sent and t - self.entered[aoi_id] >= dwell:
+                    self.dwell_sent.add(aoi_id)
+                    events.append(("aoiDwell", {"id": aoi_id, "time": t, "dwell": t - self.entered[aoi_id]}))
+        return events
+
+    def close(self, t):
+        """Exit events for every AOI still being looked at when tracking stops."""
+        events = [("aoiExit", {"id": aoi_id, "time": t, "dwell": t - start}) for aoi_id, start in self.entered.items()]
+        self.entered.clear()
+        self.dwell_sent.clear()
+        self.current = frozenset()
+        return events
@@ -1,49 +1,91 @@
-from flask import Flask
-from flask_socketio import SocketIO, emit
+from flask import Flask, jsonify, request, send_from_directory
+from flask_socketio import SocketIO, join_room
 import requests
 import pylink
-import array
 import string
 import warnings
 import pylink as pl
 from flask_cors import CORS
+import os
+import threading
 import time
+from collections import Counter
 import numpy as np
+from werkzeug.utils import secure_filename
+
+from aoi import AoiTracker
+from backends import LEFT_EYE, RIGHT_EYE, close_tracker, open_tracker, send_commands
+from caldisplay import CAMERA_ENCODINGS, CameraImage, DisplayBatch
+from clocksync import ClientClock, server_ms
+from detection import DETECTORS, EVENTS, DispersionDetector, VelocityDetector
+from gaze import GazeQuality, combine_eyes, rejection_policy
+from gazestream import Downsampler, pack_frame
+from geometry import MonitorProfile
+from logs import start_logging
+from metrics import Metrics
+from samples import TIME, LEFT_X
+from sessions import Session
+from windows import MonitorWindows, Window
+
+# DEBUG also logs every event code, key and task start/stop
+log = start_logging(os.environ.get("EYELINK_LOG_LEVEL", "INFO"))
+METRICS = Metrics()
+
+
+class InstrumentedSocketIO(SocketIO):
+    """SocketIO whose event handlers time themselves into METRICS, as ``handler.<event>``."""
+
+    def on(self, message, namespace=None):
+        register = super().on(message, namespace)
+
+        def decorator(handler):
+            register(METRICS.timed("handler." + message, handler))
+            return handler
+
+        return decorator
+
 
 app = Flask(__name__)
 # CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# pylink calls block in C, so sessions need real threads to run side by side (no eventlet/gevent)
+socketio = InstrumentedSocketIO(app, cors_allowed_origins="*", async_mode="threading")
 
 
 LATEST_KEY_RECVD = None
 
 SCREEN_RESOLUTION = (1920, 1080)
 
+# "pylink" talks to a real EyeLink, "sim" runs the simulated tracker and "replay" plays back a
+# recording (see backends.py)
+TRACKER_BACKEND = os.environ.get("EYELINK_BACKEND", "pylink")
+# simulator options: fixed sample rate (Hz, default follows the sample_rate setting) and RNG seed
+SIM_OPTIONS = {
+    "sample_rate": int(os.environ["EYELINK_SIM_RATE"]) if os.environ.get("EYELINK_SIM_RATE") else None,
+    "seed": int(os.environ["EYELINK_SIM_SEED"]) if os.environ.get("EYELINK_SIM_SEED") else None,
+}
+# recording the replay backend plays back, a path or glob pattern (see backends.ReplayEyeLink)
+REPLAY_SOURCE = os.environ.get("EYELINK_REPLAY")
+# Host PC address of each booth's tracker, e.g. EYELINK_ADDRESSES="booth1=100.1.1.1,booth2=100.1.2.1";
+# sessions not listed connect to pylink's default address
+TRACKER_ADDRESSES = dict(
+    entry.split("=", 1) for entry in os.environ.get("EYELINK_ADDRESSES", "").split(",") if "=" in entry
+)
+# where EDF files are copied to when a session ends, served under /edf/<file>
+DATA_DIR = os.environ.get("EYELINK_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# EYELINK_SAMPLE_LOG=1 also writes every link sample and message to DATA_DIR as they come in
+SAMPLE_LOG = os.environ.get("EYELINK_SAMPLE_LOG", "") not in ("", "0")
+# seconds between serverStatus events to every client, 0 turns them off
+STATUS_INTERVAL = float(os.environ.get("EYELINK_STATUS_INTERVAL", "5"))
+
 
 class EyeMovementError(Exception):
-    def __init__(self, message, x, y):
+    def __init__(self, message, x, y, reason="gaze", time=None):
         super().__init__(message)
         self.x = x
         self.y = y
-
-
-def deg2pix(eyeMoveThresh=1.25, distFromScreen=800, monitorWidth=532, screenResX=SCREEN_RESOLUTION[0]):
-    """Converts degrees visual angle to a pixel value
-
-    Args:
-        eyeMoveThresh (int, optional): threshold (dva). Defaults to 1.
-        distFromScreen (int, optional): distance from headrest to screen. Defaults to 900.
-        monitorWidth (int, optional): Width of monitor. Defaults to 532.
-        screenResX (int, optional): Monitor resolution. Defaults to 1920.
-
-    Returns:
-        pix: pixel value
-    """
-
-    pix_size_x = monitorWidth / screenResX
-    mmfromfix = 2 * distFromScreen * np.tan(0.5 * np.deg2rad(eyeMoveThresh))
-    pix = round(mmfromfix / pix_size_x)
-    return pix
+        # "gaze" outside the fixation window or data "loss", and the tracker time it happened
+        self.reason = reason
+        self.time = time
 
 
 TRACKING_SETTINGS = {
@@ -125,13 +167,27 @@ KEYS_OSX = {
 KEYS.update(KEYS_OSX)
 
 
+# seconds a startRecording ack waits for the tracker, queued calls and waitForBlockStart included
+RECORDING_START_TIMEOUT = 3.0
+
+# camera frames a client can be behind before new frames are dropped
+CAMERA_FRAMES_IN_FLIGHT = 2
+
+
 class jsCustomDisplayInterface(pylink.EyeLinkCustomDisplay):
 
-    def __init__(self):
+    def __init__(self, room):
         pylink.EyeLinkCustomDisplay.__init__(self)
-        # adjusted to put center at (0,0)
-        self.pal = []
-        self.image_buffer = array.array("I")
+        # calibration graphics only go to the clients of this display's session
+        self.room = room
+        # camera image frames are assembled here, see setup_image_display
+        self.image_buffer = CameraImage()
+        self.camera_encoding = "zlib"
+        # frames sent, and the newest one a client has finished drawing
+        self.frames_sent = 0
+        self.frames_acked = 0
+        self.frames_dropped = 0
+        self.skip_overlay = False
 
         self.text_color = (-1, -1, -1)
 
@@ -171,50 +227,177 @@ class jsCustomDisplayInterface(pylink.EyeLinkCustomDisplay):
             "tab": ord("\t"),
         }
         self.mouse = None
+        # display commands waiting for the end of the tracker frame
+        self.batch = DisplayBatch()
+        # runs the tracker calls queued during a calibration, set by the session (TrackerActor.pump)
+        self.pump = lambda: None
+
+    def _send(self):
+        message = self.batch.pack()
+        if message is not None:
+            socketio.emit("calDisplay", message, to=self.room)
 
     def setup_cal_display(self):
         """Clears window on calibration setup."""
-        emit("setupCalDisplay", broadcast=True)
+        self.batch.setup()
+        self._send()
 
     def exit_cal_display(self):
         """Clears window on calibration exit."""
-        emit("exitCalDisplay", broadcast=True)
+        self.batch.exit()
+        self._send()
 
     def clear_cal_display(self):
         """Clears calibration targets."""
-        emit("clearCalDisplay", broadcast=True)
+        self.batch.clear()
 
     def erase_cal_target(self):
         """Clears a individual calibration target."""
-        emit("eraseCalTarget", broadcast=True)
+        self.batch.erase_target()
 
     def draw_cal_target(self, x, y):
-        print("DRAW TARGET")
         """Draws calibration targets."""
-        emit("drawCalTarget", {"x": x, "y": y}, broadcast=True)
+        self.batch.draw_target(x, y)
+
+    def play_beep(self, beepid):
+        self.batch.beep(beepid)
+
+    def set_camera_encoding(self, encoding):
+        if encoding not in CAMERA_ENCODINGS:
+            raise ValueError("camera_encoding must be one of %s." % ", ".join(CAMERA_ENCODINGS))
+        self.camera_encoding = encoding
+
+    def ack_frame(self, frame):
+        """A client has drawn camera frame `frame`."""
+        self.frames_acked = max(self.frames_acked, frame)
+
+    def setup_image_display(self, width, height):
+        """Starts showing the camera image, width x height pixels."""
+        self.image_buffer.setup(width, height)
+        # frames in flight from a previous camera setup will never be acked
+        self.frames_acked = self.frames_sent
+        self.batch.setup_image(width, height)
+        self._send()
+        return 1
+
+    def exit_image_display(self):
+        self.batch.exit_image()
+        self._send()
+
+    def image_title(self, text):
+        self.batch.image_title(text)
+
+    def set_image_palette(self, r, g, b):
+        self.image_buffer.set_palette(r, g, b)
+        self.batch.palette(self.image_buffer.palette)
+
+    def draw_image_line(self, width, line, totlines, buff):
+        """Adds one line of the camera image, as indices into the palette.
+
+        Lines go into a preallocated frame buffer. Once the last line is in, the frame is
+        encoded and queued, unless clients are still drawing earlier frames: with more than
+        CAMERA_FRAMES_IN_FLIGHT unacknowledged frames the socket is lagging, and the frame
+        is dropped along with its crosshairs rather than queued behind the others.
+        """
+        if not self.image_buffer.add_line(width, line, totlines, buff):
+            return
+        self.skip_overlay = self.frames_sent - self.frames_acked >= CAMERA_FRAMES_IN_FLIGHT
+        if self.skip_overlay:
+            self.frames_dropped += 1
+            return
+        self.frames_sent += 1
+        image = self.image_buffer
+        self.batch.image_frame(
+            self.frames_sent, image.width, image.height, self.camera_encoding, image.encode(self.camera_encoding)
+        )
+
+    def draw_line(self, x1, y1, x2, y2, colorindex):
+        """Draws part of the crosshairs over the camera image."""
+        if not self.skip_overlay:
+            self.batch.draw_line(x1, y1, x2, y2, colorindex)
+
+    def draw_lozenge(self, x, y, width, height, colorindex):
+        if not self.skip_overlay:
+            self.batch.draw_lozenge(x, y, width, height, colorindex)
+
+    def get_mouse_state(self):
+        return ((0, 0), 0)
 
     def get_input_key(self):
-        """Handles key events."""
-        pass
+        """Handles key events.
 
-        # if keycode in self.keys:
-        #     key = self.keys[keycode]
-        # elif keycode in string.ascii_letters:
-        #     key = ord(keycode)
-        # else:
-        #     key = pylink.JUNK_KEY
-
-        # # mod = 256 if modifiers['alt'] else 0
-        # keys = pylink.KeyInput(key, 0)
-
-        # return keys
+        pylink polls this once per pass of its setup loop, so it marks the end of a tracker
+        frame: everything drawn since the last call goes to the clients as one batch, and
+        the event codes, keys and sample reads queued for the tracker in the meantime run.
+        Keys arrive separately through sendKeybutton.
+        """
+        self._send()
+        self.pump()
 
     def alert_printf(self, msg):
         """Prints warnings, but doesn't kill session."""
         warnings.warn(msg, RuntimeWarning)
 
 
-def init_eyetracker(filename, eye, resolution=SCREEN_RESOLUTION, settings=TRACKING_SETTINGS):
+def tracker_commands(eye, resolution=SCREEN_RESOLUTION, settings=TRACKING_SETTINGS):
+    """Setup commands for a tracker, in the order they should be sent."""
+    commands = [
+        "screen_pixel_coords = 0 0 %d %d" % resolution,
+        "file_event_filter = LEFT,RIGHT,FIXATION,SACCADE,BLINK,MESSAGE,BUTTON",
+        "file_sample_data = LEFT,RIGHT,GAZE,AREA,GAZERES,STATUS",
+        "link_event_filter = LEFT,RIGHT,FIXATION,SACCADE,BLINK,BUTTON",
+        "link_sample_data = LEFT,RIGHT,GAZE,GAZERES,AREA,STATUS",
+        # tracking settings
+        "elcl_select_configuration = %s" % settings["elcl_configuration"],
+    ]
+
+    # pl.setCalibrationColors(settings["foreground_color"], settings["background_color"])
+    # pl.setCalibrationSounds("off", "off", "off")
+    # pl.setDriftCorrectSounds("off", "off", "off")
+
+    if eye == "BOTH":
+        commands.append("binocular_enabled = YES")
+    else:
+        commands.append("active_eye = %s" % eye)
+        commands.append("binocular_enabled = NO")
+
+    commands += [
+        "automatic_calibration_pacing = %i" % settings["automatic_calibration_pacing"],
+        "calibration_area_proportion = %f %f" % settings["calibration_area_proportion"],
+        "calibration_type = %s" % settings["calibration_type"],
+        "enable_automatic_calibration = %s" % settings["enable_automatic_calibration"],
+    ]
+    if settings["preamble_text"] is not None:
+        commands.append('add_file_preamble_text "%s"' % settings["preamble_text"])
+    commands += [
+        "pupil_size_diameter = %s" % settings["pupil_size_diameter"],
+        "saccade_acceleration_threshold = %i" % settings["saccade_acceleration_threshold"],
+        "saccade_motion_threshold = %s" % settings["saccade_motion_threshold"],
+        "saccade_pursuit_fixup = %i" % settings["saccade_pursuit_fixup"],
+        "saccade_velocity_threshold = %i" % settings["saccade_velocity_threshold"],
+        "sample_rate = %i" % settings["sample_rate"],
+        "validation_area_proportion = %f %f" % settings["validation_area_proportion"],
+    ]
+    return commands
+
+
+def init_eyetracker(
+    filename,
+    eye,
+    resolution=SCREEN_RESOLUTION,
+    settings=TRACKING_SETTINGS,
+    backend=TRACKER_BACKEND,
+    address=None,
+    progress=None,
+):
+    """
+    connects to a tracker, opens its EDF file and configures it
+    Options:
+        filename (str): EDF filename, at most 8 characters plus the .edf extension
+        eye (str): LEFT, RIGHT or BOTH
+        progress (callable, optional): called with the name of each step as it starts
+
+    """
     if len(filename) > 12:
         raise ValueError("EDF filename must be at most 12 characters long including the extension.")
 
@@ -225,70 +408,176 @@ def init_eyetracker(filename, eye, resolution=SCREEN_RESOLUTION, settings=TRACKI
 
         raise ValueError("eye must be set to LEFT, RIGHT, or BOTH.")
 
-    tracker = pl.EyeLink()
-    ## open edf
-    tracker.openDataFile(filename)
+    progress = progress or (lambda step: None)
 
-    # initialize graphics
-    tracker.setOfflineMode()
-    pl.openGraphicsEx(jsCustomDisplayInterface())
+    progress("connecting")
+    if backend == "sim":
+        # setup loops wait for key events, so they have to yield to the server
+        tracker = open_tracker(backend, eye=eye, sleep=socketio.sleep, **SIM_OPTIONS)
+    elif backend == "replay":
+        if not REPLAY_SOURCE:
+            raise ValueError("EYELINK_REPLAY must be set to the recording to replay.")
+        tracker = open_tracker(backend, eye=eye, sleep=socketio.sleep, source=REPLAY_SOURCE)
+    else:
+        tracker = open_tracker(backend, eye=eye, address=address)
 
-    # set up tracker
+    try:
+        progress("opening EDF")
+        tracker.openDataFile(filename)
+
+        # graphics are hooked up by the session before each calibration
+        tracker.setOfflineMode()
+
+        progress("configuring")
+        failed = send_commands(tracker, tracker_commands(eye, resolution, settings))
+        if failed is not None:
+            warnings.warn("Tracker setup command %r returned %d" % failed, RuntimeWarning)
+        tracker.sendMessage("DISPLAY_COORDS 0 0 %d %d" % resolution)
+    except BaseException:
+        # frees the link for the next session to try
+        close_tracker(tracker)
+        raise
 
-    pl.flushGetkeyQueue()
+    return tracker
 
-    tracker.sendMessage("screen_pixel_coords = 0 0 %d %d" % resolution)
-    tracker.sendMessage("DISPLAY_COORDS 0 0 %d %d" % resolution)
 
-    tracker.setFileEventFilter("LEFT,RIGHT,FIXATION,SACCADE,BLINK,MESSAGE,BUTTON")
-    tracker.setFileSampleFilter("LEFT,RIGHT,GAZE,AREA,GAZERES,STATUS")
-    tracker.setLinkEventFilter("LEFT,RIGHT,FIXATION,SACCADE,BLINK,BUTTON")
-    tracker.setLinkSampleFilter("LEFT,RIGHT,GAZE,GAZERES,AREA,STATUS")
+# one session per booth, keyed by name (also the Socket.IO room of its clients)
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+# session each client joined at connect time, keyed by socket id
+CLIENT_SESSIONS = {}
 
-    # tracking settings
-    tracker.sendMessage("elcl_select_configuration = %s" % settings["elcl_configuration"])
 
-    # pl.setCalibrationColors(settings["foreground_color"], settings["background_color"])
-    # pl.setCalibrationSounds("off", "off", "off")
-    # pl.setCalibrationSounds("off", "off", "off")
-    # pl.setCalibrationSounds("off", "off", "off")
-    # pl.setDriftCorrectSounds("off", "off", "off")
+class SessionNotReady(Exception):
+    pass
 
-    if eye in ("LEFT", "RIGHT"):
-        tracker.sendMessage("active_eye = %s" % eye)
 
-    if eye == "BOTH":
-        tracker.sendMessage("binocular_enabled = YES")
-    else:
-        tracker.sendMessage("active_eye = %s" % eye)
-        tracker.sendMessage("binocular_enabled = NO")
+def session_info(session):
+    return {"session": session.room, "edf_filename": session.edf_filename, "eye": session.eye}
 
-    tracker.sendMessage("automatic_calibration_pacing = %i" % settings["automatic_calibration_pacing"])
 
-    tracker.sendMessage("calibration_area_proportion %f %f" % settings["calibration_area_proportion"])
+def session_filename(room, name=None):
+    """File name in DATA_DIR for a session's data: the session name, the current time and `name`."""
+    parts = [room, time.strftime("%Y%m%d-%H%M%S")] + ([name] if name else [])
+    return secure_filename("_".join(parts))
 
-    tracker.sendMessage("calibration_type = %s" % settings["calibration_type"])
-    tracker.sendMessage("enable_automatic_calibration = %s" % settings["enable_automatic_calibration"])
-    if settings["preamble_text"] is not None:
-        tracker.sendMessage("add_file_preamble_text %s" % '"' + settings["preamble_text"] + '"')
-    tracker.sendMessage("pupil_size_diameter = %s" % settings["pupil_size_diameter"])
-    tracker.sendMessage("saccade_acceleration_threshold = %i" % settings["saccade_acceleration_threshold"])
-    tracker.sendMessage("saccade_motion_threshold = %i" % settings["saccade_motion_threshold"])
-    tracker.sendMessage("saccade_pursuit_fixup = %i" % settings["saccade_pursuit_fixup"])
-    tracker.sendMessage("saccade_velocity_threshold = %i" % settings["saccade_velocity_threshold"])
-    tracker.sendMessage("sample_rate = %i" % settings["sample_rate"])
-    tracker.sendMessage("validation_area_proportion %f %f" % settings["validation_area_proportion"])
 
-    return tracker
+def start_session(session):
+    """Connects and configures a session's tracker, reporting progress to the session's room."""
+
+    def progress(step):
+        log.info("Session %s: %s", session.room, step)
+        socketio.emit("sessionProgress", {"session": session.room, "step": step}, to=session.room)
+
+    def connect():
+        return init_eyetracker(
+            session.edf_filename,
+            session.eye,
+            settings=session.settings,
+            address=TRACKER_ADDRESSES.get(session.room),
+            progress=progress,
+        )
+
+    try:
+        # the tracker is created on the session's actor thread, which makes every call on it
+        tracker = session.open(connect)
+    except Exception as e:
+        # pylink raises RuntimeError when the Host PC can't be reached
+        session.fail(str(e))
+        socketio.emit("sessionError", {"session": session.room, "error": str(e)}, to=session.room)
+        return
+
+    session.attach(tracker)
+    socketio.emit("sessionReady", session_info(session), to=session.room)
 
 
-tracker = init_eyetracker("TEST.edf", "BOTH")
+def client_session(sid):
+    """The ready session of a client, raises SessionNotReady before its tracker is set up."""
+    session = SESSIONS.get(CLIENT_SESSIONS.get(sid))
+    if session is None or not session.ready:
+        raise SessionNotReady("The EyeLink session is not ready, call open_session first.")
+    return session
+
+
+@socketio.on_error_default
+def handle_error(e):
+    if isinstance(e, SessionNotReady):
+        log.warning("Ignored %s: %s", request.event["message"], e)
+        return {"ok": False, "error": str(e)}
+    raise e
+
+
+# monitor profile picked by each client at connect time, keyed by socket id
+CLIENT_PROFILES = {}
+# offset between each client's clock and the server's, keyed by socket id
+CLIENT_CLOCKS = {}
+
+
+def client_profile(sid):
+    return CLIENT_PROFILES.get(sid) or MonitorProfile.from_spec(None)
 
 
 @socketio.on("connect")
-def handle_connect():
-    print("Client connected")
-    socketio.emit("server_response", {"data": "Connected"})
+def handle_connect(auth=None):
+    log.info("Client %s connected", request.sid)
+    auth = auth or {}
+    room = auth.get("session", "default")
+    if not isinstance(room, str) or not room:
+        raise ConnectionRefusedError("session must be a non-empty string.")
+    try:
+        profile = MonitorProfile.from_spec(auth.get("monitor"))
+    except ValueError as e:
+        raise ConnectionRefusedError(str(e))
+
+    # the tracker is only connected once a client asks for it with open_session
+    join_room(room)
+    CLIENT_SESSIONS[request.sid] = room
+    CLIENT_PROFILES[request.sid] = profile
+    CLIENT_CLOCKS[request.sid] = ClientClock()
+    socketio.emit("server_response", {"data": "Connected", "session": room}, to=request.sid)
+
+
+@socketio.on("open_session")
+def handle_open_session(data=None):
+    """
+    opens the client's session in the background unless it is already open or opening.
+    Progress goes to the session's room as sessionProgress, then sessionReady or sessionError.
+    A session that failed to open is retried. Clients joining an open session get
+    sessionReady right away, with the EDF filename and eye it was opened with. A session
+    that is still ending can't be joined, the client gets sessionError and can open a new
+    one once sessionEnded arrives.
+    Options:
+        edf_filename (str): EDF filename on the Host PC. Defaults to TEST.edf
+        eye (str): LEFT, RIGHT or BOTH. Defaults to BOTH
+
+    """
+    data = data or {}
+    room = CLIENT_SESSIONS[request.sid]
+    with SESSIONS_LOCK:
+        session = SESSIONS.get(room)
+        if session is None or session.state in ("error", "ended"):
+            session = Session(
+                room,
+                jsCustomDisplayInterface(room),
+                data.get("edf_filename", "TEST.edf"),
+                data.get("eye", "BOTH"),
+                TRACKING_SETTINGS,
+                sample_log=os.path.join(DATA_DIR, session_filename(room)) if SAMPLE_LOG else None,
+            )
+            SESSIONS[room] = session
+            socketio.start_background_task(start_session, session)
+        # a session that is ending can't be joined
+        ending = session.state == "ending"
+        if not ending:
+            session.clients.add(request.sid)
+
+    if ending:
+        error = "Session %s is ending, open it again once it has ended." % room
+        socketio.emit("sessionError", {"session": room, "error": error}, to=request.sid)
+        return {"ok": False, "state": "ending", "error": error}
+    if session.ready:
+        socketio.emit("sessionReady", session_info(session), to=request.sid)
+    return {"ok": True, "state": session.state}
 
 
 @socketio.on("key_event")
@@ -296,16 +585,15 @@ def handle_key_event(keycode):
 
     if keycode in KEYS:
         key = KEYS[keycode]
-        print(keycode, KEYS[keycode])
     elif keycode in string.ascii_letters:
         key = ord(keycode)
     else:
         key = pylink.JUNK_KEY
 
     # return pylink.KeyInput(key, 0)
-    print(f"Received key event: {keycode,key}")
+    log.debug("Received key event: %s %s", keycode, key)
     # tracker.getCustomDisplay().get_input_key(key)
-    tracker.sendKeybutton(key, 0, pl.KB_PRESS)
+    client_session(request.sid).send_key(key, 0, pl.KB_PRESS)
     # tracker.echo_key()
     # global LATEST_KEY_RECVD
     # LATEST_KEY_RECVD = key
@@ -313,131 +601,770 @@ def handle_key_event(keycode):
 
 
 @socketio.on("startRecording")
-def start_recording():
-    print(f"Starting recording at {time.time()}")
-    tracker.startRecording(1, 1, 1, 1)
+def start_recording(data=None):
+    """
+    starts recording and acknowledges once samples are coming in, so the client doesn't
+    have to wait a fixed time before sending event codes
+    Options:
+        continuous (bool): keep recording if a block is already running, for continuous
+            recording where trials are marked with TRIALID/TRIAL_RESULT messages
+
+    """
+    log.debug("Starting recording")
+    keep = bool((data or {}).get("continuous", False))
+    try:
+        started = client_session(request.sid).start_recording(keep).result(RECORDING_START_TIMEOUT)
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "started": started}
 
 
 @socketio.on("stopRecording")
 def stop_recording():
-    print(f"Stopping recording at {time.time()}")
-    tracker.stopRecording()
+    log.debug("Stopping recording")
+    client_session(request.sid).stop_recording()
 
 
 @socketio.on("calibrate")
-def calibrate():
-    print("Starting calibration")
-    tracker.doTrackerSetup()
+def calibrate(data=None):
+    log.info("Starting calibration")
+    session = client_session(request.sid)
+    camera_encoding = (data or {}).get("camera_encoding")
+    if camera_encoding is not None:
+        try:
+            session.display.set_camera_encoding(camera_encoding)
+        except ValueError as e:
+            return {"ok": False, "error": str(e)}
+    # runs on the session's worker, the handler returns right away
+    session.calibrate()
+    return {"ok": True}
+
+
+@socketio.on("camera_ack")
+def camera_ack(frame):
+    session = SESSIONS.get(CLIENT_SESSIONS.get(request.sid))
+    if session is not None:
+        session.display.ack_frame(frame)
 
 
 @socketio.on("drift_correct")
-def drift_correct():
-    print("Starting drift correction")
-    position = (int(round(i / 2)) for i in SCREEN_RESOLUTION)
-    tracker.doDriftCorrect(*position, 1, 1)
-    tracker.applyDriftCorrect()
+def drift_correct(data=None):
+    log.info("Starting drift correction")
+    x, y = (int(round(i)) for i in client_profile(request.sid).center)
+    client_session(request.sid).drift_correct(x, y)
 
 
 @socketio.on("event")
 def send_synced_event(data, keyword="SYNC"):
+    received = time.perf_counter()
     code = data.get("code")
-    print(f"Received event: {code}")
     message = keyword + " " + str(code)
-    tracker.sendMessage(message)
+    # stamp the message with when the client sent it, the EDF offset then covers network and handling delay
+    sent = CLIENT_CLOCKS[request.sid].sent_at(data.get("t"), received)
+    client_session(request.sid).messages.message(message, sent)
+    log.debug("Received event: %s", code)
 
     # Handle different events here
 
 
+@socketio.on("trial_start")
+def trial_start(data):
+    # Data Viewer splits a recording into trials at TRIALID messages
+    send_synced_event({"code": data.get("id"), "t": data.get("t")}, keyword="TRIALID")
+
+
+@socketio.on("trial_end")
+def trial_end(data):
+    send_synced_event({"code": data.get("result", 0), "t": data.get("t")}, keyword="TRIAL_RESULT")
+
+
 @socketio.on("trial_status")
 def send_trial_status(data):
     status = data.get("status")
-    print(f"Received trial status: {status}")
-    tracker.sendCommand("record_status_message '%s'" % status)
+    client_session(request.sid).messages.record_status(status)
+    log.debug("Received trial status: %s", status)
 
 
-def sleep(duration):
-    start_time = time.perf_counter()
-    while (time.perf_counter() - start_time) < duration:
-        pass
+def tracker_time(session):
+    """Current tracker time estimate in ms."""
+    return session.tracker_time()
+
+
+@socketio.on("clock_ping")
+def clock_ping(data):
+    """
+    one round of the NTP-style clock sync, replies with the server receive and send times
+    and the tracker time, so the client can also map tracker timestamps onto its clock
+    (None until the session's tracker is ready)
+
+    """
+    received = server_ms()
+    session = SESSIONS.get(CLIENT_SESSIONS.get(request.sid))
+    tracker_now = tracker_time(session) if session is not None and session.ready else None
+    return {"t0": data.get("t0"), "t1": received, "tracker": tracker_now, "t2": server_ms()}
+
+
+@socketio.on("clock_sync")
+def clock_sync(data):
+    CLIENT_CLOCKS[request.sid].update(data["offset"], data["rtt"], data.get("roundTrips", ()))
+
+
+@socketio.on("clock_stats")
+def clock_stats():
+    return CLIENT_CLOCKS[request.sid].summary()
 
 
-def gaze_data():
+def gaze_data(tracker):
     """
 
-    Contains a tuple with gaze data. If both eyes are being tracked the tuple contains two
-        tuples. Each tuple of gaze data contains an x and y value in pixels.
+    Contains a tuple with the left and right eye gaze. Each tuple of gaze data contains an
+        x and y value in pixels, (None, None) for an eye that isn't tracked.
 
     """
     sample = tracker.getNewestSample()
+    if not sample:
+        return ((None, None), (None, None))
+
+    # getEyeUsed returns an eye code, not the LEFT/RIGHT/BOTH string
+    eye = tracker.getEyeUsed()
+    left = sample.getLeftEye().getGaze() if eye != RIGHT_EYE else (None, None)
+    right = sample.getRightEye().getGaze() if eye != LEFT_EYE else (None, None)
+    return (left, right)
 
-    if tracker.getEyeUsed() == "LEFT":
-        return sample.getLeftEye().getGaze() if sample else (None, None)
-    elif tracker.getEyeUsed() == "RIGHT":
-        return sample.getRightEye().getGaze() if sample else (None, None)
-    else:
-        if sample:
-            return (sample.getLeftEye().getGaze(), sample.getRightEye().getGaze())
-        else:
-            return ((None, None), (None, None))
 
+def _gaze_or_nan(gaze):
+    if gaze is None or None in gaze or pylink.MISSING_DATA in gaze:
+        return (np.nan, np.nan)
+    return gaze
 
-def check_eyetracker(max_dist):
+
+def check_eyetracker(tracker, policy):
     """
-    gets realtime eyetracking data and determines whether to reject the trial
+    gets the newest realtime eyetracking sample and determines whether to reject the trial
     Options:
+        tracker: tracker to read the sample from
+        policy (RejectionPolicy): when to reject, timed with the tracker clock
 
     """
 
-    left, right = gaze_data()  # this used to be gaze_data_both
-
-    if left is not None and right is not None:
-        lx, ly = left
-        rx, ry = right
-        x = np.nanmean([lx, rx])
-        y = np.nanmean([ly, ry])
-    elif left is not None:
-        x, y = left
-    elif right is not None:
-        x, y = right
-    else:  # if no eye data do not reject
-        return
+    left, right = gaze_data(tracker)  # this used to be gaze_data_both
+    samples = np.array([[*_gaze_or_nan(left), *_gaze_or_nan(right)]])
+    check_samples(np.array([tracker.trackerTime()], dtype=float), samples, policy)
+
 
-    # get the x,y pixel values relative to the center of the screen
-    winx = SCREEN_RESOLUTION[0] / 2
-    winy = SCREEN_RESOLUTION[1] / 2
+def check_samples(times, samples, policy):
+    """
+    checks a block of gaze samples at once and raises on the first one that rejects the
+    trial under the policy. With the default policy both eyes are averaged and samples
+    with no eye data never reject.
+    Options:
+        times (np.ndarray): (N,) sample times in ms
+        samples (np.ndarray): (N, 4) binocular gaze, left x, left y, right x, right y
+        policy (RejectionPolicy): when to reject
 
-    x -= winx
-    y -= winy
+    """
+    rejection = policy.check(times, samples)
+    if rejection is not None:
+        reason, t, x, y = rejection
+        raise EyeMovementError("Eye Movement Detected", x, y, reason, t)
 
-    dist = np.linalg.norm(np.array([x, y]))
 
-    if dist > max_dist:
+# polling interval of the original getNewestSample check
+REALTIME_SRATE = 0.05
+# how often queued link samples are drained in streaming mode; every sample is still checked
+STREAM_SRATE = 0.005
+# how often online event detection reads the link, so saccade onsets arrive within a few ms
+DETECTION_SRATE = 0.001
 
-        raise EyeMovementError("Eye Movement Detected", x, y)
 
+class SampleTask:
+    """Base for per-client background tasks that read every link sample recorded while
+    they run.
+
+    Subclasses implement `process`, which gets each new block of samples from the client's
+    session, and can override `finish`. Tasks wait between reads with ``socketio.sleep`` so the
+    server keeps handling ``event``/``trial_status`` messages while they run. A client has
+    at most one task of each kind, kept in the subclass's `registry`.
+    """
+
+    registry = None
+    interval = STREAM_SRATE
+
+    def __init__(self, sid, duration=None):
+        self.sid = sid
+        self.session = client_session(sid)
+        self.duration = duration
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def join(self):
+        """Waits until the task has stopped reading samples."""
+        self.done.wait()
+
+    def start(self):
+        stop_task(self.registry, self.sid)
+        self.registry[self.sid] = self
+        socketio.start_background_task(self.run)
+
+    def emit(self, events):
+        for event, data in events:
+            socketio.emit(event, data, to=self.sid)
+
+    def read(self):
+        """Samples since the last read, counting the ones the ring overwrote before this task read them."""
+        cursor = self.cursor
+        samples, self.cursor = self.session.read_new_samples(cursor)
+        if self.cursor - cursor > len(samples):
+            METRICS.count("samples_dropped." + type(self).__name__, self.cursor - cursor - len(samples))
+        return samples
+
+    def step(self):
+        samples = self.read()
+        if len(samples):
+            self.process(samples)
+
+    def process(self, samples):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            if self.registry.get(self.sid) is self:
+                del self.registry[self.sid]
+            self.done.set()
+
+    def _run(self):
+        # only samples recorded after the task started count
+        self.cursor = self.session.add_reader()
+
+        start_time = time.perf_counter()
+        next_check = start_time
+        step = METRICS.timed("loop." + type(self).__name__, self.step)
+        try:
+            while not self.cancelled and (self.duration is None or (time.perf_counter() - start_time) < self.duration):
+                step()
+
+                next_check += self.interval
+                socketio.sleep(max(0, next_check - time.perf_counter()))
+        finally:
+            self.session.remove_reader()
+            self.finish()
 
-REALTIME_SRATE = 0.05
+
+def stop_task(registry, sid):
+    """Cancels a client's task, returns it (None if there was none) so it can be joined."""
+    task = registry.pop(sid, None)
+    if task is not None:
+        task.cancel()
+    return task
+
+
+# fixation monitors currently running, keyed by the socket id of the client that started them
+REALTIME_TASKS = {}
+
+
+class RealtimeMonitor(SampleTask):
+    """Fixation monitor for a single client, cancelled early with ``stop_realtime_eyetrack``.
+
+    Once the rejection policy rejects the trial (by default, on the first sample outside the
+    fixation window), recording stops and the client gets ``eyeMovementDetected``.
+    """
+
+    registry = REALTIME_TASKS
+
+    def __init__(self, sid, duration, policy, mode="stream"):
+        if mode not in ("stream", "poll"):
+            raise ValueError("mode must be set to stream or poll.")
+
+        super().__init__(sid, duration)
+        self.policy = policy
+        self.mode = mode
+        if mode == "poll":
+            self.interval = REALTIME_SRATE
+
+    def step(self):
+        try:
+            if self.mode == "poll":
+                self.session.call(check_eyetracker, self.policy)
+            else:
+                super().step()
+        except EyeMovementError as e:
+            self.session.stop_recording()
+            socketio.emit(
+                "eyeMovementDetected", {"x": e.x, "y": e.y, "reason": e.reason, "time": e.time}, to=self.sid
+            )
+            self.cancel()
+
+    def process(self, samples):
+        check_samples(samples[:, TIME], samples[:, LEFT_X:], self.policy)
+
+    def finish(self):
+        log.debug("Stopping real-time eyetracking")
 
 
 @socketio.on("realtime_eyetrack")
 def realtime_eyetrack(data):
-    print("Starting real-time eyetracking")
+    log.debug("Starting real-time eyetracking")
+    # duration is sent from jsPsych in milliseconds
+    duration = data.get("duration") / 1000
+    profile = client_profile(request.sid)
+    eyeMaxDist = profile.threshold(data.get("eyeMaxDist", 1.25))
+    mode = data.get("mode", "stream")
+    try:
+        policy = rejection_policy(eyeMaxDist, profile.center, data.get("policy"))
+        monitor = RealtimeMonitor(request.sid, duration, policy, mode)
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}
+
+    # a client only ever has one monitor running
+    monitor.start()
+    return {"ok": True}
+
+
+@socketio.on("stop_realtime_eyetrack")
+def stop_realtime_eyetrack():
+    log.debug("Cancelling real-time eyetracking")
+    stop_task(REALTIME_TASKS, request.sid)
+
+
+# window samplers, one per client, keyed by socket id
+WINDOW_MONITORS = {}
+
+
+class WindowMonitor(SampleTask):
+    """Checks every link sample against a client's monitoring windows (see windows.MonitorWindows).
+
+    One sampler per client runs from the first ``start_window`` until the client leaves or
+    its session ends, while the windows themselves are started, paused, updated and
+    stopped by ID. A window that rejects sends ``windowViolation`` and is paused until it
+    is resumed; recording only stops if the window was started with ``stop_recording``.
+    """
+
+    registry = WINDOW_MONITORS
+
+    def __init__(self, sid):
+        super().__init__(sid)
+        self.windows = MonitorWindows()
+        # window options by ID, so updates can change some of them; only used by the handlers
+        self.specs = {}
+
+    def step(self):
+        samples = self.read()
+        if len(samples):
+            self.process(samples)
+        else:
+            # housekeeping: read the clock in the sample-read lane, not the event codes' one
+            self.windows.idle(self.session.call(lambda tracker: tracker.trackerTime()))
+
+    def process(self, samples):
+        for window, reason, t, x, y in self.windows.check(samples[:, TIME], samples[:, LEFT_X:]):
+            if window.stop_recording:
+                self.session.stop_recording()
+            socketio.emit(
+                "windowViolation", {"id": window.id, "x": x, "y": y, "reason": reason, "time": t}, to=self.sid
+            )
+
+
+def client_tracker_time(sid, session, client_ms):
+    """Tracker time (ms) at which the client sent a message stamped with its clock"""
+    received = time.perf_counter()
+    sent = CLIENT_CLOCKS[sid].sent_at(client_ms, received)
+    return tracker_time(session) - (received - sent) * 1000
+
+
+def change_window(data, action):
+    """schedules a change of a client's monitoring window at the time the client sent it"""
+    window_id = data.get("id")
+    session = client_session(request.sid)
+    monitor = WINDOW_MONITORS.get(request.sid)
+    if monitor is None:
+        if action != "start":
+            return {"ok": False, "error": "No monitoring windows have been started."}
+        monitor = WindowMonitor(request.sid)
+        monitor.start()
+    if action != "start" and window_id not in monitor.specs:
+        return {"ok": False, "error": "No monitoring window %r." % window_id}
+
+    window = None
+    if action in ("start", "update"):
+        spec = {} if action == "start" else dict(monitor.specs[window_id])
+        spec.update((key, data[key]) for key in ("center", "eyeMaxDist", "policy", "stop_recording") if key in data)
+        profile = client_profile(request.sid)
+        try:
+            policy = rejection_policy(
+                profile.threshold(spec.get("eyeMaxDist", 1.25)), spec.get("center") or profile.center, spec.get("policy")
+            )
+        except (ValueError, TypeError) as e:
+            return {"ok": False, "error": str(e)}
+        window = Window(window_id, policy, bool(spec.get("stop_recording", False)))
+        monitor.specs[window_id] = spec
+    elif action == "stop":
+        del monitor.specs[window_id]
+
+    t = client_tracker_time(request.sid, session, data.get("t"))
+    monitor.windows.schedule(t, window_id, action, window)
+    return {"ok": True}
+
+
+@socketio.on("start_window")
+def start_window(data):
+    return change_window(data, "start")
+
+
+@socketio.on("pause_window")
+def pause_window(data):
+    return change_window(data, "pause")
+
+
+@socketio.on("resume_window")
+def resume_window(data):
+    return change_window(data, "resume")
+
+
+@socketio.on("update_window")
+def update_window(data):
+    return change_window(data, "update")
+
+
+@socketio.on("stop_window")
+def stop_window(data):
+    return change_window(data, "stop")
+
+
+@socketio.on("clear_windows")
+def clear_windows(data=None):
+    """stops every monitoring window, the sampler keeps running for the next ones"""
+    monitor = WINDOW_MONITORS.get(request.sid)
+    if monitor is not None:
+        for window_id in list(monitor.specs):
+            change_window({"id": window_id, "t": (data or {}).get("t")}, "stop")
+
+
+# AOI trackers currently running, keyed by socket id
+AOI_TASKS = {}
+
+
+class AoiMonitor(SampleTask):
+    """Hit-tests every link sample against a client's areas of interest.
+
+    Emits ``aoiEnter``, ``aoiExit`` and ``aoiDwell`` to the client as gaze moves between
+    AOIs, until ``clear_aois`` is received or the optional duration runs out.
+    """
+
+    registry = AOI_TASKS
+
+    def __init__(self, sid, aois, duration=None):
+        super().__init__(sid, duration)
+        self.aois = aois
+        self.last_time = None
+
+    def process(self, samples):
+        self.last_time = samples[-1, TIME]
+        self.emit(self.aois.update(samples[:, TIME], combine_eyes(samples[:, LEFT_X:])))
+
+    def finish(self):
+        if self.last_time is not None:
+            self.emit(self.aois.close(self.last_time))
+
+
+@socketio.on("set_aois")
+def set_aois(data):
+    log.debug("Starting AOI tracking")
+    try:
+        aois = AoiTracker(data.get("aois", []), default_dwell=data.get("dwell"))
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}
+
+    # duration is sent from jsPsych in milliseconds
+    duration = data.get("duration")
+    AoiMonitor(request.sid, aois, duration / 1000 if duration is not None else None).start()
+    return {"ok": True}
+
+
+@socketio.on("clear_aois")
+def clear_aois():
+    log.debug("Stopping AOI tracking")
+    stop_task(AOI_TASKS, request.sid)
+
+
+# online event detectors currently running, keyed by socket id
+DETECTION_TASKS = {}
+
+
+class DetectionMonitor(SampleTask):
+    """Runs an online saccade/fixation detector over every link sample and pushes the
+    events the client asked for as soon as they are detected.
+    """
+
+    registry = DETECTION_TASKS
+    # detection latency is the point of this task, so read the link more often
+    interval = DETECTION_SRATE
+
+    def __init__(self, sid, detector, events, duration=None):
+        super().__init__(sid, duration)
+        self.detector = detector
+        self.events = events
+
+    def process(self, samples):
+        events = self.detector.update_block(samples[:, TIME], combine_eyes(samples[:, LEFT_X:]))
+        self.emit((event, data) for event, data in events if event in self.events)
+
+
+@socketio.on("start_event_detection")
+def start_event_detection(data):
+    log.debug("Starting online event detection")
+    profile = client_profile(request.sid)
+    method = data.get("method", "ivt")
+    events = data.get("events", EVENTS)
+    if method not in DETECTORS:
+        return {"ok": False, "error": "method must be one of %s." % ", ".join(DETECTORS)}
+    if not set(events) <= set(EVENTS):
+        return {"ok": False, "error": "events must be a subset of %s." % ", ".join(EVENTS)}
+
+    if method == "ivt":
+        detector = VelocityDetector(
+            profile,
+            velocity_threshold=data.get("velocity_threshold", TRACKING_SETTINGS["saccade_velocity_threshold"]),
+            acceleration_threshold=data.get("acceleration_threshold", TRACKING_SETTINGS["saccade_acceleration_threshold"]),
+        )
+    else:
+        detector = DispersionDetector(profile, data.get("dispersion", 1.0), data.get("min_duration", 100))
+
+    # duration is sent from jsPsych in milliseconds
     duration = data.get("duration")
-    eyeMaxDist = deg2pix(data.get("eyeMaxDist", 1.25))
-    start_time = time.perf_counter()
+    DetectionMonitor(request.sid, detector, frozenset(events), duration / 1000 if duration is not None else None).start()
+    return {"ok": True}
+
+
+@socketio.on("stop_event_detection")
+def stop_event_detection():
+    log.debug("Stopping online event detection")
+    stop_task(DETECTION_TASKS, request.sid)
+
+
+# per-trial gaze statistics being collected, keyed by socket id
+TRIAL_STATS = {}
+
+
+class TrialStatsTask(SampleTask):
+    """Collects gaze quality statistics over a trial (see gaze.GazeQuality), until the
+    client asks for them with ``stop_trial_stats``.
+    """
+
+    registry = TRIAL_STATS
+
+    def __init__(self, sid, quality):
+        super().__init__(sid)
+        self.quality = quality
+        self.done = threading.Event()
+
+    def process(self, samples):
+        self.quality.add(samples[:, TIME], samples[:, LEFT_X:])
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            self.done.set()
+
+
+@socketio.on("start_trial_stats")
+def start_trial_stats(data=None):
+    data = data or {}
+    profile = client_profile(request.sid)
+    detector = VelocityDetector(
+        profile,
+        velocity_threshold=data.get("velocity_threshold", TRACKING_SETTINGS["saccade_velocity_threshold"]),
+        acceleration_threshold=data.get("acceleration_threshold", TRACKING_SETTINGS["saccade_acceleration_threshold"]),
+    )
+    TrialStatsTask(request.sid, GazeQuality(profile.center, detector)).start()
+    return {"ok": True}
+
+
+@socketio.on("stop_trial_stats")
+def stop_trial_stats():
+    """stops collecting trial statistics and returns them"""
+    task = TRIAL_STATS.pop(request.sid, None)
+    if task is None:
+        return {"ok": False, "error": "No trial statistics are being collected."}
+    task.cancel()
+    # the task thread is at most one interval from noticing, then the rest of the link is read here
+    task.done.wait(1.0)
+    task.step()
+    return {"ok": True, "stats": task.quality.summary()}
+
+
+# live gaze subscriptions, keyed by socket id
+GAZE_STREAMS = {}
+
+
+class GazeStream(SampleTask):
+    """Pushes link samples to a client as packed binary ``gazeFrame`` messages, `rate`
+    frames per second, downsampled so the socket isn't flooded at the link sample rate.
+    """
+
+    registry = GAZE_STREAMS
+
+    def __init__(self, sid, rate, downsample):
+        super().__init__(sid)
+        self.interval = 1 / rate
+        self.downsample = downsample
+        self.seq = 0
+
+    def process(self, samples):
+        samples = self.downsample(samples)
+        if len(samples):
+            socketio.emit("gazeFrame", pack_frame(self.seq, samples), to=self.sid)
+            self.seq += 1
+
+
+@socketio.on("gaze_subscribe")
+def gaze_subscribe(data):
+    log.debug("Starting gaze stream")
+    rate = data.get("rate", 30)
+    if not 0 < rate <= 1000:
+        return {"ok": False, "error": "rate must be between 0 and 1000 frames per second."}
     try:
-        while (time.perf_counter() - start_time) < duration:
-            check_eyetracker(eyeMaxDist)
+        downsample = Downsampler(data.get("policy", "decimate"), data.get("factor", 1))
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}
+
+    GazeStream(request.sid, rate, downsample).start()
+    return {"ok": True}
+
+
+@socketio.on("gaze_unsubscribe")
+def gaze_unsubscribe():
+    log.debug("Stopping gaze stream")
+    stop_task(GAZE_STREAMS, request.sid)
 
-            sleep(REALTIME_SRATE)
-    except EyeMovementError as e:
-        tracker.stopRecording()
-        emit("eyeMovementDetected", {"x": e.x, "y": e.y})
-    print("Stopping real-time eyetracking")
+
+# every kind of per-client task, stopped when the client leaves or its session ends
+TASK_REGISTRIES = (REALTIME_TASKS, WINDOW_MONITORS, AOI_TASKS, DETECTION_TASKS, TRIAL_STATS, GAZE_STREAMS)
+
+
+@socketio.on("end_session")
+def handle_end_session():
+    """
+    ends the client's session: stops the realtime tasks of its clients, closes the EDF file
+    on the Host PC, copies it into DATA_DIR and disconnects the tracker. Progress goes to the
+    session's room as edfProgress (bytes received so far), then sessionEnded with the file's
+    name, size and download url, or sessionError. The next open_session opens a new session.
+
+    """
+    session = client_session(request.sid)
+    # from here on nobody can join it (see open_session)
+    session.state = "ending"
+    tasks = [stop_task(registry, sid) for sid in list(session.clients) for registry in TASK_REGISTRIES]
+
+    # one file per session, the EDF filename alone is the same for every participant
+    name = session_filename(session.room, session.edf_filename)
+
+    def progress(received):
+        socketio.emit("edfProgress", {"session": session.room, "received": received}, to=session.room)
+
+    def ended(future):
+        with SESSIONS_LOCK:
+            if SESSIONS.get(session.room) is session:
+                del SESSIONS[session.room]
+        session.actor.stop(wait=False)
+        if future.exception() is not None:
+            error = str(future.exception())
+            socketio.emit("sessionError", {"session": session.room, "error": error}, to=session.room)
+            return
+        log.info("Session %s: received %s", session.room, name)
+        info = dict(session_info(session), file=name, size=future.result(), url="/edf/" + name)
+        socketio.emit("sessionEnded", info, to=session.room)
+
+    def end():
+        # tasks still reading samples would find the actor stopped once the session has ended
+        for task in tasks:
+            if task is not None:
+                task.join()
+        session.end(os.path.join(DATA_DIR, name), progress).add_done_callback(ended)
+
+    log.info("Session %s: ending", session.room)
+    # the recorder and tasks may be waiting behind a long actor call, which the handler mustn't
+    socketio.start_background_task(end)
+    return {"ok": True}
+
+
+@app.route("/edf/<path:name>")
+def download_edf(name):
+    # streamed from disk in chunks
+    return send_from_directory(DATA_DIR, name, as_attachment=True)
+
+
+def session_status(session):
+    """Gauges of a session for /metrics: state, queue depths, sample counts and link status."""
+    status = {
+        "state": session.state,
+        "recording": session.recording,
+        "clients": len(session.clients),
+        "actor_queue": session.actor.queue.qsize(),
+        "samples_received": session.samples.count,
+        "samples_missing": session.samples_missing,
+        "samples_overwritten": session.samples.dropped,
+    }
+    if session.messages is not None:
+        status["message_delay_ms"] = session.messages.delay.summary()
+        status["status_pending"] = len(session.messages.status)
+    if session.recorder is not None:
+        recorder = session.recorder
+        status["recorder"] = {"written": recorder.written, "lost": recorder.lost, "pending": len(recorder.pending)}
+    if session.ready:
+        status["link"] = session.link_status()
+    return status
+
+
+def server_status():
+    status = METRICS.snapshot()
+    status["clients"] = len(CLIENT_SESSIONS)
+    # running tasks of each kind
+    status["tasks"] = dict(Counter(type(task).__name__ for tasks in TASK_REGISTRIES for task in list(tasks.values())))
+    status["sessions"] = {room: session_status(session) for room, session in list(SESSIONS.items())}
+    return status
+
+
+@app.route("/metrics")
+def metrics():
+    return jsonify(server_status())
+
+
+def status_loop():
+    """Sends serverStatus to every client every STATUS_INTERVAL seconds."""
+    while True:
+        socketio.sleep(STATUS_INTERVAL)
+        try:
+            socketio.emit("serverStatus", server_status())
+        except Exception:
+            log.exception("Sending serverStatus failed")
+
+
+if STATUS_INTERVAL > 0:
+    socketio.start_background_task(status_loop)
+
+
+@socketio.on("disconnect")
+def handle_disconnect(reason=None):
+    log.info("Client %s disconnected", request.sid)
+    for registry in TASK_REGISTRIES:
+        stop_task(registry, request.sid)
+    CLIENT_PROFILES.pop(request.sid, None)
+    CLIENT_CLOCKS.pop(request.sid, None)
+    # the session and its tracker stay open for the booth's next client
+    room = CLIENT_SESSIONS.pop(request.sid, None)
+    if room in SESSIONS:
+        SESSIONS[room].clients.discard(request.sid)
 
 
 if __name__ == "__main__":
-    # try:
-    socketio.run(app, port=5001, debug=True)
-    # except:
-    #     tracker.closeDataFile()
+    # the threading server is Werkzeug's, which is fine on the lab network
+    socketio.run(app, port=int(os.environ.get("EYELINK_PORT", 5001)), debug=True, allow_unsafe_werkzeug=True)
@@ -0,0 +1,613 @@
+import glob
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pylink
+
+from messages import message_time
+from samples import SAMPLE_COLUMNS, TIME, LEFT_X, LEFT_Y, RIGHT_X, RIGHT_Y
+
+# pylink keeps a single link per process: its module-level calls (openGraphicsEx, the
+# custom display, getEYELINK) act on whichever tracker connected last, so a server process
+# drives at most one real tracker at a time; held while it is connected (see open_tracker)
+PYLINK_LINK = threading.Lock()
+
+# eye codes returned by EyeLink.getEyeUsed
+LEFT_EYE, RIGHT_EYE, BINOCULAR = 0, 1, 2
+EYES = {"LEFT": LEFT_EYE, "RIGHT": RIGHT_EYE, "BOTH": BINOCULAR}
+# sample columns of each eye written to the simulator's data file
+_ASC_EYES = {
+    LEFT_EYE: ((LEFT_X, LEFT_Y),),
+    RIGHT_EYE: ((RIGHT_X, RIGHT_Y),),
+    BINOCULAR: ((LEFT_X, LEFT_Y), (RIGHT_X, RIGHT_Y)),
+}
+
+
+class GazeSimulator:
+    """Generates realistic binocular gaze for a fixation task.
+
+    Gaze alternates between fixations (with drift, tremor noise and a small vergence offset
+    between the eyes) and saccades with a main-sequence duration and a minimum-jerk
+    velocity profile. Most saccades go back toward the screen center, some wander off
+    (the ones realtime monitoring should catch), and now and then the eyes blink and the
+    samples go missing. Everything comes from one seeded RNG, so a seed always gives the
+    same gaze.
+    """
+
+    def __init__(self, resolution=(1920, 1080), px_per_deg=38, noise=0.6, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.resolution = resolution
+        self.noise = noise  # sample-to-sample noise, px RMS
+        self.center = np.array(resolution, dtype=float) / 2
+        self.px_per_deg = px_per_deg
+        self.pos = self.center.copy()
+        self.vergence = self.rng.normal(0, 3, 2)
+        self.segment = None  # (kind, start time, end time, params)
+
+    def _next_segment(self, t):
+        rng = self.rng
+        kind = self.segment[0] if self.segment else "saccade"
+
+        if kind != "fixation":
+            # every saccade or blink lands in a fixation
+            duration = 80 + rng.gamma(2.5, 90)
+            self.segment = ("fixation", t, t + duration, {"start": self.pos.copy(), "drift": rng.normal(0, 0.01, 2)})
+        elif rng.random() < 0.08:
+            self.segment = ("blink", t, t + rng.uniform(80, 300), {})
+        else:
+            if rng.random() < 0.75:
+                # corrective saccade back toward the center
+                target = self.center + rng.normal(0, 0.4 * self.px_per_deg, 2)
+            else:
+                amplitude = rng.gamma(2, 1.5) * self.px_per_deg
+                angle = rng.uniform(0, 2 * math.pi)
+                target = self.pos + amplitude * np.array((math.cos(angle), math.sin(angle)))
+            target = np.clip(target, 0, np.array(self.resolution) - 1)
+            amplitude_deg = np.hypot(*(target - self.pos)) / self.px_per_deg
+            duration = 2.2 * amplitude_deg + 21
+            self.segment = ("saccade", t, t + duration, {"start": self.pos.copy(), "target": target})
+
+    def generate(self, times):
+        """Returns (N, 4) left x, left y, right x, right y gaze at the given times (ms)."""
+        out = np.empty((len(times), 4))
+        i = 0
+        while i < len(times):
+            if self.segment is None or times[i] >= self.segment[2]:
+                self._next_segment(times[i])
+            kind, start, end, params = self.segment
+            j = i + int(np.searchsorted(times[i:], end))
+            t = times[i:j]
+            n = len(t)
+
+            if kind == "blink":
+                out[i:j] = np.nan
+            else:
+                if kind == "fixation":
+                    gaze = params["start"] + np.outer(t - start, params["drift"])
+                    self.pos = gaze[-1].copy()
+                else:
+                    tau = np.clip((t - start) / (end - start), 0, 1)
+                    profile = tau**3 * (10 - 15 * tau + 6 * tau**2)
+                    gaze = params["start"] + np.outer(profile, params["target"] - params["start"])
+                    self.pos = gaze[-1].copy()
+                noise = self.rng.normal(0, self.noise, (n, 4))
+                out[i:j, :2] = gaze - self.vergence / 2 + noise[:, :2]
+                out[i:j, 2:] = gaze + self.vergence / 2 + noise[:, 2:]
+            i = j
+        return out
+
+
+class SimulatedEyeData:
+    def __init__(self, x, y):
+        if x != x:  # NaN
+            x = y = pylink.MISSING_DATA
+        self.gaze = (x, y)
+
+    def getGaze(self):
+        return self.gaze
+
+    def getPupilSize(self):
+        return 0 if self.gaze[0] == pylink.MISSING_DATA else 1000
+
+
+class SimulatedSample:
+    """Stand-in for pylink's Sample, built from one sample row."""
+
+    def __init__(self, row, eye):
+        self.time = row[TIME]
+        self.eye = eye
+        self.left = SimulatedEyeData(row[LEFT_X], row[LEFT_Y])
+        self.right = SimulatedEyeData(row[RIGHT_X], row[RIGHT_Y])
+
+    def getTime(self):
+        return self.time
+
+    def isLeftSample(self):
+        return self.eye != RIGHT_EYE
+
+    def isRightSample(self):
+        return self.eye != LEFT_EYE
+
+    def isBinocular(self):
+        return self.eye == BINOCULAR
+
+    def getLeftEye(self):
+        return self.left
+
+    def getRightEye(self):
+        return self.right
+
+
+class SimulatedEyeLink:
+    """Simulated tracker implementing the part of pylink.EyeLink the server uses.
+
+    Samples are generated on demand from the wall clock at the configured sample rate
+    (following ``sample_rate`` commands unless a fixed rate is given), so the realtime path
+    sees the same 1 kHz / 2 kHz stream it would get over the link. Calibration, validation
+    and drift correction drive the custom display like the Host PC would, and answer to the
+    keys sent with sendKeybutton; Enter toggles a simulated camera image. Messages are kept
+    in `messages` with their tracker time.
+
+    There is no EDF writer: the data file is an ASC-style text log (the lines edf2asc
+    would print for recording starts and ends, samples and messages) spooled to a
+    temporary file, which receiveDataFile copies out.
+
+    Args:
+        eye (str): LEFT, RIGHT or BOTH.
+        sample_rate (int, optional): fixed sample rate; by default follows commands.
+        seed (int, optional): seed for the gaze simulator.
+        sleep (callable): how to wait while blocked in setup, should yield to the server
+            (socketio.sleep) so key events can still be handled.
+    """
+
+    def __init__(self, eye="BOTH", sample_rate=None, seed=None, sleep=time.sleep):
+        self.eye = EYES[eye]
+        self.fixed_rate = sample_rate
+        self.sample_rate = sample_rate or 1000
+        self.seed = seed
+        self.sleep = sleep
+        self.resolution = (1920, 1080)
+        self.simulator = self._simulator()
+        self.display = None
+        self.keys = deque()
+        self.messages = deque(maxlen=100000)
+        self.data_file = None
+        self.file = None  # spooled data file, None once closed
+        self.spooled = None  # the closed data file, kept for receiveDataFile
+        self.file_samples = False
+        self.epoch = time.perf_counter()
+
+        self.recording = False
+        self.next_sample = None  # tracker time of the next sample to generate
+        self.queue = deque()  # generated, not yet read sample blocks
+        self.current = None  # sample returned by getFloatData
+        self.newest = None
+
+    def _simulator(self):
+        # the link filter gets stronger above 1 kHz, which keeps per-sample noise (and the
+        # velocity noise the parser sees) about the same as at 1000 Hz
+        noise = 0.6 * min(1, 1000 / self.sample_rate)
+        return GazeSimulator(self.resolution, noise=noise, seed=self.seed)
+
+    # -- clock and configuration
+
+    def trackerTime(self):
+        return (time.perf_counter() - self.epoch) * 1000
+
+    def _configure(self, text):
+        match = re.match(r"\s*sample_rate\s*=\s*(\d+)", text)
+        if match and not self.fixed_rate:
+            self.sample_rate = int(match.group(1))
+            self.simulator = self._simulator()
+        match = re.match(r"\s*screen_pixel_coords\s*=\s*0 0 (\d+) (\d+)", text)
+        if match:
+            self.resolution = (int(match.group(1)), int(match.group(2)))
+            self.simulator = self._simulator()
+
+    def sendCommand(self, text):
+        self._configure(text)
+        return 0
+
+    def sendMessage(self, text):
+        self._configure(text)
+        now = self.trackerTime()
+        # like the Host PC, the file keeps a leading offset (how many ms ago the message
+        # happened) in the text and stamps the message with the time it arrived
+        self.messages.append(message_time(now, text))
+        self._write("MSG\t%d %s\n" % (now, text))
+
+    def openGraphicsEx(self, display):
+        self.display = display
+
+    # -- data file
+
+    def _write(self, text):
+        if self.file is not None:
+            self.file.write(text.encode("utf-8"))
+
+    def openDataFile(self, filename):
+        self.closeDataFile()
+        self.data_file = filename
+        self.file = tempfile.TemporaryFile()
+        self.spooled = None
+        # header lines start with ** like edf2asc's, which is how converters tell it from an EDF
+        self._write("** SIMULATED EYELINK DATA FILE %s\n" % filename)
+        return 0
+
+    def closeDataFile(self):
+        if self.file is not None:
+            self.file.flush()
+            self.spooled, self.file = self.file, None
+        return 0
+
+    def receiveDataFile(self, src, dest, chunk_size=1 << 16):
+        """Copies the closed data file to `dest`, returns its size like pylink."""
+        if self.spooled is None or src != self.data_file:
+            return -1
+        self.spooled.seek(0)
+        with open(dest, "wb") as out:
+            while chunk := self.spooled.read(chunk_size):
+                out.write(chunk)
+                out.flush()
+                self.sleep(0)
+        return os.path.getsize(dest)
+
+    def isConnected(self):
+        return True
+
+    def close(self):
+        self.recording = False
+
+    def setOfflineMode(self):
+        self.recording = False
+
+    def getEyeUsed(self):
+        return self.eye
+
+    def __getattr__(self, name):
+        # file/link filters and the like have no effect on the simulation
+        if name.startswith("set"):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+
+    # -- recording and samples
+
+    def startRecording(self, file_samples, file_events, link_samples, link_events):
+        self.recording = True
+        self.file_samples = bool(file_samples)
+        self.next_sample = math.ceil(self.trackerTime())
+        self.queue.clear()
+        eyes = {LEFT_EYE: "LEFT", RIGHT_EYE: "RIGHT", BINOCULAR: "LEFT\tRIGHT"}[self.eye]
+        self._write("START\t%d \t%s\tSAMPLES\tEVENTS\n" % (self.next_sample, eyes))
+        self._write("SAMPLES\tGAZE\t%s\tRATE\t%.2f\n" % (eyes, self.sample_rate))
+        return 0
+
+    def stopRecording(self):
+        self._generate()
+        if self.recording:
+            self._write("END\t%d \tSAMPLES\tEVENTS\n" % self.trackerTime())
+        self.recording = False
+
+    def waitForBlockStart(self, timeout, samples, events):
+        return 1 if self.recording else 0
+
+    def isRecording(self):
+        return 0 if self.recording else pylink.TRIAL_ERROR
+
+    def _generate(self):
+        if not self.recording:
+            return
+        now = self.trackerTime()
+        dt = 1000 / self.sample_rate
+        n = int((now - self.next_sample) // dt) + 1
+        if n <= 0:
+            return
+        rows = np.empty((n, len(SAMPLE_COLUMNS)))
+        rows[:, TIME] = self.next_sample + dt * np.arange(n)
+        rows[:, LEFT_X:] = self.simulator.generate(rows[:, TIME])
+        self.next_sample += dt * n
+        self._emit(rows)
+
+    def _emit(self, rows):
+        """Queues generated rows on the link and writes them to the data file."""
+        if self.eye == LEFT_EYE:
+            rows[:, RIGHT_X:] = np.nan
+        elif self.eye == RIGHT_EYE:
+            rows[:, LEFT_X:RIGHT_X] = np.nan
+        self.queue.append(rows)
+        self.newest = rows[-1]
+        if self.file_samples and self.file is not None:
+            self._write("".join(self._asc_sample(row) for row in rows))
+
+    def _asc_sample(self, row):
+        # time, then x, y and pupil of each recorded eye, "." for missing data
+        t = row[TIME]
+        fields = ["%d" % t if t == int(t) else "%.1f" % t]
+        for x, y in _ASC_EYES[self.eye]:
+            if row[x] != row[x]:  # NaN
+                fields += (".", ".", "0.0")
+            else:
+                fields += ("%.1f" % row[x], "%.1f" % row[y], "1000.0")
+        return "\t".join(fields) + "\t...\n"
+
+    def read_samples(self):
+        """Block read of every queued sample as (N, len(SAMPLE_COLUMNS)) rows."""
+        self._generate()
+        if not self.queue:
+            return None
+        rows = np.concatenate(self.queue) if len(self.queue) > 1 else self.queue[0]
+        self.queue.clear()
+        return rows
+
+    def getNextData(self):
+        self._generate()
+        while self.queue and not len(self.queue[0]):
+            self.queue.popleft()
+        if not self.queue:
+            return 0
+        block = self.queue[0]
+        self.current = SimulatedSample(block[0], self.eye)
+        self.queue[0] = block[1:]
+        return pylink.SAMPLE_TYPE
+
+    def getFloatData(self):
+        return self.current
+
+    def getNewestSample(self):
+        self._generate()
+        if self.newest is None or not self.recording:
+            return None
+        return SimulatedSample(self.newest, self.eye)
+
+    # -- setup
+
+    def sendKeybutton(self, key, modifier, state):
+        self.keys.append(key)
+
+    def _pump(self, seconds=0.01, frame=0.01):
+        # like the Host PC, poll the display for keys once per frame, which flushes what was drawn
+        end = time.perf_counter() + seconds
+        while True:
+            self.display.get_input_key()
+            remaining = end - time.perf_counter()
+            if remaining <= 0:
+                return
+            self.sleep(min(frame, remaining))
+
+    def _wait_key(self, timeout=None):
+        start = time.perf_counter()
+        while not self.keys:
+            if timeout is not None and time.perf_counter() - start > timeout:
+                return None
+            self._pump()
+        return self.keys.popleft()
+
+    def _run_targets(self, proportion=0.5):
+        w, h = self.resolution
+        xs = (w / 2 - w * proportion / 2, w / 2, w / 2 + w * proportion / 2)
+        ys = (h / 2 - h * proportion / 2, h / 2, h / 2 + h * proportion / 2)
+        self.display.setup_cal_display()
+        for x in xs:
+            for y in ys:
+                self.display.clear_cal_display()
+                self.display.draw_cal_target(round(x), round(y))
+                self._pump(0.4)
+                self.display.erase_cal_target()
+        self.display.exit_cal_display()
+
+    def _camera_image(self, width=192, height=160, fps=30):
+        """Shows a noisy camera image with crosshairs until Enter or Escape is sent."""
+        rng = np.random.default_rng(self.seed)
+        levels = list(range(256))
+        self.display.setup_image_display(width, height)
+        self.display.image_title("Simulated camera")
+        self.display.set_image_palette(levels, levels, levels)
+        yy, xx = np.mgrid[:height, :width]
+        while True:
+            # dark pupil on a bright iris, jittering like a live eye
+            cx, cy = width / 2 + rng.normal(0, 2), height / 2 + rng.normal(0, 2)
+            image = np.where((xx - cx) ** 2 + (yy - cy) ** 2 < 400, 20, 160) + rng.integers(0, 40, (height, width))
+            image = image.astype(np.uint8)
+            for line in range(height):
+                self.display.draw_image_line(width, line + 1, height, image[line])
+            self.display.draw_line(cx - 10, cy, cx + 10, cy, pylink.PUPIL_HAIR_COLOR)
+            self.display.draw_line(cx, cy - 10, cx, cy + 10, pylink.PUPIL_HAIR_COLOR)
+            self.display.draw_lozenge(cx - 25, cy - 25, 50, 50, pylink.PUPIL_BOX_COLOR)
+            self._pump(1 / fps)
+            if self.keys and self.keys[0] in (pylink.ENTER_KEY, pylink.ESC_KEY):
+                self.keys.popleft()
+                break
+        self.display.exit_image_display()
+
+    def doTrackerSetup(self):
+        """Runs setup until the 'o' (output/record) or escape key is sent."""
+        self.display.setup_cal_display()
+        while True:
+            key = self._wait_key()
+            if key in (ord("c"), ord("v")):
+                self._run_targets()
+            elif key == pylink.ENTER_KEY:
+                self._camera_image()
+            elif key in (ord("o"), pylink.ESC_KEY):
+                self.display.exit_cal_display()
+                return 0
+
+    def doDriftCorrect(self, x, y, draw, allow_setup):
+        self.display.setup_cal_display()
+        self.display.draw_cal_target(x, y)
+        key = self._wait_key(timeout=5)
+        self.display.erase_cal_target()
+        self.display.exit_cal_display()
+        return pylink.ESC_KEY if key == pylink.ESC_KEY else 0
+
+    def applyDriftCorrect(self):
+        return 0
+
+
+class ReplayEyeLink(SimulatedEyeLink):
+    """Simulated tracker that plays back a recording instead of generated gaze.
+
+    The recording's samples come over the link in real time, shifted onto the tracker clock,
+    so realtime monitoring, AOIs and event detection run on real data through the whole
+    server. Each startRecording continues where the last block stopped, so consecutive
+    trials get consecutive stretches of the recording, and playback starts over at its end.
+    Gaps longer than `max_gap` ms (between the recording's blocks) are skipped. Everything
+    else (setup, messages, the data file) works like SimulatedEyeLink. To replay a whole
+    dataset as fast as possible instead, see replay.py.
+
+    Args:
+        source (str): path or glob pattern of the recording, see replay.load_recording.
+        eye (str): LEFT, RIGHT or BOTH, the other eye's data is dropped.
+        sleep (callable): see SimulatedEyeLink.
+        max_gap (float): longest gap in ms played back as it was recorded.
+    """
+
+    def __init__(self, source, eye="BOTH", sleep=time.sleep, max_gap=50):
+        # the offline replay tool, only the replay backend needs it
+        from replay import load_recording
+
+        paths = sorted(glob.glob(source)) or [source]
+        self.rows, _ = load_recording(paths)
+        if len(self.rows) < 2:
+            raise ValueError("%s has no samples to replay." % source)
+        intervals = np.diff(self.rows[:, TIME])
+        dt = float(np.median(intervals))
+        super().__init__(eye, sample_rate=round(1000 / dt), sleep=sleep)
+        # recording times with the gaps closed up, playback follows these
+        intervals[intervals > max_gap] = dt
+        self.playback = self.rows[0, TIME] + np.concatenate(([0], np.cumsum(intervals)))
+        self.position = 0  # next row to play
+        self.shift = 0.0  # tracker time - playback time
+
+    def startRecording(self, file_samples, file_events, link_samples, link_events):
+        error = super().startRecording(file_samples, file_events, link_samples, link_events)
+        self.shift = self.next_sample - self.playback[self.position]
+        return error
+
+    def _generate(self):
+        if not self.recording:
+            return
+        now = self.trackerTime()
+        while True:
+            end = int(np.searchsorted(self.playback, now - self.shift, "right"))
+            if end <= self.position:
+                return
+            rows = self.rows[self.position : end].copy()
+            rows[:, TIME] = self.playback[self.position : end] + self.shift
+            self.position = end
+            self._emit(rows)
+            if end < len(self.rows):
+                return
+            # from the start again, one sample interval after the last one
+            self.position = 0
+            self.shift = rows[-1, TIME] + 1000 / self.sample_rate - self.playback[0]
+
+
+def open_tracker(backend, eye="BOTH", address=None, **options):
+    """Connects to a tracker, close it with `close_tracker`.
+
+    Only one real tracker can be connected per process, opening a second one raises
+    RuntimeError until the first is closed; run one server per booth to drive several.
+    Simulated and replayed trackers have no such limit.
+
+    Args:
+        backend (str): "pylink" for a real EyeLink, "sim" for SimulatedEyeLink, "replay"
+            for ReplayEyeLink.
+        eye (str): LEFT, RIGHT or BOTH, used by the simulator.
+        address (str, optional): IP address of the Host PC, defaults to pylink's.
+        options: passed on to SimulatedEyeLink or ReplayEyeLink.
+    """
+    if backend == "pylink":
+        if not PYLINK_LINK.acquire(blocking=False):
+            raise RuntimeError(
+                "Another session is already connected to an EyeLink, pylink supports one tracker per server process."
+            )
+        try:
+            return pylink.EyeLink(address) if address else pylink.EyeLink()
+        except BaseException:
+            PYLINK_LINK.release()
+            raise
+    if backend == "sim":
+        return SimulatedEyeLink(eye, **options)
+    if backend == "replay":
+        return ReplayEyeLink(eye=eye, **options)
+    raise ValueError("backend must be set to pylink, sim or replay.")
+
+
+def close_tracker(tracker):
+    """Disconnects a tracker opened with `open_tracker`, a real one can be opened again afterwards."""
+    try:
+        tracker.close()
+    finally:
+        if not isinstance(tracker, SimulatedEyeLink) and PYLINK_LINK.locked():
+            PYLINK_LINK.release()
+
+
+def send_commands(tracker, commands):
+    """Sends commands one by one.
+
+    sendCommand waits for the tracker to run each command and returns its result, 0 if it
+    succeeded. Every command is sent even if one fails. Returns the first failing command
+    and its result, or None if they all succeeded.
+    """
+    failed = None
+    for command in commands:
+        result = tracker.sendCommand(command)
+        if result != 0 and failed is None:
+            failed = (command, result)
+    return failed
+
+
+def receive_data_file(tracker, filename, dest, progress=None, interval=0.25):
+    """Closes the EDF file on the Host PC and copies it to `dest`.
+
+    receiveDataFile writes to disk as the file comes in, so even a long session's file is
+    never held in memory. The copy blocks until it is done, so progress comes from a
+    thread watching the partial file grow, calling `progress(bytes_received)` every
+    `interval` seconds. The file only appears under `dest` once it is complete. Returns
+    its size.
+    """
+    tracker.setOfflineMode()
+    tracker.closeDataFile()
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    partial = dest + ".part"
+
+    done = threading.Event()
+
+    def watch():
+        while not done.wait(interval):
+            if os.path.exists(partial):
+                progress(os.path.getsize(partial))
+
+    watcher = threading.Thread(target=watch, name="edf-progress", daemon=True)
+    if progress is not None:
+        watcher.start()
+    try:
+        size = tracker.receiveDataFile(filename, partial)
+    finally:
+        done.set()
+        if watcher.is_alive():
+            watcher.join()
+
+    # 0 if the transfer was cancelled, negative on errors
+    if size <= 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise RuntimeError("Could not receive %s from the Host PC (%d)." % (filename, size))
+    os.replace(partial, dest)
+    return size
+
+
+def open_graphics(tracker, display):
+    """Hooks the custom calibration display up to the tracker."""
+    if isinstance(tracker, SimulatedEyeLink):
+        tracker.openGraphicsEx(display)
+    else:
+        pylink.openGraphicsEx(display)
+        pylink.flushGetkeyQueue()
@@ -0,0 +1,113 @@
+"""Micro-benchmark of the realtime gaze check.
+
+Compares the per-sample cost of the original check_eyetracker math (nanmean + linalg.norm
+on every sample) with RejectionPolicy.check, the check realtime monitoring runs, at
+different block sizes. The samples include blinks and excursions outside the window.
+
+    python bench_gaze.py [--repeat 2000] [--json]
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from gaze import rejection_policy
+
+SCREEN_RESOLUTION = (1920, 1080)
+SCREEN_CENTER = (SCREEN_RESOLUTION[0] / 2, SCREEN_RESOLUTION[1] / 2)
+MAX_DIST = 63  # threshold(1.25) on the default monitor
+BLOCK_SIZES = (1, 5, 50, 1000)
+
+
+def legacy_check(left, right, max_dist):
+    """check_eyetracker as it was before GazeCheck, minus the tracker read."""
+    if left is not None and right is not None:
+        lx, ly = left
+        rx, ry = right
+        x = np.nanmean([lx, rx])
+        y = np.nanmean([ly, ry])
+    elif left is not None:
+        x, y = left
+    elif right is not None:
+        x, y = right
+    else:
+        return None
+
+    winx = SCREEN_RESOLUTION[0] / 2
+    winy = SCREEN_RESOLUTION[1] / 2
+
+    x -= winx
+    y -= winy
+
+    dist = np.linalg.norm(np.array([x, y]))
+    if dist > max_dist:
+        return x, y
+    return None
+
+
+def trial_samples(n, seed=0, blink=0.05, outside=0.02):
+    """(n, 4) binocular samples jittering inside the fixation window, with a `blink` share of
+    missing samples and an `outside` share of samples outside it."""
+    rng = np.random.default_rng(seed)
+    samples = np.tile(SCREEN_CENTER, 2) + rng.normal(0, 5, size=(n, 4))
+    excursions = rng.random(n) < outside
+    excursions[0] = True  # so no block takes the all-inside shortcut
+    samples[excursions] += 2 * MAX_DIST
+    blinks = rng.random(n) < blink
+    blinks[-1] = n > 1
+    samples[blinks] = np.nan
+    return samples
+
+
+def ns_per_sample(fn, n_samples, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / (repeat * n_samples) * 1e9
+
+
+def run(repeat):
+    results = {"legacy": {}, "kernel": {}}
+    # long enough that the block is checked to its end
+    policy = rejection_policy(MAX_DIST, SCREEN_CENTER, {"min_duration": 1e9, "max_loss": 1e9})
+
+    for n in BLOCK_SIZES:
+        times = np.arange(n, dtype=float)
+        samples = trial_samples(n)
+        pairs = [tuple(None if np.isnan(s[i]) else (s[i], s[i + 1]) for i in (0, 2)) for s in samples]
+        reps = max(1, repeat // n)
+
+        def kernel():
+            policy.reset()
+            policy.check(times, samples)
+
+        def legacy():
+            for left, right in pairs:
+                legacy_check(left, right, MAX_DIST)
+
+        results["legacy"][n] = ns_per_sample(legacy, n, reps)
+        results["kernel"][n] = ns_per_sample(kernel, n, reps)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="samples checked per block size")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    if args.json:
+        print(json.dumps({"unit": "ns/sample", **results}, indent=2))
+        return
+
+    print("%10s %14s %14s" % ("block", "legacy ns", "kernel ns"))
+    for n in BLOCK_SIZES:
+        print("%10d %14.0f %14.0f" % (n, results["legacy"][n], results["kernel"][n]))
+
+
+if __name__ == "__main__":
+    main()
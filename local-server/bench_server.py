@@ -0,0 +1,227 @@
+"""Load test of the Socket.IO server against the simulated tracker.
+
+Runs the server of app.py in this process with the sim backend and drives it from a
+Socket.IO client in a child process (so the client doesn't compete with the server for
+the GIL). Each scenario sends ``event`` and ``trial_status`` messages as fast as the
+client can (or at --rate per second), optionally while ``realtime_eyetrack`` is running,
+and measures:
+
+- throughput: messages per second handed to the tracker's sendMessage
+- latency: ms from the handler receiving a message to sendMessage, p50/p99
+- cpu: server process CPU time over wall time, in percent of one core
+- check cost: ns per link sample spent in the realtime check
+
+    python bench_server.py [--duration 5] [--rate 0] [--json results.json]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# a trial status update every this many event codes
+STATUS_EVERY = 10
+# messages in flight at most; the client waits for a clock_ping round trip after each batch
+WINDOW = 100
+SCENARIOS = {
+    "events": {"messages": True, "realtime": False},
+    "events+realtime": {"messages": True, "realtime": True},
+    "realtime": {"messages": False, "realtime": True},
+}
+
+
+def client(url, room, scenario, duration, rate, ready, go, result):
+    """Child process: opens a session, waits for `go`, then sends messages for `duration` s."""
+    import socketio
+
+    sio = socketio.Client()
+    opened = threading.Event()
+    sio.on("sessionReady", lambda data: opened.set())
+    sio.connect(url, auth={"session": room}, transports=["websocket"])
+    sio.call("open_session", {})
+    opened.wait(30)
+    sio.emit("startRecording")
+    time.sleep(0.2)
+    if scenario["realtime"]:
+        # a window that gaze never leaves, so monitoring runs for the whole scenario
+        sio.call("realtime_eyetrack", {"duration": (duration + 5) * 1000, "eyeMaxDist": 90})
+    ready.set()
+    go.wait()
+
+    sent = 0
+    start = time.perf_counter()
+    end = start + duration
+    while time.perf_counter() < end:
+        if scenario["messages"]:
+            if sent % STATUS_EVERY == STATUS_EVERY - 1:
+                sio.emit("trial_status", {"status": "bench %d" % sent})
+            else:
+                sio.emit("event", {"code": sent})
+            sent += 1
+            if sent % WINDOW == 0:
+                sio.call("clock_ping", {"t0": 0})
+        if rate:
+            time.sleep(max(0, start + sent / rate - time.perf_counter()))
+        elif not scenario["messages"]:
+            time.sleep(0.01)
+    result.put(sent)
+    sio.emit("stop_realtime_eyetrack")
+    sio.emit("stopRecording")
+    time.sleep(0.2)
+    sio.disconnect()
+
+
+class Probe:
+    """Records when each message is queued and sent, and how long the realtime check takes."""
+
+    def __init__(self, app, session):
+        self.queued = {}
+        self.sent = []  # (queued, sent) perf_counter pairs
+        self.check_time = 0.0
+        self.check_samples = 0
+
+        queue = session.messages
+        message, send = queue.message, session.tracker.sendMessage
+
+        def queued(text, received=None):
+            self.queued[text] = time.perf_counter()
+            message(text, received)
+
+        def sent(text):
+            send(text)
+            # the writer prefixes an offset when the message waited
+            text = text.split(" ", 1)[1] if text[0].isdigit() else text
+            start = self.queued.pop(text, None)
+            if start is not None:
+                self.sent.append((start, time.perf_counter()))
+
+        queue.message = queued
+        session.tracker.sendMessage = sent
+
+        self.app = app
+        check = self.check = app.check_samples
+
+        def timed_check(times, samples, policy):
+            start = time.perf_counter()
+            try:
+                check(times, samples, policy)
+            finally:
+                self.check_time += time.perf_counter() - start
+                self.check_samples += len(times)
+
+        app.check_samples = timed_check
+
+    def remove(self):
+        self.app.check_samples = self.check
+
+
+def run_scenario(app, port, name, scenario, duration, rate):
+    ctx = multiprocessing.get_context("spawn")
+    ready, go, result = ctx.Event(), ctx.Event(), ctx.Queue()
+    room = "bench-%s" % name
+    proc = ctx.Process(
+        target=client, args=("http://localhost:%d" % port, room, scenario, duration, rate, ready, go, result)
+    )
+    proc.start()
+    if not ready.wait(60):
+        proc.terminate()
+        raise RuntimeError("Benchmark client for %s didn't start." % name)
+
+    session = app.SESSIONS[room]
+    probe = Probe(app, session)
+    cpu, wall = time.process_time(), time.perf_counter()
+    go.set()
+    sent = result.get(timeout=duration + 30)
+    # every message ends up as one sendMessage, wait for the last ones
+    deadline = time.perf_counter() + 10
+    while len(probe.sent) < sent and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    probe.remove()
+    proc.join(10)
+
+    latency = np.array([(s - q) * 1000 for q, s in probe.sent])
+    out = {"sent": sent, "delivered": len(probe.sent), "throughput": len(probe.sent) / wall}
+    if len(latency):
+        out["latency_ms"] = {
+            "p50": float(np.percentile(latency, 50)),
+            "p99": float(np.percentile(latency, 99)),
+            "max": float(latency.max()),
+        }
+    out["cpu_pct"] = 100 * cpu / wall
+    if probe.check_samples:
+        out["check_ns_per_sample"] = probe.check_time / probe.check_samples * 1e9
+        out["samples_checked"] = probe.check_samples
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5, help="seconds per scenario")
+    parser.add_argument("--rate", type=float, default=0, help="messages per second, 0 sends as fast as possible")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="scenarios to run, default all")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON to PATH ('-' for stdout)")
+    args = parser.parse_args()
+
+    os.environ["EYELINK_BACKEND"] = "sim"
+    os.environ.setdefault("EYELINK_SIM_SEED", "0")
+    os.environ.setdefault("EYELINK_DATA_DIR", tempfile.mkdtemp(prefix="eyelink-bench-"))
+    # session and client lifecycle logs would interleave with the results on stderr
+    os.environ.setdefault("EYELINK_LOG_LEVEL", "WARNING")
+
+    # pylink's and the server's banners go nowhere
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        import app
+
+        threading.Thread(
+            target=app.socketio.run,
+            args=(app.app,),
+            kwargs={"port": args.port, "allow_unsafe_werkzeug": True, "log_output": False},
+            daemon=True,
+        ).start()
+        time.sleep(1)
+
+        results = {}
+        for name in args.scenario or SCENARIOS:
+            results[name] = run_scenario(app, args.port, name, SCENARIOS[name], args.duration, args.rate)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    report = {"duration": args.duration, "rate": args.rate, "python": sys.version.split()[0], "results": results}
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json != "-":
+        columns = ("scenario", "sent", "msgs/s", "p50 ms", "p99 ms", "max ms", "cpu %", "check ns")
+        print("%-16s %9s %9s %10s %9s %9s %7s %10s" % columns)
+        for name, r in results.items():
+            lat = r.get("latency_ms", {})
+            print(
+                "%-16s %9d %9.0f %10.3f %9.3f %9.3f %7.1f %10.0f"
+                % (
+                    name,
+                    r["sent"],
+                    r["throughput"],
+                    lat.get("p50", np.nan),
+                    lat.get("p99", np.nan),
+                    lat.get("max", np.nan),
+                    r["cpu_pct"],
+                    r.get("check_ns_per_sample", np.nan),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import struct
+import zlib
+
+# opcodes of the binary calibration display stream, mirrored in plugin-eyelink-display.ts
+SETUP = 1  # setup_cal_display
+EXIT = 2  # exit_cal_display
+CLEAR = 3  # clear_cal_display
+DRAW_TARGET = 4  # int16 x, int16 y
+ERASE_TARGET = 5
+SETUP_IMAGE = 6  # uint16 width, uint16 height
+EXIT_IMAGE = 7
+IMAGE_TITLE = 8  # uint16 length, utf-8 text
+PALETTE = 9  # uint16 n, n * (r, g, b) bytes
+IMAGE_FRAME = 10  # uint32 frame, uint16 width, uint16 height, uint8 encoding, uint32 length, data
+DRAW_LINE = 11  # int16 x1, y1, x2, y2, uint8 color
+DRAW_LOZENGE = 12  # int16 x, y, width, height, uint8 color
+BEEP = 13  # uint8 beep
+
+# batch header: protocol version, batch sequence number, number of commands
+BATCH_HEADER = struct.Struct("<BIH")
+VERSION = 2
+
+# how a camera frame's palette indices are encoded
+CAMERA_ENCODINGS = ("raw", "zlib", "png")
+
+_POINT = struct.Struct("<hh")
+_SIZE = struct.Struct("<HH")
+_LENGTH = struct.Struct("<H")
+_SHAPE = struct.Struct("<hhhhB")
+_FRAME_HEADER = struct.Struct("<IHHBI")
+_BYTE = struct.Struct("<B")
+
+# commands that only matter until the calibration screen is cleared or a target is redrawn
+_TARGET_LAYER = frozenset((CLEAR, DRAW_TARGET, ERASE_TARGET))
+# commands that belong to one camera image, superseded when the next image starts
+_IMAGE_FRAME = frozenset((IMAGE_FRAME, DRAW_LINE, DRAW_LOZENGE))
+
+
+class DisplayBatch:
+    """Collects calibration display commands between two flushes.
+
+    pylink calls the custom display many times per tracker frame (a clear, a target, and
+    during camera setup every line of the image plus the crosshairs) and then polls
+    get_input_key, which is where the batch is flushed as one binary message. Commands
+    that are superseded before the flush are dropped instead of sent: a clear or a new
+    target replaces any pending target drawing, and a new camera image replaces the lines
+    and crosshairs of an image that hasn't gone out yet.
+    """
+
+    def __init__(self):
+        self.commands = []  # (opcode, packed command)
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.commands)
+
+    def _drop(self, opcodes):
+        self.commands = [command for command in self.commands if command[0] not in opcodes]
+
+    def add(self, op, payload=b""):
+        if op in (CLEAR, SETUP, EXIT):
+            self._drop(_TARGET_LAYER)
+        elif op in (DRAW_TARGET, ERASE_TARGET):
+            self._drop((DRAW_TARGET, ERASE_TARGET))
+        elif op == SETUP_IMAGE or op == EXIT_IMAGE:
+            self._drop(_IMAGE_FRAME)
+        self.commands.append((op, _BYTE.pack(op) + payload))
+
+    def setup(self):
+        self.add(SETUP)
+
+    def exit(self):
+        self.add(EXIT)
+
+    def clear(self):
+        self.add(CLEAR)
+
+    def draw_target(self, x, y):
+        self.add(DRAW_TARGET, _POINT.pack(round(x), round(y)))
+
+    def erase_target(self):
+        self.add(ERASE_TARGET)
+
+    def setup_image(self, width, height):
+        self.add(SETUP_IMAGE, _SIZE.pack(width, height))
+
+    def exit_image(self):
+        self.add(EXIT_IMAGE)
+
+    def image_title(self, text):
+        text = text.encode("utf-8")[:0xFFFF]
+        self.add(IMAGE_TITLE, _LENGTH.pack(len(text)) + text)
+
+    def palette(self, rgb):
+        """`rgb` is the packed r, g, b bytes of each palette entry."""
+        self.add(PALETTE, _LENGTH.pack(len(rgb) // 3) + rgb)
+
+    def image_frame(self, frame, width, height, encoding, data):
+        # a new image, whatever is left of the last one is stale
+        self._drop(_IMAGE_FRAME)
+        header = _FRAME_HEADER.pack(frame & 0xFFFFFFFF, width, height, CAMERA_ENCODINGS.index(encoding), len(data))
+        self.add(IMAGE_FRAME, header + data)
+
+    def draw_line(self, x1, y1, x2, y2, color):
+        self.add(DRAW_LINE, _SHAPE.pack(round(x1), round(y1), round(x2), round(y2), color))
+
+    def draw_lozenge(self, x, y, width, height, color):
+        self.add(DRAW_LOZENGE, _SHAPE.pack(round(x), round(y), round(width), round(height), color))
+
+    def beep(self, beep):
+        self.add(BEEP, _BYTE.pack(beep))
+
+    def pack(self):
+        """Returns the pending commands as one binary message and starts a new batch."""
+        if not self.commands:
+            return None
+        message = b"".join(
+            [BATCH_HEADER.pack(VERSION, self.seq & 0xFFFFFFFF, len(self.commands))]
+            + [command for _, command in self.commands]
+        )
+        self.commands = []
+        self.seq += 1
+        return message
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(width, height, pixels, palette):
+    """8-bit palette PNG of `pixels` (width * height palette indices, row by row)."""
+    rows = bytearray((width + 1) * height)  # every row starts with filter type 0
+    for y in range(height):
+        rows[y * (width + 1) + 1 : (y + 1) * (width + 1)] = pixels[y * width : (y + 1) * width]
+    return b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)),
+            _png_chunk(b"PLTE", palette or bytes(3)),
+            _png_chunk(b"IDAT", zlib.compress(rows, 1)),
+            _png_chunk(b"IEND", b""),
+        )
+    )
+
+
+class CameraImage:
+    """Assembles camera image lines into whole frames.
+
+    Lines are copied straight into a buffer allocated once per image size, so a frame
+    costs no allocations until it is encoded. The palette is kept as packed RGB bytes,
+    which is what both the PALETTE command and a PNG's PLTE chunk need.
+    """
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.buffer = bytearray()
+        self.view = memoryview(self.buffer)
+        self.palette = b""
+
+    def setup(self, width, height):
+        if width * height != len(self.buffer):
+            self.buffer = bytearray(width * height)
+            self.view = memoryview(self.buffer)
+        self.width = width
+        self.height = height
+
+    def set_palette(self, r, g, b):
+        n = min(len(r), len(g), len(b))
+        rgb = bytearray(3 * n)
+        rgb[0::3], rgb[1::3], rgb[2::3] = bytes(r[:n]), bytes(g[:n]), bytes(b[:n])
+        self.palette = bytes(rgb)
+
+    def add_line(self, width, line, totlines, pixels):
+        """Copies line `line` (1-based) into the frame, returns True when it was the last."""
+        if width != self.width or totlines != self.height:
+            self.setup(width, totlines)
+        start = (line - 1) * width
+        try:
+            # bytes, array("B") and uint8 arrays are copied straight in
+            self.view[start : start + width] = pixels[:width]
+        except TypeError:
+            # a list of ints
+            self.buffer[start : start + width] = bytes(pixels[:width])
+        return line == totlines
+
+    def encode(self, encoding):
+        if encoding == "raw":
+            return bytes(self.buffer)
+        if encoding == "zlib":
+            # speed over ratio, a camera frame has to be ready well before the next one
+            return zlib.compress(self.buffer, 1)
+        return encode_png(self.width, self.height, self.buffer, self.palette)
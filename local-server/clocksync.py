@@ -0,0 +1,50 @@
+import time
+
+from stats import Histogram
+
+
+def server_ms():
+    """The server clock the client's clock is synced to, in ms."""
+    return time.perf_counter() * 1000
+
+
+class ClientClock:
+    """Offset between one client's performance.now() clock and the server clock.
+
+    The client measures it NTP-style with ``clock_ping`` round trips, keeps the one with
+    the shortest round trip and reports it with ``clock_sync``. The server also keeps
+    histograms of the round-trip times and of the one-way delay of every timestamped
+    event, to show how much marker jitter the network and server add under load.
+    """
+
+    def __init__(self):
+        self.offset = None  # server ms - client ms
+        self.rtt = None  # round trip of the ping the offset came from
+        self.round_trips = Histogram()
+        self.one_way = Histogram()
+
+    def update(self, offset, rtt, round_trips=()):
+        self.offset = offset
+        self.rtt = rtt
+        for value in round_trips:
+            self.round_trips.add(value)
+
+    def sent_at(self, client_ms, received):
+        """Server time (time.perf_counter() seconds) at which the client sent a message.
+
+        Falls back to the receive time if the clock hasn't been synced yet, and never
+        returns a time after the receive time.
+        """
+        if self.offset is None or client_ms is None:
+            return received
+        sent = (client_ms + self.offset) / 1000
+        self.one_way.add(max(received - sent, 0) * 1000)
+        return min(sent, received)
+
+    def summary(self):
+        return {
+            "offset": self.offset,
+            "rtt": self.rtt,
+            "roundTrip": self.round_trips.summary(),
+            "oneWay": self.one_way.summary(),
+        }
@@ -0,0 +1,288 @@
+import math
+from collections import deque
+
+# what a detector reports, in the order they can happen
+EVENTS = ("fixationStart", "fixationEnd", "saccadeStart", "saccadeEnd", "blinkStart", "blinkEnd")
+
+
+class EventDetector:
+    """Base for online eye event detectors.
+
+    Samples are fed one at a time with `update` and every call does a constant amount of
+    work on a fixed-size window, so detectors can keep up with the link sample rate.
+    Missing samples (NaN) are reported as blinks and restart the window.
+    """
+
+    def __init__(self, profile):
+        # degrees of visual angle per pixel along x and y, at the center of the screen
+        self.deg_per_pix = tuple(math.degrees(2 * math.atan(size / (2 * profile.distance))) for size in profile.pix_size)
+        self.in_blink = False
+        self.blink_start = None
+
+    def update(self, t, x, y):
+        """Feeds one sample, returns a list of (event, data) tuples."""
+        if x != x or y != y:  # NaN
+            if self.in_blink:
+                return []
+            self.in_blink = True
+            self.blink_start = t
+            events = self.interrupt(t)
+            events.append(("blinkStart", {"time": t}))
+            return events
+
+        if self.in_blink:
+            self.in_blink = False
+            events = [("blinkEnd", {"time": t, "duration": t - self.blink_start})]
+            events.extend(self.sample(t, x, y))
+            return events
+        return self.sample(t, x, y)
+
+    def update_block(self, times, gaze):
+        """Feeds an (N,) array of times and an (N, 2) array of gaze."""
+        events = []
+        for t, (x, y) in zip(times.tolist(), gaze.tolist()):
+            events.extend(self.update(t, x, y))
+        return events
+
+    def sample(self, t, x, y):
+        raise NotImplementedError
+
+    def interrupt(self, t):
+        """Ends whatever is in progress when data is lost, returns its events."""
+        raise NotImplementedError
+
+
+class VelocityDetector(EventDetector):
+    """I-VT: samples faster than a velocity (or acceleration) threshold are saccades.
+
+    Velocity is estimated with the same 5-sample model the EyeLink parser uses, so the
+    detector runs two samples behind the newest one (2 ms at 1000 Hz).
+
+    Args:
+        profile (MonitorProfile): geometry used to turn pixels into degrees.
+        velocity_threshold (float): saccade velocity threshold in deg/s.
+        acceleration_threshold (float): saccade acceleration threshold in deg/s^2.
+    """
+
+    def __init__(self, profile, velocity_threshold=30, acceleration_threshold=9500):
+        super().__init__(profile)
+        self.velocity_threshold = velocity_threshold
+        self.acceleration_threshold = acceleration_threshold
+        self.window = deque(maxlen=5)
+        self.last_velocity = None
+        self.in_saccade = False
+        self.start = None  # (t, x, y) of the current fixation or saccade
+        self.peak_velocity = 0
+        self.fix_sum = [0.0, 0.0, 0]
+
+    def sample(self, t, x, y):
+        window = self.window
+        window.append((t, x, y))
+        if len(window) < 5:
+            return []
+
+        (t0, x0, y0), (_, x1, y1), (tc, xc, yc), (_, x3, y3), (t4, x4, y4) = window
+        dt = (t4 - t0) / 4000  # seconds between samples
+        if dt <= 0:
+            return []
+        vx = (x3 + x4 - x1 - x0) / (6 * dt) * self.deg_per_pix[0]
+        vy = (y3 + y4 - y1 - y0) / (6 * dt) * self.deg_per_pix[1]
+        velocity = math.hypot(vx, vy)
+        acceleration = abs(velocity - self.last_velocity) / dt if self.last_velocity is not None else 0
+        self.last_velocity = velocity
+
+        fast = velocity > self.velocity_threshold or acceleration > self.acceleration_threshold
+        events = []
+        if self.start is None:
+            self.in_saccade = fast
+            events.append(("saccadeStart" if fast else "fixationStart", {"time": tc, "x": xc, "y": yc}))
+            self.start = (tc, xc, yc)
+            self.peak_velocity = velocity
+            self.fix_sum = [xc, yc, 1]
+        elif fast and not self.in_saccade:
+            events.append(self._end_fixation(tc))
+            events.append(("saccadeStart", {"time": tc, "x": xc, "y": yc}))
+            self.in_saccade = True
+            self.start = (tc, xc, yc)
+            self.peak_velocity = velocity
+        elif not fast and self.in_saccade:
+            events.append(self._end_saccade(tc, xc, yc))
+            events.append(("fixationStart", {"time": tc, "x": xc, "y": yc}))
+            self.in_saccade = False
+            self.start = (tc, xc, yc)
+            self.fix_sum = [xc, yc, 1]
+        elif self.in_saccade:
+            self.peak_velocity = max(self.peak_velocity, velocity)
+        else:
+            self.fix_sum[0] += xc
+            self.fix_sum[1] += yc
+            self.fix_sum[2] += 1
+        return events
+
+    def _end_fixation(self, t):
+        sx, sy, n = self.fix_sum
+        return ("fixationEnd", {"time": t, "duration": t - self.start[0], "x": sx / n, "y": sy / n})
+
+    def _end_saccade(self, t, x, y):
+        t0, x0, y0 = self.start
+        amplitude = math.hypot((x - x0) * self.deg_per_pix[0], (y - y0) * self.deg_per_pix[1])
+        return (
+            "saccadeEnd",
+            {"time": t, "duration": t - t0, "x": x, "y": y, "amplitude": amplitude, "peakVelocity": self.peak_velocity},
+        )
+
+    def interrupt(self, t):
+        events = []
+        if self.start is not None:
+            if self.in_saccade:
+                _, x, y = self.window[-1]
+                events.append(self._end_saccade(t, x, y))
+            else:
+                events.append(self._end_fixation(t))
+        self.window.clear()
+        self.last_velocity = None
+        self.in_saccade = False
+        self.start = None
+        return events
+
+
+class _SlidingExtreme:
+    """Running max of the last values pushed, O(1) amortized per push."""
+
+    def __init__(self, sign):
+        self.sign = sign  # 1 for max, -1 for min
+        self.items = deque()  # (index, signed value), decreasing
+
+    def push(self, index, value):
+        value *= self.sign
+        while self.items and self.items[-1][1] <= value:
+            self.items.pop()
+        self.items.append((index, value))
+
+    def evict(self, first_index):
+        while self.items and self.items[0][0] < first_index:
+            self.items.popleft()
+
+    def value(self):
+        return self.items[0][1] * self.sign
+
+    def clear(self):
+        self.items.clear()
+
+
+class DispersionDetector(EventDetector):
+    """I-DT: gaze that stays within a dispersion threshold for a minimum duration is a
+    fixation, everything between fixations is a saccade.
+
+    Only the candidate window is kept sample by sample, and it is at most `min_duration`
+    long. Once it becomes a fixation, the fixation is carried as its first sample, running
+    sums and x/y bounds, so memory doesn't grow however long the fixation lasts.
+
+    Args:
+        profile (MonitorProfile): geometry used to turn degrees into pixels.
+        dispersion (float): maximum (x range + y range) of a fixation in degrees.
+        min_duration (float): minimum fixation duration in ms.
+    """
+
+    def __init__(self, profile, dispersion=1.0, min_duration=100):
+        super().__init__(profile)
+        x_pix, y_pix = profile.threshold(dispersion)
+        self.dispersion = (x_pix + y_pix) / 2
+        self.min_duration = min_duration
+        self.window = deque()  # (index, t, x, y) of the samples in the candidate fixation
+        self.extremes = [_SlidingExtreme(s) for s in (-1, 1, -1, 1)]  # min x, max x, min y, max y
+        self.index = 0
+        self.in_fixation = False
+        self.bounds = None  # min x, max x, min y, max y of the fixation in progress
+        self.start = None  # (t, x, y) of the first sample of the fixation in progress
+        self.saccade_start = None
+        self.fix_sum = [0.0, 0.0, 0]  # x, y and number of samples of the candidate or fixation
+
+    def _dispersion(self):
+        min_x, max_x, min_y, max_y = (e.value() for e in self.extremes)
+        return (max_x - min_x) + (max_y - min_y)
+
+    def sample(self, t, x, y):
+        index = self.index
+        self.index += 1
+
+        if self.in_fixation:
+            min_x, max_x, min_y, max_y = self.bounds
+            min_x, max_x, min_y, max_y = min(min_x, x), max(max_x, x), min(min_y, y), max(max_y, y)
+            if (max_x - min_x) + (max_y - min_y) > self.dispersion:
+                # this sample left the fixation, it starts a saccade
+                events = [self._end_fixation(t), ("saccadeStart", {"time": t, "x": x, "y": y})]
+                self.saccade_start = (t, x, y)
+                self._restart(index, t, x, y)
+                return events
+            self.bounds = (min_x, max_x, min_y, max_y)
+            self._add(x, y)
+            return []
+
+        self.window.append((index, t, x, y))
+        for extreme, value in zip(self.extremes, (x, x, y, y)):
+            extreme.push(index, value)
+        self._add(x, y)
+
+        # slide the candidate window forward until it is compact again
+        while self._dispersion() > self.dispersion:
+            first = self.window.popleft()
+            self._add(-first[2], -first[3], -1)
+            for extreme in self.extremes:
+                extreme.evict(first[0] + 1)
+
+        _, first_t, fx, fy = self.window[0]
+        if t - first_t < self.min_duration:
+            return []
+
+        # the candidate is now a fixation, only its aggregates are kept from here on
+        events = []
+        self.in_fixation = True
+        self.start = (first_t, fx, fy)
+        self.bounds = tuple(e.value() for e in self.extremes)
+        self.window.clear()
+        for extreme in self.extremes:
+            extreme.clear()
+        if self.saccade_start is not None:
+            t0, x0, y0 = self.saccade_start
+            amplitude = math.hypot((fx - x0) * self.deg_per_pix[0], (fy - y0) * self.deg_per_pix[1])
+            events.append(("saccadeEnd", {"time": first_t, "duration": first_t - t0, "x": fx, "y": fy, "amplitude": amplitude}))
+            self.saccade_start = None
+        events.append(("fixationStart", {"time": first_t, "x": fx, "y": fy}))
+        return events
+
+    def _add(self, x, y, n=1):
+        self.fix_sum[0] += x
+        self.fix_sum[1] += y
+        self.fix_sum[2] += n
+
+    def _restart(self, index, t, x, y):
+        self.in_fixation = False
+        self.bounds = None
+        self.start = None
+        self.window.clear()
+        for extreme in self.extremes:
+            extreme.clear()
+        self.window.append((index, t, x, y))
+        for extreme, value in zip(self.extremes, (x, x, y, y)):
+            extreme.push(index, value)
+        self.fix_sum = [x, y, 1]
+
+    def _end_fixation(self, t):
+        sx, sy, n = self.fix_sum
+        return ("fixationEnd", {"time": t, "duration": t - self.start[0], "x": sx / n, "y": sy / n})
+
+    def interrupt(self, t):
+        events = [self._end_fixation(t)] if self.in_fixation else []
+        self.in_fixation = False
+        self.bounds = None
+        self.start = None
+        self.saccade_start = None
+        self.window.clear()
+        for extreme in self.extremes:
+            extreme.clear()
+        self.fix_sum = [0.0, 0.0, 0]
+        return events
+
+
+DETECTORS = {"ivt": VelocityDetector, "idt": DispersionDetector}
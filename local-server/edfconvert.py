@@ -0,0 +1,344 @@
+"""Converts EyeLink recordings to memory-mapped columns for analysis.
+
+Parses the ASCII export of an EDF file (edf2asc output, or the text log the simulated
+tracker writes) in one streaming pass and writes a directory of .npy columns:
+
+    samples/   time, left_x, left_y, left_pupil, right_x, right_y, right_pupil, status
+    events/    type, eye, start, end, duration, x, y, end_x, end_y, amplitude, peak_velocity, pupil
+    messages/  time, text, plus the SYNC codes sent by the server (sync_time, sync_code);
+               event codes the server sent with an offset get their event time
+    meta.json  eyes, sample rate, recording blocks, display coordinates
+
+Columns are loaded with np.load(mmap_mode="r"), so even a multi-hour recording opens
+instantly and only the slices that are used are read from disk. Trials are sliced by
+SYNC code with `Recording.trials`. With --parquet, samples, events and messages are also
+written as Parquet files (needs pyarrow).
+
+    python edfconvert.py session.asc out_dir [--parquet]
+    python edfconvert.py session.edf out_dir   # runs edf2asc first (unless it is simulated)
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+
+import numpy as np
+
+from messages import message_time
+
+SAMPLE_COLUMNS = ("time", "left_x", "left_y", "left_pupil", "right_x", "right_y", "right_pupil")
+EVENT_COLUMNS = ("start", "end", "duration", "x", "y", "end_x", "end_y", "amplitude", "peak_velocity", "pupil")
+EVENT_TYPES = ("fixation", "saccade", "blink")
+EYE_CODES = {"L": 0, "R": 1}
+
+# status bits, from the flags at the end of each sample line: "I" interpolated, "C" corneal
+# reflection missing, "R" corneal reflection recovering (the right eye's are shifted by 4)
+INTERPOLATED, CR_MISSING, CR_RECOVERING = 1, 2, 4
+RIGHT_STATUS_SHIFT = 4
+# where each flag is, for one eye ("I C R") and two ("I LC LR RC RR")
+_FLAGS_MONOCULAR = ((0, INTERPOLATED), (1, CR_MISSING), (2, CR_RECOVERING))
+_FLAGS_BINOCULAR = (
+    ((0, INTERPOLATED), (1, CR_MISSING), (2, CR_RECOVERING)),
+    ((0, INTERPOLATED), (3, CR_MISSING), (4, CR_RECOVERING)),
+)
+
+# sample lines parsed at a time
+CHUNK_LINES = 1 << 16
+
+_MISSING = re.compile(r"\t *\.(?=\t)")
+_SYNC = re.compile(r"SYNC (-?\d+)$")
+_NPY_HEADER_SIZE = 128
+
+
+def _npy_header(dtype, n):
+    # fixed size, so it can be rewritten with the final length once all rows are in
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), n)
+    header = header.ljust(_NPY_HEADER_SIZE - 11).encode("latin1") + b"\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header
+
+
+class ColumnWriter:
+    """Appends chunks of a 1-d column to a .npy file without holding the column in memory."""
+
+    def __init__(self, path, dtype):
+        self.dtype = np.dtype(dtype)
+        self.file = open(path, "wb")
+        self.file.write(_npy_header(self.dtype, 0))
+        self.count = 0
+
+    def write(self, values):
+        values = np.ascontiguousarray(values, self.dtype)
+        self.file.write(values.tobytes())
+        self.count += len(values)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(_npy_header(self.dtype, self.count))
+        self.file.close()
+
+
+def _status_bits(flags, positions):
+    """Status bits of one eye, `flags` being an (N, 5) array of flag characters."""
+    bits = np.zeros(len(flags), np.uint8)
+    for at, bit in positions:
+        bits[flags[:, at] != ord(".")] |= bit
+    return bits
+
+
+def parse_sample_lines(lines, eyes):
+    """Parses sample lines into a (N, len(SAMPLE_COLUMNS)) array and N status values.
+
+    `eyes` are the eyes recorded ("LEFT", "RIGHT" or both), which fixes the column layout:
+    time, then x, y and pupil per eye, then the flags. Missing values ("." in the export)
+    become NaN. The numbers of the whole chunk are parsed by numpy in one go instead of
+    line by line.
+    """
+    # the flags are the last field, unless the export was written without them
+    has_flags = not any(c.isdigit() for c in lines[0].rpartition("\t")[2])
+    if has_flags:
+        split = [line.rpartition("\t") for line in lines]
+        numbers = [fields[0] for fields in split]
+    else:
+        numbers = lines
+    text = _MISSING.sub("\tnan", "\t\n".join(numbers) + "\t\n")
+    values = np.fromstring(text, sep=" ").reshape(len(lines), -1)
+
+    out = np.full((len(lines), len(SAMPLE_COLUMNS)), np.nan)
+    out[:, 0] = values[:, 0]
+    for i, eye in enumerate(eyes):
+        at = 1 if eye == "LEFT" else 4
+        out[:, at : at + 3] = values[:, 1 + 3 * i : 4 + 3 * i]
+
+    status = np.zeros(len(lines), np.uint8)
+    if has_flags:
+        flags = np.array([fields[2].ljust(5, ".") for fields in split], dtype="S5")
+        flags = np.frombuffer(flags.tobytes(), np.uint8).reshape(-1, 5)
+        for i, eye in enumerate(eyes):
+            positions = _FLAGS_MONOCULAR if len(eyes) == 1 else _FLAGS_BINOCULAR[i]
+            status |= _status_bits(flags, positions) << (RIGHT_STATUS_SHIFT if eye == "RIGHT" else 0)
+    return out, status
+
+
+def _parse_event(parts):
+    """One end-of-event line (EFIX, ESACC, EBLINK) as (type, eye, values)."""
+    kind = EVENT_TYPES[("EFIX", "ESACC", "EBLINK").index(parts[0])]
+    values = [np.nan] * len(EVENT_COLUMNS)
+    numbers = [float("nan") if p == "." else float(p) for p in parts[2:]]
+    values[:3] = numbers[:3]
+    if kind == "fixation":
+        values[3], values[4], values[9] = numbers[3:6]
+    elif kind == "saccade":
+        values[3:9] = numbers[3:9]
+    return EVENT_TYPES.index(kind), EYE_CODES.get(parts[1], -1), values
+
+
+def convert(asc_path, out_dir, chunk_lines=CHUNK_LINES, parquet=False):
+    """Converts an ASC file into `out_dir`, returns the metadata written to meta.json."""
+    # samples go straight to disk chunk by chunk, events and messages are few enough to keep
+    folder = os.path.join(out_dir, "samples")
+    os.makedirs(folder, exist_ok=True)
+    samples = {name: ColumnWriter(os.path.join(folder, name + ".npy"), np.float64) for name in SAMPLE_COLUMNS}
+    status = ColumnWriter(os.path.join(folder, "status.npy"), np.uint8)
+
+    events = []
+    messages = []
+    blocks = []
+    meta = {"source": os.path.basename(asc_path), "eyes": None, "sample_rate": None, "display_coords": None}
+    eyes = ("LEFT", "RIGHT")
+    pending = []
+
+    def flush():
+        if not pending:
+            return
+        values, bits = parse_sample_lines(pending, eyes)
+        for i, name in enumerate(SAMPLE_COLUMNS):
+            samples[name].write(values[:, i])
+        status.write(bits)
+        pending.clear()
+
+    with open(asc_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            first = line[:1]
+            if first.isdigit():
+                pending.append(line.rstrip("\r\n"))
+                if len(pending) >= chunk_lines:
+                    flush()
+                continue
+
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == "MSG":
+                # MSG <time> [<offset>] <text>
+                time, _, text = line.rstrip("\r\n").partition("\t")[2].partition(" ")
+                time, text = message_time(float(time), text.strip())
+                messages.append((time, text))
+                if text.startswith("DISPLAY_COORDS"):
+                    meta["display_coords"] = [float(v) for v in text.split()[1:5]]
+            elif parts[0] == "START":
+                # samples after a START follow its eye layout
+                flush()
+                eyes = tuple(eye for eye in ("LEFT", "RIGHT") if eye in parts[2:])
+                meta["eyes"] = list(eyes)
+                blocks.append([float(parts[1]), None])
+            elif parts[0] == "END":
+                flush()
+                if blocks:
+                    blocks[-1][1] = float(parts[1])
+            elif parts[0] == "SAMPLES" and "RATE" in parts:
+                meta["sample_rate"] = float(parts[parts.index("RATE") + 1])
+            elif parts[0] in ("EFIX", "ESACC", "EBLINK"):
+                events.append(_parse_event(parts))
+    flush()
+
+    for writer in list(samples.values()) + [status]:
+        writer.close()
+    meta["samples"] = samples["time"].count
+    meta["blocks"] = blocks
+    if meta["sample_rate"] is None and meta["samples"] > 1:
+        time = np.load(os.path.join(out_dir, "samples", "time.npy"), mmap_mode="r")
+        meta["sample_rate"] = round(1000 / float(np.median(np.diff(time[: min(len(time), 10000)]))))
+
+    _write_events(os.path.join(out_dir, "events"), events)
+    _write_messages(os.path.join(out_dir, "messages"), messages)
+    meta["event_types"] = list(EVENT_TYPES)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if parquet:
+        write_parquet(out_dir)
+    return meta
+
+
+def _write_events(path, events):
+    os.makedirs(path, exist_ok=True)
+    values = np.array([e[2] for e in events], np.float64).reshape(-1, len(EVENT_COLUMNS))
+    np.save(os.path.join(path, "type.npy"), np.array([e[0] for e in events], np.int8))
+    np.save(os.path.join(path, "eye.npy"), np.array([e[1] for e in events], np.int8))
+    for i, name in enumerate(EVENT_COLUMNS):
+        np.save(os.path.join(path, name + ".npy"), values[:, i])
+
+
+def _write_messages(path, messages):
+    os.makedirs(path, exist_ok=True)
+    messages.sort(key=lambda m: m[0])
+    np.save(os.path.join(path, "time.npy"), np.array([m[0] for m in messages], np.float64))
+    np.save(os.path.join(path, "text.npy"), np.array([m[1] for m in messages], dtype=str))
+    syncs = [(t, int(match.group(1))) for t, text in messages if (match := _SYNC.match(text))]
+    np.save(os.path.join(path, "sync_time.npy"), np.array([s[0] for s in syncs], np.float64))
+    np.save(os.path.join(path, "sync_code.npy"), np.array([s[1] for s in syncs], np.int64))
+
+
+def is_asc(path):
+    """Whether `path` is an ASC export (the simulated tracker's data files are), not a binary EDF."""
+    with open(path, "rb") as f:
+        return f.read(2) == b"**"
+
+
+def edf_to_asc(edf_path, out_dir):
+    """Runs SR Research's edf2asc on `edf_path`, returns the path of the ASC file."""
+    edf2asc = shutil.which("edf2asc")
+    if edf2asc is None:
+        raise RuntimeError("edf2asc not found, install the EyeLink Developers Kit or convert the EDF to ASC first.")
+    subprocess.run([edf2asc, "-y", "-p", out_dir, edf_path], check=True, stdout=subprocess.DEVNULL)
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(edf_path))[0] + ".asc")
+
+
+def write_parquet(out_dir):
+    """Writes samples, events and messages of a converted recording as Parquet files."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Writing Parquet needs pyarrow (pip install pyarrow).") from None
+
+    recording = Recording(out_dir)
+    for name in ("samples", "events", "messages"):
+        table = getattr(recording, name)
+        if name == "messages":
+            # the SYNC index has its own length
+            table = {"time": table["time"], "text": table["text"]}
+        columns = {column: np.asarray(values) for column, values in table.items()}
+        pq.write_table(pa.table(columns), os.path.join(out_dir, name + ".parquet"))
+
+
+class Recording:
+    """A converted recording, with every column memory-mapped.
+
+    `samples`, `events` and `messages` map column names to arrays; nothing is read from
+    disk until it is used.
+
+    Args:
+        path (str): directory written by `convert`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.samples = self._columns("samples")
+        self.events = self._columns("events")
+        self.messages = self._columns("messages")
+
+    def _columns(self, table):
+        folder = os.path.join(self.path, table)
+        return {
+            name[:-4]: np.load(os.path.join(folder, name), mmap_mode="r")
+            for name in sorted(os.listdir(folder))
+            if name.endswith(".npy")
+        }
+
+    def between(self, start, end):
+        """Samples with start <= time < end, as views into the mapped columns."""
+        time = self.samples["time"]
+        i, j = np.searchsorted(time, (start, end))
+        return {name: column[i:j] for name, column in self.samples.items()}
+
+    def sync_times(self, code):
+        """Tracker times of every SYNC message with `code`."""
+        return self.messages["sync_time"][self.messages["sync_code"] == code]
+
+    def trials(self, start_code, end_code=None, before=0, after=0):
+        """Samples of every trial starting at a SYNC `start_code`.
+
+        A trial runs until the next SYNC `end_code`, or the next `start_code` when no end
+        code is given (the last trial then runs to the end of the recording). `before` and
+        `after` widen the window, in ms.
+        """
+        starts = self.sync_times(start_code)
+        ends = self.sync_times(end_code if end_code is not None else start_code)
+        trials = []
+        for start in starts:
+            later = ends[ends > start]
+            end = later[0] if len(later) else np.inf
+            trials.append(self.between(start - before, end + after))
+        return trials
+
+
+def load(path):
+    return Recording(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="ASC file, or EDF file to convert with edf2asc")
+    parser.add_argument("out_dir", help="directory to write the columns to")
+    parser.add_argument("--parquet", action="store_true", help="also write Parquet files (needs pyarrow)")
+    parser.add_argument("--chunk-lines", type=int, default=CHUNK_LINES, help="sample lines parsed at a time")
+    args = parser.parse_args()
+
+    if not is_asc(args.source):
+        with tempfile.TemporaryDirectory() as tmp:
+            meta = convert(edf_to_asc(args.source, tmp), args.out_dir, args.chunk_lines, args.parquet)
+    else:
+        meta = convert(args.source, args.out_dir, args.chunk_lines, args.parquet)
+    print("%d samples, %d recording blocks, written to %s" % (meta["samples"], len(meta["blocks"]), args.out_dir))
+
+
+if __name__ == "__main__":
+    main()
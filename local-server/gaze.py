@@ -0,0 +1,279 @@
+import numpy as np
+
+from stats import RunningMoments
+
+
+def combine_eyes(samples):
+    """Returns (N, 2) gaze from (N, 2) monocular or (N, 4) binocular samples.
+
+    Binocular samples are laid out as left x, left y, right x, right y and are averaged,
+    falling back to whichever eye is present when the other one is missing (NaN).
+    """
+    if samples.shape[1] == 4:
+        left = samples[:, :2]
+        right = samples[:, 2:]
+        return np.where(np.isnan(left), right, np.where(np.isnan(right), left, (left + right) * 0.5))
+    return samples.astype(float, copy=True)
+
+
+class GazeCheck:
+    """Vectorized fixation check against a circular (or, on non-square pixels, elliptical)
+    window.
+
+    The window center and the squared pixel threshold are computed once, so checking a
+    block of samples is a handful of array operations no matter how many samples it holds.
+    """
+
+    __slots__ = ("center", "max_dist", "max_dist_sq", "scale")
+
+    def __init__(self, max_dist, center):
+        """
+        Args:
+            max_dist (float or tuple): radius of the fixation window in pixels, or an
+                (x, y) pair of radii (see MonitorProfile.threshold).
+            center (tuple): (x, y) center of the window in screen pixels.
+        """
+        self.center = np.asarray(center, dtype=float)
+        radii = np.broadcast_to(np.asarray(max_dist, dtype=float), (2,))
+        self.max_dist = tuple(float(r) for r in radii)
+
+        if radii[0] == radii[1]:
+            self.scale = None
+            self.max_dist_sq = radii[0] ** 2
+        else:
+            # measure distance in units of the window radius along each axis
+            self.scale = 1 / radii
+            self.max_dist_sq = 1.0
+
+    def gaze(self, samples):
+        """Returns (N, 2) gaze relative to the window center, see combine_eyes."""
+        gaze = combine_eyes(samples)
+        gaze -= self.center
+        return gaze
+
+
+class GazeQuality:
+    """Gaze quality summary of one trial, kept up to date sample block by sample block.
+
+    Memory doesn't depend on the length of the trial: gaze mean and spread are running
+    moments, deviation is a running max, and fixations and blinks are counted from the
+    events of an online detector as they happen.
+
+    Args:
+        center (tuple): (x, y) point deviation is measured from, in screen pixels.
+        detector (EventDetector): online detector fed every sample, also gives the
+            degrees per pixel.
+    """
+
+    def __init__(self, center, detector):
+        self.center = np.asarray(center, dtype=float)
+        self.detector = detector
+        self.x = RunningMoments()
+        self.y = RunningMoments()
+        self.samples = 0
+        self.lost = 0  # samples with no gaze from either eye
+        self.max_deviation = 0.0  # degrees
+        self.fixations = 0
+        self.blinks = 0
+        self.blink_time = 0.0  # ms, blinks that have ended
+        self.last_time = None
+
+    def add(self, times, samples):
+        """Adds an (N,) array of times and (N, 4) binocular samples."""
+        gaze = combine_eyes(samples)
+        valid = ~np.isnan(gaze).any(axis=1)
+        good = gaze[valid]
+        self.samples += len(gaze)
+        self.lost += len(gaze) - len(good)
+        if len(good):
+            self.x.add(good[:, 0])
+            self.y.add(good[:, 1])
+            deviation = (good - self.center) * self.detector.deg_per_pix
+            self.max_deviation = max(self.max_deviation, float(np.sqrt(np.einsum("ij,ij->i", deviation, deviation).max())))
+
+        for event, data in self.detector.update_block(times, gaze):
+            if event == "fixationStart":
+                self.fixations += 1
+            elif event == "blinkStart":
+                self.blinks += 1
+            elif event == "blinkEnd":
+                self.blink_time += data["duration"]
+        if len(times):
+            self.last_time = float(times[-1])
+
+    def summary(self):
+        """The trial's statistics, flat so they can go straight into a jsPsych data row."""
+        blink_time = self.blink_time
+        if self.detector.in_blink:
+            # still blinking when the trial ended
+            blink_time += self.last_time - self.detector.blink_start
+        return {
+            "gaze_samples": self.samples,
+            "gaze_lost_pct": 100 * self.lost / self.samples if self.samples else None,
+            "gaze_mean_x": self.x.mean if self.x.count else None,
+            "gaze_mean_y": self.y.mean if self.y.count else None,
+            "gaze_sd_x": self.x.sd,
+            "gaze_sd_y": self.y.sd,
+            "gaze_max_deviation": self.max_deviation if self.x.count else None,
+            "gaze_fixations": self.fixations,
+            "gaze_blinks": self.blinks,
+            "gaze_blink_ms": blink_time,
+        }
+
+
+class RejectionPolicy:
+    """Decides when realtime monitoring rejects a trial, sample by sample.
+
+    By default a trial is rejected on the first sample whose eye-averaged gaze is outside
+    the fixation window, and missing data never rejects. A policy can instead require gaze
+    to stay outside for `min_duration` ms (so a single noisy sample doesn't reject at
+    1 kHz), reject when data is missing for longer than `max_loss` ms (shorter gaps are
+    blinks and tolerated), check a dominant eye or either/both eyes, and only forget a
+    violation in progress once gaze is back within `release` times the window radius
+    (hysteresis). The runs of missing and outside samples of a block are found with array
+    operations, carrying the violation or data loss in progress over from the last block,
+    so a block costs a handful of array operations however many blinks and excursions it
+    holds.
+
+    Args:
+        gaze_check (GazeCheck): fixation window.
+        eye (str): "average" of both eyes (falling back to the one present), "either"
+            (rejects when either eye is outside), "both" (only when both are), "left" or
+            "right".
+        min_duration (float): ms gaze has to stay outside the window before rejecting.
+        max_loss (float, optional): ms of missing data tolerated, None to never reject on it.
+        release (float): fraction of the window radius gaze has to come back within to end
+            a violation, 1 ends it as soon as gaze is inside.
+    """
+
+    EYES = ("average", "either", "both", "left", "right")
+
+    def __init__(self, gaze_check, eye="average", min_duration=0, max_loss=None, release=1.0):
+        if eye not in self.EYES:
+            raise ValueError("eye must be set to %s." % ", ".join(self.EYES))
+        if min_duration < 0 or (max_loss is not None and max_loss < 0):
+            raise ValueError("min_duration and max_loss must not be negative.")
+        if not 0 < release <= 1:
+            raise ValueError("release must be between 0 and 1.")
+        self.gaze_check = gaze_check
+        self.eye = eye
+        self.min_duration = min_duration
+        self.max_loss = max_loss
+        self.release_sq = gaze_check.max_dist_sq * release**2
+        self.reset()
+
+    def reset(self):
+        """Forgets a violation or data loss in progress."""
+        self.violation_start = None  # time gaze left the window
+        self.loss_start = None  # time data went missing
+
+    def _dist_sq(self, gaze):
+        check = self.gaze_check
+        scaled = gaze if check.scale is None else gaze * check.scale
+        return np.einsum("ij,ij->i", scaled, scaled)
+
+    def _checked(self, samples):
+        """Gaze relative to the window center and its squared distance, per the eye rule."""
+        center = self.gaze_check.center
+        if self.eye == "average":
+            gaze = self.gaze_check.gaze(samples)
+            return gaze, self._dist_sq(gaze)
+        left = samples[:, :2] - center
+        right = samples[:, 2:] - center
+        if self.eye == "left":
+            return left, self._dist_sq(left)
+        if self.eye == "right":
+            return right, self._dist_sq(right)
+        left_sq, right_sq = self._dist_sq(left), self._dist_sq(right)
+        # fmax/fmin ignore a missing eye, so the other one decides
+        dist_sq = np.fmax(left_sq, right_sq) if self.eye == "either" else np.fmin(left_sq, right_sq)
+        farther = (left_sq >= right_sq) | np.isnan(right_sq)
+        gaze = np.where((farther if self.eye == "either" else ~farther)[:, None], left, right)
+        return np.where(np.isnan(gaze), np.where(np.isnan(left), right, left), gaze), dist_sq
+
+    def check(self, times, samples):
+        """Checks a block of (N,) times and (N, 4) binocular samples in order.
+
+        Returns:
+            None if the trial isn't rejected, otherwise (reason, time, x, y), reason being
+            "gaze" or "loss" and x, y the gaze relative to the window center (None when
+            the data was lost).
+        """
+        gaze, dist_sq = self._checked(samples)
+        missing = np.isnan(dist_sq)
+        outside = dist_sq > self.gaze_check.max_dist_sq
+        if not len(times) or (
+            self.violation_start is None and self.loss_start is None and not (outside.any() or missing.any())
+        ):
+            return None
+
+        index = np.arange(len(times))
+        loss_start = self._loss_starts(times, missing, index)
+        violation_start = self._violation_starts(times, dist_sq, outside, index)
+
+        # NaN starts compare False
+        rejected = np.zeros(len(times), bool)
+        if violation_start is not None:
+            rejected |= outside & (times - violation_start >= self.min_duration)
+        if loss_start is not None and self.max_loss is not None:
+            rejected |= missing & (times - loss_start >= self.max_loss)
+        i = int(rejected.argmax())
+        last = i if rejected[i] else len(times) - 1
+        self.loss_start = _state(loss_start, last)
+        self.violation_start = _state(violation_start, last)
+        if not rejected[i]:
+            return None
+        if missing[i]:
+            return "loss", float(times[i]), None, None
+        return "gaze", float(times[i]), float(gaze[i, 0]), float(gaze[i, 1])
+
+    def _loss_starts(self, times, missing, index):
+        """Per sample, when the data loss it is part of started (NaN if it isn't missing)."""
+        if self.loss_start is None and not missing.any():
+            return None
+        # a loss starts at the first missing sample of its run, or before the block if the
+        # block opens with one in progress
+        after_missing = np.concatenate(([self.loss_start is not None], missing[:-1]))
+        run = _latest(missing & ~after_missing, index, -1)
+        carried = np.nan if self.loss_start is None else self.loss_start
+        return np.where(missing, np.where(run >= 0, times[run], carried), np.nan)
+
+    def _violation_starts(self, times, dist_sq, outside, index):
+        """Per sample, when the violation in progress after it started (NaN if there is none)."""
+        if self.violation_start is None and not outside.any():
+            return None
+        # a violation starts at the first sample outside after the last one back within the
+        # release radius, missing samples pause it; one in progress counts as a sample outside
+        # just before the block
+        carried = -1 if self.violation_start is not None else -2
+        reset = _latest(dist_sq <= self.release_sq, index, -2)
+        last_outside = _latest(outside, index, carried)
+        before = np.concatenate(([carried], last_outside[:-1]))
+        first = _latest(outside & (before <= reset), index, -1)
+        start = np.where(first >= 0, times[first], np.nan if self.violation_start is None else self.violation_start)
+        start[last_outside <= reset] = np.nan
+        return start
+
+
+def _state(starts, i):
+    if starts is None or np.isnan(starts[i]):
+        return None
+    return float(starts[i])
+
+
+def _latest(mask, index, default):
+    """Per position, the index of the last True in `mask` up to it, or `default`."""
+    return np.maximum.accumulate(np.where(mask, index, default))
+
+
+def rejection_policy(max_dist, center, options=None):
+    """RejectionPolicy from the policy options sent by the client (see RejectionPolicy), the
+    defaults reject on the first sample outside the window"""
+    options = options or {}
+    return RejectionPolicy(
+        GazeCheck(max_dist, center),
+        eye=options.get("eye", "average"),
+        min_duration=options.get("min_duration", 0),
+        max_loss=options.get("max_loss"),
+        release=options.get("release", 1.0),
+    )
@@ -0,0 +1,74 @@
+import struct
+
+import numpy as np
+
+from samples import TIME, LEFT_X
+
+# frame header: sequence number, number of samples, reserved
+FRAME_HEADER = struct.Struct("<IHH")
+MAX_FRAME_SAMPLES = 0xFFFF
+POLICIES = ("decimate", "mean", "latest")
+
+
+class Downsampler:
+    """Reduces a stream of sample blocks to every `factor`-th sample.
+
+    Policies:
+        decimate: keep one sample out of every `factor`.
+        mean: average each group of `factor` samples (NaN-aware, so a group with one eye
+            missing keeps the other).
+        latest: keep only the newest sample of each block.
+
+    Groups carry over between blocks, so the output rate doesn't depend on how the samples
+    happened to be split into blocks.
+    """
+
+    def __init__(self, policy="decimate", factor=1):
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of %s." % ", ".join(POLICIES))
+        if int(factor) < 1:
+            raise ValueError("factor must be at least 1.")
+        self.policy = policy
+        self.factor = int(factor)
+        self.pending = None  # leftover samples of an unfinished group
+
+    def __call__(self, samples):
+        if self.policy == "latest":
+            return samples[-1:]
+        if self.factor == 1:
+            return samples
+
+        if self.pending is not None:
+            samples = np.concatenate((self.pending, samples))
+        n = len(samples) - len(samples) % self.factor
+        self.pending = samples[n:] if n < len(samples) else None
+        groups = samples[:n].reshape(-1, self.factor, samples.shape[1])
+
+        if self.policy == "decimate":
+            return groups[:, 0]
+
+        out = np.empty((len(groups), samples.shape[1]))
+        out[:, TIME] = groups[:, 0, TIME]
+        with np.errstate(invalid="ignore"):
+            count = np.sum(~np.isnan(groups[:, :, LEFT_X:]), axis=1)
+            out[:, LEFT_X:] = np.nansum(groups[:, :, LEFT_X:], axis=1) / count
+        return out
+
+
+def pack_frame(seq, samples):
+    """Packs samples into one binary gaze frame.
+
+    Layout (little endian): the FRAME_HEADER (uint32 sequence number, uint16 sample count,
+    uint16 reserved), then the sample times as float64 (ms), then left x, left y, right x,
+    right y per sample as float32 (pixels, NaN when the eye is missing). Times come first
+    so both arrays are aligned for zero-copy typed-array views in the browser.
+    """
+    samples = samples[-MAX_FRAME_SAMPLES:]
+    n = len(samples)
+    return b"".join(
+        (
+            FRAME_HEADER.pack(seq & 0xFFFFFFFF, n, 0),
+            samples[:, TIME].astype("<f8").tobytes(),
+            samples[:, LEFT_X:].astype("<f4").tobytes(),
+        )
+    )
@@ -0,0 +1,71 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class MonitorProfile:
+    """Viewing geometry of one rig.
+
+    Args:
+        distance (float): distance from headrest to screen in mm.
+        width (float): visible width of the monitor in mm.
+        resolution (tuple): (x, y) screen resolution in pixels.
+        height (float, optional): visible height of the monitor in mm. Defaults to square
+            pixels, i.e. width * resolution y / resolution x.
+    """
+
+    distance: float
+    width: float
+    resolution: tuple
+    height: float = None
+    pix_size: tuple = field(init=False, repr=False, compare=False)
+    center: tuple = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        resolution = tuple(int(r) for r in self.resolution)
+        if len(resolution) != 2:
+            raise ValueError("resolution must be (x, y) in pixels.")
+        height = self.height if self.height is not None else self.width * resolution[1] / resolution[0]
+
+        object.__setattr__(self, "resolution", resolution)
+        object.__setattr__(self, "height", float(height))
+        # mm per pixel along each axis, differs between x and y on non-square pixels
+        object.__setattr__(self, "pix_size", (self.width / resolution[0], height / resolution[1]))
+        object.__setattr__(self, "center", (resolution[0] / 2, resolution[1] / 2))
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Builds a profile from a profile name or a dict sent by the client."""
+        if spec is None:
+            return MONITOR_PROFILES["default"]
+        if isinstance(spec, str):
+            if spec not in MONITOR_PROFILES:
+                raise ValueError("Unknown monitor profile %r, expected one of %s." % (spec, ", ".join(MONITOR_PROFILES)))
+            return MONITOR_PROFILES[spec]
+        try:
+            return cls(
+                distance=float(spec["distance"]),
+                width=float(spec["width"]),
+                height=float(spec["height"]) if spec.get("height") is not None else None,
+                resolution=tuple(spec["resolution"]),
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError("Monitor profile needs distance, width and resolution.") from e
+
+    def threshold(self, degrees):
+        """(x, y) pixel extent of `degrees` visual angle, cached per profile."""
+        return _threshold(self, float(degrees))
+
+
+@lru_cache(maxsize=256)
+def _threshold(profile, degrees):
+    mm = 2 * profile.distance * np.tan(0.5 * np.deg2rad(degrees))
+    return round(mm / profile.pix_size[0]), round(mm / profile.pix_size[1])
+
+
+# rigs a client can pick by name in EyeLinkExtension's `monitor` parameter
+MONITOR_PROFILES = {
+    "default": MonitorProfile(distance=800, width=532, resolution=(1920, 1080)),
+}
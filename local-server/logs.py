@@ -0,0 +1,30 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+
+
+def start_logging(level="INFO", name="eyelink"):
+    """Sets up logger `name` to write from a background thread.
+
+    Handlers only put the record on a queue; a QueueListener thread writes it to stderr, so
+    a slow terminal never holds up a handler or a sample loop. Records below `level` are
+    dropped before any formatting. Calling it again (app.py imported both as __main__ and
+    as app, say) only sets the level. Returns the logger.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if any(isinstance(handler, logging.handlers.QueueHandler) for handler in logger.handlers):
+        return logger
+
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(message)s"))
+    listener = logging.handlers.QueueListener(records, stream)
+    listener.start()
+    # writes out whatever is still queued
+    atexit.register(listener.stop)
+
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+    return logger
@@ -0,0 +1,71 @@
+import re
+import time
+from collections import deque
+
+from actor import STATUS, SYNC
+from stats import Histogram
+
+# messages the server sends as "<offset> <text>" (app.send_synced_event), they happened
+# `offset` ms before their time stamp; other text starting with a number is left alone
+OFFSET_KEYWORDS = ("SYNC", "TRIALID", "TRIAL_RESULT")
+_OFFSET = re.compile(r"(\d+) ((?:%s) .*)" % "|".join(OFFSET_KEYWORDS), re.S)
+
+
+def message_time(t, text):
+    """When a message happened and its text, without the offset the server may have sent it with.
+
+    The Host PC stamps ``sendMessage("<offset> <text>")`` with the time it got the message
+    and keeps the offset in the text, the event itself happened `offset` ms earlier. Only
+    the server's event codes (OFFSET_KEYWORDS) are read this way.
+    """
+    match = _OFFSET.match(text)
+    if match is None:
+        return t, text
+    return t - int(match.group(1)), match.group(2)
+
+
+class TrackerMessageQueue:
+    """Sends EDF messages and status commands through the tracker's actor.
+
+    Socket.IO handlers only queue a call on the actor and return. Messages go at SYNC
+    priority, ahead of everything but other timing-critical calls. Each message is stamped
+    with the time the server received it, and is sent as ``"<offset> <text>"`` where
+    offset is how many ms ago that was, so the EDF timestamp of the message is the receive
+    time even when the link was busy.
+
+    Trial status updates only ever show the newest one on the Host PC, so pending updates
+    are coalesced and only the last one is sent, at STATUS priority.
+
+    If `log` is given, it is called with the tracker time and text of every message sent
+    (see recorder.SampleRecorder). `delay` keeps how long messages waited to be sent, in ms.
+    """
+
+    def __init__(self, actor, tracker, log=None):
+        self.actor = actor
+        self.tracker = tracker
+        self.log = log
+        # holds at most the newest status update, appending replaces the pending one
+        self.status = deque(maxlen=1)
+        self.delay = Histogram()  # only added to on the actor
+
+    def message(self, text, received=None):
+        """Queues an EDF message, `received` is a time.perf_counter() timestamp."""
+        self.actor.submit(SYNC, self._send, text, received if received is not None else time.perf_counter())
+
+    def record_status(self, text):
+        """Queues a record_status_message, replacing any update that hasn't been sent yet."""
+        self.status.append(text)
+        self.actor.submit(STATUS, self._send_status)
+
+    def _send(self, text, received):
+        waited = (time.perf_counter() - received) * 1000
+        self.delay.add(waited)
+        offset = round(waited)
+        self.tracker.sendMessage("%d %s" % (offset, text) if offset > 0 else text)
+        if self.log is not None:
+            self.log(self.tracker.trackerTime() - max(offset, 0), text)
+
+    def _send_status(self):
+        # the updates queued after this one found it still pending and left nothing to do
+        if self.status:
+            self.tracker.sendCommand("record_status_message '%s'" % self.status.popleft())
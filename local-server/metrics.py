@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from stats import Histogram
+
+
+class Metrics:
+    """Latency histograms and counters of the running server.
+
+    Recording a value costs a lock and a histogram bin increment (see stats.Histogram),
+    so it can stay on in the handlers and sample loops. Gauges (queue depths, link
+    status) are only computed when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def observe(self, name, ms):
+        """Adds a duration in ms to histogram `name`."""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(ms)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def timed(self, name, fn):
+        """Wraps `fn` so each call's duration goes to histogram `name`, errors included."""
+
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.observe(name, (time.perf_counter() - start) * 1000)
+
+        return timed
+
+    def snapshot(self):
+        with self.lock:
+            histograms = {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+            counters = dict(sorted(self.counters.items()))
+        return {"uptime": time.time() - self.started, "latency_ms": histograms, "counters": counters}
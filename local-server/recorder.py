@@ -0,0 +1,192 @@
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from samples import SAMPLE_COLUMNS
+
+# file header: magic, format version, block number, wall clock time the file was opened
+FILE_HEADER = struct.Struct("<6sBHd")
+MAGIC = b"ELREC\0"
+VERSION = 1
+# records: a block of link samples, or a message with its tracker time
+SAMPLES_RECORD = b"S"  # uint32 n, then n rows of float64 SAMPLE_COLUMNS
+MESSAGE_RECORD = b"M"  # float64 time, uint16 length, utf-8 text
+_COUNT = struct.Struct("<I")
+_MESSAGE = struct.Struct("<dH")
+_ROW_BYTES = 8 * len(SAMPLE_COLUMNS)
+
+
+class SampleRecorder:
+    """Writes every link sample and message of a session to local binary files.
+
+    A second copy of the recording that is on disk as it happens, instead of waiting for
+    the EDF transfer at the end of the session. The recorder is a reader of the session's
+    sample ring like the realtime tasks, with its own thread polling it every `interval`
+    seconds. Messages are handed over through a deque, so the writer thread that sends
+    them never waits on the disk. Sample rows come out of the ring as one contiguous block
+    and go to the file's write buffer as they are, without per-sample formatting; the
+    file is fsynced every `fsync_interval` seconds.
+
+    Each recording block (startRecording) gets its own file, `<prefix>_block<n>.elrec`,
+    which `read_log` can read while it is still being written. A new block starts at a
+    position in the sample ring, so the samples and messages from before it end up in the
+    old file however late the recorder thread gets to them.
+
+    Args:
+        read (callable): returns the samples after a cursor and the new cursor
+            (Session.read_new_samples).
+        prefix (str): path prefix of the files.
+    """
+
+    def __init__(self, read, prefix, interval=0.01, fsync_interval=1.0):
+        self.read = read
+        self.prefix = prefix
+        self.interval = interval
+        self.fsync_interval = fsync_interval
+        # messages, and the ring positions new blocks start at, in the order they came
+        self.pending = deque()
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+        self.file = None
+        self.path = None
+        self.block = 0
+        self.written = 0  # samples written
+        self.lost = 0  # samples that left the ring before the recorder got to them
+        self.last_fsync = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="sample-recorder", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Writes what is left and closes the file."""
+        self.running = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def message(self, t, text):
+        """Records a message sent to the tracker at tracker time `t`."""
+        self.pending.append((t, text))
+
+    def new_block(self, cursor):
+        """Starts a new file with the sample at ring position `cursor`."""
+        self.pending.append(cursor)
+        self.wake.set()
+
+    def _open(self):
+        self.block += 1
+        self.path = "%s_block%03d.elrec" % (self.prefix, self.block)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "ab", buffering=1 << 16)
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, self.block, time.time()))
+
+    def _close(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+    def _write_samples(self, rows):
+        rows = np.ascontiguousarray(rows, np.float64)
+        self.file.write(SAMPLES_RECORD + _COUNT.pack(len(rows)))
+        self.file.write(memoryview(rows).cast("B"))
+        self.written += len(rows)
+
+    def _write_message(self, t, text):
+        text = text.encode("utf-8")[:0xFFFF]
+        self.file.write(MESSAGE_RECORD + _MESSAGE.pack(t, len(text)) + text)
+
+    def _step(self, cursor):
+        rows, new_cursor = self.read(cursor)
+        self.lost += new_cursor - cursor - len(rows)
+        first = new_cursor - len(rows)  # ring position of rows[0]
+        pending = self.pending
+        # a block start the samples haven't reached yet holds back what came after it
+        while pending and not (isinstance(pending[0], int) and pending[0] > new_cursor):
+            item = pending.popleft()
+            if isinstance(item, int):
+                split = max(item - first, 0)
+                if split and self.file is None:
+                    self._open()
+                if split:
+                    self._write_samples(rows[:split])
+                rows, first = rows[split:], first + split
+                self._close()
+                self._open()
+            else:
+                if self.file is None:
+                    self._open()
+                self._write_message(*item)
+        if len(rows):
+            if self.file is None:
+                self._open()
+            self._write_samples(rows)
+        return new_cursor
+
+    def _run(self):
+        cursor = 0
+        try:
+            while self.running:
+                self.wake.wait(self.interval)
+                self.wake.clear()
+                cursor = self._step(cursor)
+
+                now = time.perf_counter()
+                if self.file is not None and now - self.last_fsync >= self.fsync_interval:
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    self.last_fsync = now
+
+            self._step(cursor)
+        finally:
+            # whatever was written stays readable if a read fails (the session's actor stopped, say)
+            self._close()
+
+
+def read_log(path):
+    """Reads a recorder file, returns its samples as (N, len(SAMPLE_COLUMNS)) rows and its messages.
+
+    A record cut off at the end (the file is still being written) is left out.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, block, opened = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("%s is not a sample recorder file." % path)
+
+    samples = []
+    messages = []
+    offset = FILE_HEADER.size
+    while offset < len(data):
+        kind = data[offset : offset + 1]
+        if kind == SAMPLES_RECORD:
+            if offset + 1 + _COUNT.size > len(data):
+                break
+            (n,) = _COUNT.unpack_from(data, offset + 1)
+            start = offset + 1 + _COUNT.size
+            if start + n * _ROW_BYTES > len(data):
+                break
+            samples.append(np.frombuffer(data, np.float64, n * len(SAMPLE_COLUMNS), start).reshape(n, -1))
+            offset = start + n * _ROW_BYTES
+        elif kind == MESSAGE_RECORD:
+            if offset + 1 + _MESSAGE.size > len(data):
+                break
+            t, length = _MESSAGE.unpack_from(data, offset + 1)
+            start = offset + 1 + _MESSAGE.size
+            if start + length > len(data):
+                break
+            messages.append((t, data[start : start + length].decode("utf-8")))
+            offset = start + length
+        else:
+            raise ValueError("Corrupt record at byte %d of %s." % (offset, path))
+
+    rows = np.concatenate(samples) if samples else np.empty((0, len(SAMPLE_COLUMNS)))
+    return rows, messages
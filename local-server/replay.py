@@ -0,0 +1,254 @@
+"""Replays recorded gaze through the realtime rejection check, as fast as possible.
+
+Reads recordings (recorder logs, ASC exports, EDF files or directories written by
+edfconvert), splits them into trials at their TRIALID/TRIAL_RESULT messages (or any other
+pair of message markers, e.g. SYNC codes) and runs every trial's samples through the
+RejectionPolicy that ``realtime_eyetrack`` uses, built from the same options the client
+sends. Reports which trials each policy would have rejected, so a change to the fixation
+window or the policy can be checked against a whole dataset in seconds.
+
+    python replay.py data/booth1_*.elrec --max-dist 1 1.25 1.5
+    python replay.py s01.asc s02.asc --policy '{"min_duration": 30}' --policy '{"max_loss": 100}'
+    python replay.py s01.asc --start "SYNC 10" --end "SYNC 20" --trials --json results.json
+
+Recorder files (``<session>_<time>_block<n>.elrec``) of the same session are replayed as
+one recording, the trial messages are often in a different block than the trial's samples.
+To watch a recording go through the server in real time instead, run it with
+EYELINK_BACKEND=replay (see backends.ReplayEyeLink).
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+import edfconvert
+from gaze import rejection_policy
+from geometry import MonitorProfile
+
+# recorder and samples are imported where they're used: they import pylink, whose banner
+# main sends to stderr so it stays out of the --json - output
+
+_BLOCK_FILE = re.compile(r"_block\d+\.elrec$")
+
+
+def _from_columns(recording):
+    from samples import SAMPLE_COLUMNS
+
+    rows = np.column_stack([recording.samples[name] for name in SAMPLE_COLUMNS])
+    messages = list(zip(recording.messages["time"].tolist(), recording.messages["text"].tolist()))
+    return rows, messages
+
+
+def _load_converted(path):
+    if os.path.isdir(path):
+        return _from_columns(edfconvert.load(path))
+    with tempfile.TemporaryDirectory() as tmp:
+        asc = path if edfconvert.is_asc(path) else edfconvert.edf_to_asc(path, tmp)
+        out_dir = os.path.join(tmp, "columns")
+        edfconvert.convert(asc, out_dir)
+        return _from_columns(edfconvert.load(out_dir))
+
+
+def load_recording(paths):
+    """Samples and messages of one recording.
+
+    `paths` are the recorder files of one session (see recorder.read_log), or a single ASC
+    or EDF file (converted with edfconvert first) or directory written by edfconvert.
+    Returns the samples as (N, len(SAMPLE_COLUMNS)) rows and the messages as (time, text)
+    pairs, both sorted by time.
+    """
+    from recorder import read_log
+    from samples import TIME
+
+    if isinstance(paths, str):
+        paths = [paths]
+    if paths and all(path.endswith(".elrec") for path in paths):
+        blocks = [read_log(path) for path in paths]
+        rows = np.concatenate([samples for samples, _ in blocks])
+        messages = [message for _, block_messages in blocks for message in block_messages]
+    elif len(paths) == 1:
+        rows, messages = _load_converted(paths[0])
+    else:
+        raise ValueError("Only recorder files can be combined into one recording.")
+
+    rows = rows[np.argsort(rows[:, TIME], kind="stable")]
+    messages.sort(key=lambda message: message[0])
+    return rows, messages
+
+
+def group_recordings(paths):
+    """Groups recorder files by session, every other path is a recording of its own."""
+    groups = {}
+    for path in paths:
+        key = _BLOCK_FILE.sub("", path) if path.endswith(".elrec") else path
+        groups.setdefault(key, []).append(path)
+    return {os.path.basename(key): sorted(group) for key, group in groups.items()}
+
+
+def _marked(messages, marker):
+    """(time, rest of the text) of the messages starting with `marker`."""
+    found = []
+    for t, text in messages:
+        if text == marker or text.startswith(marker + " "):
+            found.append((t, text[len(marker) :].strip()))
+    return found
+
+
+def split_trials(messages, start="TRIALID", end="TRIAL_RESULT"):
+    """(label, start, end) of every trial.
+
+    A trial starts at a `start` message, labelled with the rest of its text (or its number
+    if there is none), and runs until the next `end` message, the next `start` message or
+    the end of the recording, whichever comes first.
+    """
+    starts = _marked(messages, start)
+    ends = np.array([t for t, _ in _marked(messages, end)] if end else [])
+    trials = []
+    for i, (t, label) in enumerate(starts):
+        stop = starts[i + 1][0] if i + 1 < len(starts) else np.inf
+        later = ends[(ends > t) & (ends <= stop)]
+        trials.append((label or str(i + 1), t, float(later[0]) if len(later) else stop))
+    return trials
+
+
+def replay_trials(rows, trials, policy, offset=0, duration=None):
+    """Runs the samples of each trial through `policy`, like a ``realtime_eyetrack`` started
+    `offset` ms after the trial start and running for `duration` ms (the whole trial by
+    default).
+
+    Returns a dict per trial: its label, start time, number of samples checked, and whether
+    it was rejected, with the reason, the ms since the trial start and the gaze relative to
+    the window center when it was.
+    """
+    from samples import LEFT_X, TIME
+
+    times = rows[:, TIME]
+    results = []
+    for label, start, end in trials:
+        begin = start + offset
+        stop = min(end, begin + duration) if duration is not None else end
+        i, j = np.searchsorted(times, (begin, stop))
+        policy.reset()
+        rejection = policy.check(times[i:j], rows[i:j, LEFT_X:])
+        result = {"trial": label, "start": start, "samples": int(j - i), "rejected": rejection is not None}
+        if rejection is not None:
+            reason, t, x, y = rejection
+            result.update(reason=reason, time=t - start, x=x, y=y)
+        results.append(result)
+    return results
+
+
+def summarize(results):
+    rejected = [r for r in results if r["rejected"]]
+    return {
+        "trials": len(results),
+        "rejected": len(rejected),
+        "rejected_pct": 100 * len(rejected) / len(results) if results else None,
+        "reasons": dict(Counter(r["reason"] for r in rejected)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recordings", nargs="+", help="recorder files, ASC/EDF files or edfconvert directories")
+    parser.add_argument(
+        "--max-dist", type=float, nargs="+", default=[1.25], help="fixation window radii to try, in degrees"
+    )
+    parser.add_argument(
+        "--policy",
+        type=json.loads,
+        action="append",
+        help="rejection policy options as JSON (eye, min_duration, max_loss, release), repeat to compare",
+    )
+    parser.add_argument("--monitor", default=None, help="monitor profile name or JSON, default the default profile")
+    parser.add_argument("--start", default="TRIALID", help="message marking a trial start, default TRIALID")
+    parser.add_argument("--end", default="TRIAL_RESULT", help="message marking a trial end, default TRIAL_RESULT")
+    parser.add_argument("--offset", type=float, default=0, help="ms after the trial start monitoring begins")
+    parser.add_argument("--duration", type=float, help="ms of each trial to monitor, default the whole trial")
+    parser.add_argument("--trials", action="store_true", help="list every rejected trial")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON to PATH ('-' for stdout)")
+    args = parser.parse_args()
+    with contextlib.redirect_stdout(sys.stderr):
+        import pylink  # noqa: F401
+
+    monitor = args.monitor
+    if monitor is not None and monitor.lstrip().startswith("{"):
+        monitor = json.loads(monitor)
+    try:
+        profile = MonitorProfile.from_spec(monitor)
+        configs = [
+            (max_dist, options, rejection_policy(profile.threshold(max_dist), profile.center, options))
+            for max_dist in args.max_dist
+            for options in args.policy or [{}]
+        ]
+    except ValueError as e:
+        parser.error(str(e))
+
+    started = time.perf_counter()
+    recordings = {}
+    for name, paths in group_recordings(args.recordings).items():
+        rows, messages = load_recording(paths)
+        recordings[name] = (rows, split_trials(messages, args.start, args.end))
+    loaded = time.perf_counter()
+
+    results = []
+    for max_dist, options, policy in configs:
+        trials = []
+        for name, (rows, recording_trials) in recordings.items():
+            for result in replay_trials(rows, recording_trials, policy, args.offset, args.duration):
+                trials.append(dict(result, recording=name))
+        results.append({"max_dist": max_dist, "policy": options, "summary": summarize(trials), "trials": trials})
+    replayed = time.perf_counter()
+
+    samples = sum(len(rows) for rows, _ in recordings.values())
+    report = {
+        "recordings": {name: {"samples": len(rows), "trials": len(trials)} for name, (rows, trials) in recordings.items()},
+        "load_s": loaded - started,
+        "replay_s": replayed - loaded,
+        "results": results,
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    trial_count = sum(len(trials) for _, trials in recordings.values())
+    print(
+        "%d recordings, %d trials, %d samples, loaded in %.2f s, %d policies replayed in %.2f s"
+        % (len(recordings), trial_count, samples, loaded - started, len(configs), replayed - loaded)
+    )
+    print("%-8s %-40s %8s %9s  %s" % ("max deg", "policy", "rejected", "%", "reasons"))
+    for result in results:
+        summary = result["summary"]
+        print(
+            "%-8g %-40s %8d %9.1f  %s"
+            % (
+                result["max_dist"],
+                json.dumps(result["policy"]),
+                summary["rejected"],
+                summary["rejected_pct"] if summary["rejected_pct"] is not None else np.nan,
+                ", ".join("%s %d" % item for item in sorted(summary["reasons"].items())),
+            )
+        )
+        if args.trials:
+            for trial in result["trials"]:
+                if trial["rejected"]:
+                    print(
+                        "    %s trial %s: %s at %.0f ms"
+                        % (trial["recording"], trial["trial"], trial["reason"], trial["time"])
+                    )
+
+
+if __name__ == "__main__":
+    main()
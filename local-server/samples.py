@@ -0,0 +1,118 @@
+import numpy as np
+import pylink
+
+# columns of a buffered sample row; gaze is in screen pixels, missing eyes are NaN
+SAMPLE_COLUMNS = ("time", "left_x", "left_y", "right_x", "right_y")
+TIME, LEFT_X, LEFT_Y, RIGHT_X, RIGHT_Y = range(len(SAMPLE_COLUMNS))
+
+
+class SampleRing:
+    """Fixed-size ring buffer of link samples.
+
+    Every row written gets a sequence number that keeps increasing across wrap-arounds, so
+    each reader can keep its own cursor and ask for everything it hasn't seen with `since`.
+    Readers register with `attach` and `detach`; rows written while there are none are
+    nobody's loss and never count as dropped.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.data = np.full((capacity, len(SAMPLE_COLUMNS)), np.nan)
+        self.count = 0  # total number of rows ever written
+        self.read = 0  # sequence number the furthest reader has read up to
+        self.readers = 0
+        self.dropped = 0  # rows overwritten before any reader got to them, each counted once
+
+    def extend(self, rows):
+        """Appends an (N, len(SAMPLE_COLUMNS)) array of samples."""
+        # rows from here on that no reader has seen yet are lost once they are overwritten
+        unread = max(self.read, self.count - self.capacity)
+        n = len(rows)
+        if n > self.capacity:
+            rows = rows[-self.capacity :]
+            self.count += n - self.capacity
+            n = self.capacity
+
+        start = self.count % self.capacity
+        first = min(n, self.capacity - start)
+        self.data[start : start + first] = rows[:first]
+        self.data[: n - first] = rows[first:]
+        self.count += n
+        if self.readers:
+            self.dropped += max(0, self.count - self.capacity - unread)
+        else:
+            self.read = self.count
+
+    def attach(self):
+        """Registers a reader, returns its cursor: it reads the rows written from now on."""
+        self.readers += 1
+        self.read = max(self.read, self.count)
+        return self.count
+
+    def detach(self):
+        self.readers -= 1
+
+    def since(self, seq):
+        """Returns the rows written after sequence number `seq` and the new cursor.
+
+        If the reader fell more than `capacity` rows behind, the oldest rows are gone and
+        only the newest `capacity` rows are returned; the new cursor minus `seq` minus the
+        rows returned is how many this reader missed.
+        """
+        self.read = max(self.read, self.count)
+        return self._rows(seq), self.count
+
+    def newest(self, n):
+        """The last `n` rows written (at most `capacity`), without counting them as read."""
+        return self._rows(self.count - n)
+
+    def _rows(self, seq):
+        seq = max(seq, self.count - self.capacity)
+        n = self.count - seq
+        if n <= 0:
+            return self.data[:0]
+
+        start = seq % self.capacity
+        if start + n <= self.capacity:
+            return self.data[start : start + n].copy()
+        return np.concatenate((self.data[start:], self.data[: start + n - self.capacity]))
+
+
+def _eye_gaze(eye):
+    x, y = eye.getGaze()
+    if x == pylink.MISSING_DATA or y == pylink.MISSING_DATA:
+        return np.nan, np.nan
+    return x, y
+
+
+def drain_link_samples(tracker, ring):
+    """Moves every sample queued on the link into `ring`.
+
+    Events (fixations, saccades, ...) are skipped. Backends that can hand over all queued
+    samples at once (see backends.SimulatedEyeLink.read_samples) are read in one block.
+    Returns the number of samples read.
+    """
+    read_samples = getattr(tracker, "read_samples", None)
+    if read_samples is not None:
+        rows = read_samples()
+        if rows is None:
+            return 0
+        ring.extend(rows)
+        return len(rows)
+
+    rows = []
+    while True:
+        data_type = tracker.getNextData()
+        if not data_type:
+            break
+        if data_type != pylink.SAMPLE_TYPE:
+            continue
+
+        sample = tracker.getFloatData()
+        lx, ly = _eye_gaze(sample.getLeftEye()) if sample.isLeftSample() else (np.nan, np.nan)
+        rx, ry = _eye_gaze(sample.getRightEye()) if sample.isRightSample() else (np.nan, np.nan)
+        rows.append((sample.getTime(), lx, ly, rx, ry))
+
+    if rows:
+        ring.extend(np.array(rows, dtype=float))
+    return len(rows)
@@ -0,0 +1,228 @@
+import warnings
+
+import numpy as np
+
+from actor import COMMAND, KEY, POLL, SYNC, ActorBound, TrackerActor
+from backends import close_tracker, open_graphics, receive_data_file
+from messages import TrackerMessageQueue
+from recorder import SampleRecorder
+from samples import LEFT_X, SampleRing, drain_link_samples
+
+
+class Session:
+    """One booth: a tracker connection and everything that belongs to it.
+
+    A session is created as soon as a client asks for it and starts out with no tracker;
+    connecting and configuring the tracker happens in the background and ends with
+    `attach` (or `fail`), so handlers have to check `ready` before using it.
+
+    Clients of a booth share a Socket.IO room named after the session. The session owns the
+    tracker, its EDF file and settings, the custom display that sends calibration graphics
+    to the room, the link sample buffer its realtime tasks read from, and the tracker's
+    actor (see actor.TrackerActor), the one thread that calls the tracker: it connects it,
+    sends messages, reads samples and runs blocking calls (calibration, drift correction,
+    starting/stopping recording), by priority. A booth that is calibrating never holds up
+    another booth's handlers or sample loops, and keeps sending its own event codes.
+
+    Args:
+        room (str): session name, also the Socket.IO room of its clients.
+        display: custom display for calibration, sending to `room`.
+        edf_filename (str): EDF file to open on the Host PC.
+        eye (str): LEFT, RIGHT or BOTH.
+        settings (dict): tracking settings to configure the tracker with.
+        sample_log (str, optional): path prefix of local sample log files; if given, every
+            link sample and message is also written to disk (see recorder.SampleRecorder).
+    """
+
+    def __init__(self, room, display, edf_filename, eye, settings, sample_log=None):
+        self.room = room
+        self.tracker = None
+        self.state = "opening"  # then "ready" or "error", and "ending" and "ended" once ended
+        self.recording = False  # only changed on the actor
+        self.error = None
+        self.display = display
+        self.edf_filename = edf_filename
+        self.eye = eye
+        self.settings = settings
+        self.clients = set()
+        # link samples shared by every realtime task of the session, each keeps its own cursor
+        self.samples = SampleRing()
+        self.samples_missing = 0  # samples read with no gaze from either eye
+        # port codes and trial status labels are queued on the actor so handlers never wait on the link
+        self.messages = None
+        self.recorder = SampleRecorder(self.read_new_samples, sample_log) if sample_log else None
+        self.actor = TrackerActor("session-%s" % room)
+        self.actor.start()
+        # calibration blocks the actor, the display lets queued calls through once per frame
+        display.pump = self.actor.pump
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def open(self, connect, *args):
+        """Runs `connect(*args)` on the actor, which owns the tracker it returns from then on.
+
+        Returns the tracker, see `attach`.
+        """
+        return self.actor.call(COMMAND, connect, *args)
+
+    def attach(self, tracker):
+        """Hands the session its connected and configured tracker."""
+        # from here on only the actor may call it
+        self.tracker = ActorBound(tracker, self.actor)
+        log = self.recorder.message if self.recorder else None
+        self.messages = TrackerMessageQueue(self.actor, self.tracker, log=log)
+        if self.recorder is not None:
+            # no samples have been read yet, the recorder's cursor starts at 0
+            self.samples.attach()
+            self.recorder.start()
+        self.state = "ready"
+
+    def fail(self, error):
+        self.error = error
+        self.state = "error"
+        self.actor.stop(wait=False)
+
+    def submit(self, fn, *args, priority=COMMAND):
+        """Runs a tracker call on the session's actor, returns a Future."""
+        future = self.actor.submit(priority, fn, *args)
+        future.add_done_callback(self._report)
+        return future
+
+    def _report(self, future):
+        # nobody waits on most of these futures, so errors would otherwise go unnoticed
+        if not future.cancelled() and future.exception() is not None:
+            warnings.warn("Session %s: %r" % (self.room, future.exception()), RuntimeWarning)
+
+    def start_recording(self, keep=False, timeout=1000):
+        """Starts a recording block, returns a Future that is done once samples are coming in.
+
+        The Future's result is True if a block was started, False if `keep` is set and the
+        tracker was already recording (for continuous recording, where a block spans many
+        trials).
+        """
+
+        def run():
+            if keep and self.recording:
+                return False
+            # the new block's samples go to a file of their own
+            if self.recorder is not None:
+                self._drain()
+                self.recorder.new_block(self.samples.count)
+            error = self.tracker.startRecording(1, 1, 1, 1)
+            if error:
+                raise RuntimeError("Could not start recording (%d)." % error)
+            self.recording = True
+            # the tracker takes a moment to switch modes, messages sent before samples arrive can be lost
+            if not self.tracker.waitForBlockStart(timeout, 1, 0):
+                raise RuntimeError("No samples %d ms after starting to record." % timeout)
+            return True
+
+        return self.submit(run)
+
+    def _stop_recording(self):
+        self.tracker.stopRecording()
+        self.recording = False
+
+    def stop_recording(self):
+        return self.submit(self._stop_recording)
+
+    def send_key(self, key, modifier, state):
+        return self.submit(self.tracker.sendKeybutton, key, modifier, state, priority=KEY)
+
+    def tracker_time(self):
+        """Current tracker time in ms."""
+        return self.actor.call(SYNC, self.tracker.trackerTime)
+
+    def call(self, fn, *args, priority=POLL):
+        """Runs `fn(tracker, *args)` on the actor and waits for its result."""
+        return self.actor.call(priority, fn, self.tracker, *args)
+
+    def _with_display(self, fn, *args):
+        # a continuous recording block ends here, setup and drift correction need the tracker offline
+        if self.recording:
+            self._stop_recording()
+        open_graphics(self.tracker, self.display)
+        return fn(*args)
+
+    def calibrate(self):
+        return self.submit(self._with_display, self.tracker.doTrackerSetup)
+
+    def drift_correct(self, x, y):
+        def run():
+            self.tracker.doDriftCorrect(x, y, 1, 1)
+            self.tracker.applyDriftCorrect()
+
+        return self.submit(self._with_display, run)
+
+    def end(self, dest, progress=None):
+        """Ends the session and copies its EDF file to `dest`, returns a Future of the file size.
+
+        Whatever is already queued on the actor (a last stopRecording, say) runs first,
+        pending messages included, and the tracker is disconnected afterwards, whether or
+        not the copy worked. Stop the actor once the Future is done.
+
+        Waits for the recorder to write its last samples, which can take as long as the
+        call the actor is busy with, so call it from a background task once the session's
+        sample tasks have stopped.
+        """
+        self.state = "ending"
+        # its last samples are read through the actor, after any stopRecording queued before
+        if self.recorder is not None:
+            self.recorder.stop()
+        return self.submit(self._end, dest, progress)
+
+    def _end(self, dest, progress):
+        try:
+            return receive_data_file(self.tracker, self.edf_filename, dest, progress)
+        finally:
+            close_tracker(self.tracker)
+            self.state = "ended"
+
+    def _drain(self):
+        n = drain_link_samples(self.tracker, self.samples)
+        if n:
+            rows = self.samples.newest(n)
+            self.samples_missing += int(np.isnan(rows[:, LEFT_X:]).all(axis=1).sum())
+        return n
+
+    def add_reader(self):
+        """Registers a reader of the link samples, returns its cursor (see SampleRing.attach).
+
+        The link is drained first, so the reader only gets samples recorded from now on.
+        """
+
+        def attach():
+            self._drain()
+            return self.samples.attach()
+
+        return self.actor.call(POLL, attach)
+
+    def remove_reader(self):
+        self.actor.submit(POLL, self.samples.detach)
+
+    def _read_new_samples(self, cursor):
+        self._drain()
+        return self.samples.since(cursor)
+
+    def read_new_samples(self, cursor):
+        """Drains the link and returns the samples after `cursor` and the new cursor."""
+        return self.actor.call(POLL, self._read_new_samples, cursor)
+
+    def link_status(self, timeout=0.1):
+        """Returns "connected", "disconnected", or "busy" if the actor is in the middle of a long call."""
+        if self.tracker is None:
+            return "disconnected"
+        try:
+            connected = self.actor.submit(POLL, self.tracker.isConnected).result(timeout)
+        except TimeoutError:
+            return "busy"
+        except Exception:
+            return "disconnected"
+        return "connected" if connected else "disconnected"
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.stop()
+        self.actor.stop()
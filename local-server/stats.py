@@ -0,0 +1,91 @@
+import math
+
+import numpy as np
+
+
+class Histogram:
+    """Fixed-size histogram with log-spaced bins, for latencies in ms.
+
+    Adding a value is O(1) and memory doesn't grow with the number of values, so it can
+    stay on for a whole session. Percentiles are accurate to the bin width (about 5%).
+    """
+
+    def __init__(self, low=0.01, high=10000.0, bins_per_decade=48):
+        self.low = low
+        self.scale = bins_per_decade / math.log(10)
+        self.counts = np.zeros(int(math.ceil(math.log(high / low) * self.scale)) + 2, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = -math.inf
+        self.min = math.inf
+
+    def _bin(self, value):
+        if value < self.low:
+            return 0
+        return min(int(math.log(value / self.low) * self.scale) + 1, len(self.counts) - 1)
+
+    def add(self, value):
+        value = float(value)
+        self.counts[self._bin(value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.min = min(self.min, value)
+
+    def percentile(self, q):
+        """Approximate q-th percentile (0-100), the geometric middle of its bin."""
+        if not self.count:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.count))
+        if index == 0:
+            return self.low
+        value = self.low * math.exp((index - 0.5) / self.scale)
+        return min(max(value, self.min), self.max)
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class RunningMoments:
+    """Running count, mean and variance of a stream of values (Welford's algorithm).
+
+    Blocks of values are merged in with the parallel form of the update (Chan et al.), so
+    a block costs a few array reductions and memory stays constant however long it runs.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+
+    def add(self, values):
+        """Adds an array of values."""
+        n = len(values)
+        if not n:
+            return
+        mean = float(np.mean(values))
+        m2 = float(np.sum((values - mean) ** 2))
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta**2 * self.count * n / total
+        self.count = total
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def sd(self):
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the server modules import each other by name, as they do when run from local-server
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
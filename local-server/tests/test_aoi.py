@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from aoi import AoiIndex, AoiTracker, Circle, Polygon, Rect, aoi_from_spec
+
+NAN = np.nan
+
+
+def test_shapes_contain():
+    assert Rect("r", 10, 10, 20, 10).contains(30, 20)
+    assert not Rect("r", 10, 10, 20, 10).contains(31, 20)
+    assert Circle("c", 0, 0, 5).contains(3, 4)
+    assert not Circle("c", 0, 0, 5).contains(4, 4)
+    triangle = Polygon("p", [(0, 0), (10, 0), (0, 10)])
+    assert triangle.contains(2, 2)
+    assert not triangle.contains(8, 8)
+
+
+def test_aoi_from_spec_rejects_bad_specs():
+    with pytest.raises(ValueError):
+        aoi_from_spec({"id": "a", "shape": "star"})
+    with pytest.raises(ValueError):
+        aoi_from_spec({"shape": "rect", "x": 0, "y": 0, "width": 1, "height": 1})
+    with pytest.raises(ValueError):
+        aoi_from_spec({"id": "a", "shape": "circle", "x": 0})
+    with pytest.raises(ValueError):
+        aoi_from_spec({"id": "a", "shape": "polygon", "points": [[0, 0], [1, 1]]})
+
+
+def test_index_matches_brute_force():
+    rng = np.random.default_rng(1)
+    aois = [Rect("r%d" % i, *rng.uniform(0, 1800, 2), *rng.uniform(10, 300, 2)) for i in range(40)]
+    aois += [Circle("c%d" % i, *rng.uniform(0, 1900, 2), rng.uniform(5, 150)) for i in range(40)]
+    index = AoiIndex(aois, cell_size=64)
+    for x, y in rng.uniform(-50, 1950, size=(2000, 2)):
+        assert index.hits(x, y) == frozenset(aoi.id for aoi in aois if aoi.contains(x, y))
+
+
+def test_overlapping_aois_both_hit():
+    index = AoiIndex([Rect("a", 0, 0, 100, 100), Circle("b", 100, 100, 50)])
+    assert index.hits(90, 90) == {"a", "b"}
+    assert index.hits(10, 10) == {"a"}
+    assert index.hits(500, 500) == frozenset()
+
+
+def run(tracker, points, start=0):
+    times = np.arange(start, start + len(points), dtype=float)
+    return tracker.update(times, np.array(points, dtype=float))
+
+
+def test_enter_dwell_exit():
+    tracker = AoiTracker([{"id": "a", "shape": "rect", "x": 0, "y": 0, "width": 100, "height": 100, "dwell": 3}])
+    events = run(tracker, [(200, 200), (50, 50), (50, 50), (50, 50), (50, 50), (50, 50), (200, 200)])
+    assert [(name, data["time"]) for name, data in events] == [
+        ("aoiEnter", 1),
+        ("aoiDwell", 4),
+        ("aoiExit", 6),
+    ]
+    assert events[-1][1]["dwell"] == 5
+
+
+def test_blinks_keep_the_current_aoi():
+    tracker = AoiTracker([{"id": "a", "shape": "circle", "x": 50, "y": 50, "radius": 20}])
+    events = run(tracker, [(50, 50), (NAN, NAN), (NAN, NAN), (50, 50)])
+    assert [name for name, _ in events] == ["aoiEnter"]
+    assert tracker.close(10) == [("aoiExit", {"id": "a", "time": 10, "dwell": 10})]
+
+
+def test_duplicate_ids_are_rejected():
+    spec = {"id": "a", "shape": "rect", "x": 0, "y": 0, "width": 1, "height": 1}
+    with pytest.raises(ValueError):
+        AoiTracker([spec, spec])
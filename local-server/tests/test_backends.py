@@ -0,0 +1,69 @@
+import pytest
+
+import backends
+from backends import close_tracker, open_tracker, send_commands
+
+
+class FakeEyeLink:
+    def __init__(self, address=None):
+        self.address = address
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_pylink(monkeypatch):
+    monkeypatch.setattr(backends.pylink, "EyeLink", FakeEyeLink)
+    yield
+    if backends.PYLINK_LINK.locked():
+        backends.PYLINK_LINK.release()
+
+
+def test_one_real_tracker_per_process(fake_pylink):
+    first = open_tracker("pylink", address="100.1.1.1")
+    with pytest.raises(RuntimeError, match="one tracker per server process"):
+        open_tracker("pylink", address="100.1.2.1")
+
+    close_tracker(first)
+    assert first.closed
+    second = open_tracker("pylink", address="100.1.2.1")
+    close_tracker(second)
+    close_tracker(second)  # closing twice is harmless
+    assert not backends.PYLINK_LINK.locked()
+
+
+def test_failed_connect_frees_the_link(fake_pylink, monkeypatch):
+    def unreachable(address=None):
+        raise RuntimeError("Could not connect to tracker at %s" % address)
+
+    monkeypatch.setattr(backends.pylink, "EyeLink", unreachable)
+    with pytest.raises(RuntimeError, match="Could not connect"):
+        open_tracker("pylink", address="100.1.1.1")
+    assert not backends.PYLINK_LINK.locked()
+
+
+def test_simulated_trackers_have_no_limit(fake_pylink):
+    real = open_tracker("pylink")
+    sims = [open_tracker("sim", seed=i) for i in range(3)]
+    for sim in sims:
+        close_tracker(sim)
+    assert backends.PYLINK_LINK.locked()
+    close_tracker(real)
+
+
+def test_send_commands_reports_the_first_failure():
+    class Tracker:
+        def __init__(self):
+            self.sent = []
+
+        def sendCommand(self, command):
+            self.sent.append(command)
+            return 0 if command.startswith("ok") else len(self.sent)
+
+    tracker = Tracker()
+    assert send_commands(tracker, ["ok 1", "ok 2"]) is None
+    tracker = Tracker()
+    assert send_commands(tracker, ["ok 1", "bad 2", "bad 3", "ok 4"]) == ("bad 2", 2)
+    assert tracker.sent == ["ok 1", "bad 2", "bad 3", "ok 4"]
@@ -0,0 +1,83 @@
+import numpy as np
+
+from detection import DispersionDetector, VelocityDetector
+from geometry import MonitorProfile
+
+PROFILE = MonitorProfile.from_spec(None)
+NAN = np.nan
+
+
+def gaze_path(*segments):
+    """1 kHz samples: (ms, (x, y)) holds gaze still, (ms, (x0, y0), (x1, y1)) moves it linearly."""
+    points = []
+    for ms, start, *end in segments:
+        end = end[0] if end else start
+        for i in range(ms):
+            f = i / ms
+            points.append((start[0] + (end[0] - start[0]) * f, start[1] + (end[1] - start[1]) * f))
+    times = np.arange(len(points), dtype=float)
+    return times, np.array(points, dtype=float)
+
+
+def names(events):
+    return [name for name, _ in events]
+
+
+def test_ivt_fixation_saccade_fixation():
+    # a 380 px jump in 20 ms is 7.6 deg at ~380 deg/s on the default monitor
+    times, gaze = gaze_path((200, (960, 540)), (20, (960, 540), (1340, 540)), (200, (1340, 540)))
+    events = VelocityDetector(PROFILE).update_block(times, gaze)
+    assert names(events) == ["fixationStart", "fixationEnd", "saccadeStart", "saccadeEnd", "fixationStart"]
+    end = dict(events)["saccadeEnd"]
+    assert abs(end["amplitude"] - 7.6) < 0.5
+    assert end["peakVelocity"] > 300
+    assert abs(dict(events)["fixationEnd"]["x"] - 960) < 1
+
+
+def test_ivt_blink_ends_the_fixation():
+    times, gaze = gaze_path((100, (960, 540)), (50, (NAN, NAN)), (100, (960, 540)))
+    events = VelocityDetector(PROFILE).update_block(times, gaze)
+    assert names(events) == ["fixationStart", "fixationEnd", "blinkStart", "blinkEnd", "fixationStart"]
+    assert dict(events)["blinkEnd"]["duration"] == 50
+
+
+def test_idt_fixation_needs_min_duration():
+    detector = DispersionDetector(PROFILE, dispersion=1.0, min_duration=100)
+    times, gaze = gaze_path((100, (960, 540)))
+    assert detector.update_block(times, gaze) == []
+    events = detector.update(100.0, 960.0, 540.0)
+    assert events == [("fixationStart", {"time": 0.0, "x": 960.0, "y": 540.0})]
+
+
+def test_idt_saccade_between_fixations():
+    times, gaze = gaze_path((300, (960, 540)), (20, (960, 540), (1340, 540)), (300, (1340, 540)))
+    events = DispersionDetector(PROFILE, min_duration=100).update_block(times, gaze)
+    assert names(events) == ["fixationStart", "fixationEnd", "saccadeStart", "saccadeEnd", "fixationStart"]
+    fixation_end = dict(events)["fixationEnd"]
+    assert abs(fixation_end["x"] - 960) < 5
+    assert 280 <= fixation_end["duration"] <= 305
+    # measured from the first sample outside the fixation
+    assert 4 < dict(events)["saccadeEnd"]["amplitude"] < 7.6
+
+
+def test_idt_memory_stays_bounded_during_long_fixation():
+    detector = DispersionDetector(PROFILE, min_duration=100)
+    rng = np.random.default_rng(0)
+    times = np.arange(60000, dtype=float)
+    gaze = rng.normal((960, 540), 2, size=(len(times), 2))
+    events = detector.update_block(times, gaze)
+    assert names(events) == ["fixationStart"]
+    assert len(detector.window) == 0
+    assert all(len(e.items) == 0 for e in detector.extremes)
+    # the aggregates still describe the whole fixation
+    end = detector.interrupt(60000.0)[0][1]
+    assert end["duration"] == 60000
+    assert abs(end["x"] - gaze[:, 0].mean()) < 1e-6
+
+
+def test_idt_blink_restarts_the_window():
+    detector = DispersionDetector(PROFILE, min_duration=100)
+    times, gaze = gaze_path((150, (960, 540)), (30, (NAN, NAN)), (50, (960, 540)))
+    events = detector.update_block(times, gaze)
+    assert names(events) == ["fixationStart", "fixationEnd", "blinkStart", "blinkEnd"]
+    assert len(detector.window) == 50
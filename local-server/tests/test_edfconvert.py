@@ -0,0 +1,65 @@
+import os
+
+import edfconvert
+from backends import SimulatedEyeLink
+from messages import message_time
+
+
+def write_asc(path, messages, start=990, end=1100):
+    lines = ["** CONVERTED FROM test.edf\n", "START\t%d \tLEFT\tSAMPLES\tEVENTS\n" % start]
+    lines.append("SAMPLES\tGAZE\tLEFT\tRATE\t1000.00\n")
+    lines += ["%d\t  960.0\t  540.0\t 1000.0\t...\n" % t for t in range(start, end)]
+    lines += ["MSG\t%s\n" % message for message in messages]
+    lines.append("END\t%d \tSAMPLES\tEVENTS\n" % end)
+    with open(path, "w") as f:
+        f.writelines(lines)
+
+
+def test_offset_messages_are_moved_back(tmp_path):
+    asc = os.path.join(tmp_path, "test.asc")
+    write_asc(
+        asc, ["1001 3 SYNC 5", "1050 SYNC 6", "1060 0 SYNC 5", "1070 2 TRIAL_RESULT 1", "1080 100 trials done"]
+    )
+    edfconvert.convert(asc, os.path.join(tmp_path, "out"))
+    recording = edfconvert.load(os.path.join(tmp_path, "out"))
+
+    assert recording.messages["time"].tolist() == [998, 1050, 1060, 1068, 1080]
+    assert recording.messages["text"].tolist() == ["SYNC 5", "SYNC 6", "SYNC 5", "TRIAL_RESULT 1", "100 trials done"]
+    assert recording.sync_times(5).tolist() == [998, 1060]
+
+    trials = recording.trials(5, 6)
+    assert len(trials) == 2
+    assert trials[0]["time"][0] == 998 and trials[0]["time"][-1] == 1049
+    assert trials[1]["time"][0] == 1060 and trials[1]["time"][-1] == 1099
+
+
+def test_message_time():
+    assert message_time(1001.0, "3 SYNC 5") == (998.0, "SYNC 5")
+    assert message_time(1001.0, "12 TRIALID 7") == (989.0, "TRIALID 7")
+    assert message_time(1001.0, "SYNC 5") == (1001.0, "SYNC 5")
+    assert message_time(1001.0, "TRIALID 7") == (1001.0, "TRIALID 7")
+    # only the server's event codes carry offsets
+    assert message_time(1001.0, "100 trials done") == (1001.0, "100 trials done")
+    assert message_time(1001.0, "-2 SYNC 5") == (1001.0, "-2 SYNC 5")
+
+
+def test_simulator_keeps_offsets_like_the_host_pc(tmp_path):
+    tracker = SimulatedEyeLink("LEFT", sample_rate=1000, seed=1, sleep=lambda s: None)
+    tracker.openDataFile("test.edf")
+    tracker.startRecording(1, 1, 1, 1)
+    tracker.sendMessage("20 SYNC 5")
+    tracker.stopRecording()
+    tracker.closeDataFile()
+    asc = os.path.join(tmp_path, "test.asc")
+    assert tracker.receiveDataFile("test.edf", asc) > 0
+
+    with open(asc) as f:
+        sent = [line.split("\t")[1] for line in f if line.startswith("MSG")]
+    stamp, text = sent[-1].rstrip("\n").split(" ", 1)
+    assert text == "20 SYNC 5"
+    t, text = tracker.messages[-1]
+    assert text == "SYNC 5" and 0 <= t - (int(stamp) - 20) < 1
+
+    edfconvert.convert(asc, os.path.join(tmp_path, "out"))
+    recording = edfconvert.load(os.path.join(tmp_path, "out"))
+    assert recording.sync_times(5).tolist() == [int(stamp) - 20]
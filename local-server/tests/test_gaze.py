@@ -0,0 +1,232 @@
+import numpy as np
+import pytest
+
+from gaze import GazeCheck, combine_eyes, rejection_policy
+
+CENTER = (960, 540)
+NAN = np.nan
+
+
+def test_combine_eyes_averages_and_falls_back():
+    samples = np.array(
+        [
+            [100, 200, 110, 210],
+            [NAN, NAN, 110, 210],
+            [100, 200, NAN, NAN],
+            [NAN, NAN, NAN, NAN],
+        ]
+    )
+    gaze = combine_eyes(samples)
+    assert gaze[:3].tolist() == [[105, 205], [110, 210], [100, 200]]
+    assert np.isnan(gaze[3]).all()
+
+
+def test_gaze_is_relative_to_center():
+    check = GazeCheck(50, CENTER)
+    assert check.gaze(np.array([[970.0, 530.0]])).tolist() == [[10, -10]]
+
+
+def first_violation(max_dist, samples):
+    """The default policy's rejection of `samples` at 1 kHz."""
+    return rejection_policy(max_dist, CENTER).check(np.arange(len(samples), dtype=float), samples)
+
+
+def test_check_finds_first_sample_outside():
+    samples = np.array([[960, 540], [1000, 540], [1020, 540], [1100, 540]], dtype=float)
+    assert first_violation(50, samples) == ("gaze", 2.0, 60.0, 0.0)
+
+
+def test_check_is_none_inside_window():
+    samples = np.array([[960, 540], [1010, 540], [960, 590]], dtype=float)
+    assert first_violation(50, samples) is None
+
+
+def test_missing_samples_never_violate():
+    samples = np.array([[NAN, NAN, NAN, NAN], [NAN, NAN, 1200, 540]])
+    # the second sample falls back to the right eye, which is outside
+    assert first_violation(50, samples) == ("gaze", 1.0, 240.0, 0.0)
+    assert first_violation(50, samples[:1]) is None
+
+
+def test_elliptical_window_uses_radius_per_axis():
+    assert first_violation((100, 50), np.array([[1050.0, 540.0]])) is None
+    assert first_violation((100, 50), np.array([[960.0, 600.0]])) == ("gaze", 0.0, 0.0, 60.0)
+
+
+@pytest.mark.parametrize("block", [1, 7, 100])
+def test_block_size_does_not_change_result(block):
+    rng = np.random.default_rng(0)
+    samples = rng.normal(CENTER, 20, size=(300, 2))
+    samples[250] = (1200, 540)
+    times = np.arange(len(samples), dtype=float)
+    policy = rejection_policy(63, CENTER)
+    expected = policy.check(times, samples)
+    policy.reset()
+    for start in range(0, len(samples), block):
+        found = policy.check(times[start : start + block], samples[start : start + block])
+        if found is not None:
+            assert found == expected
+            break
+    else:
+        assert expected is None
+
+
+def trial(*segments):
+    """(times, binocular samples) of `(n, left, right)` segments at 1 kHz, offsets from CENTER or None."""
+    rows = []
+    for n, left, right in segments:
+        eyes = [(NAN, NAN) if eye is None else (CENTER[0] + eye[0], CENTER[1] + eye[1]) for eye in (left, right)]
+        rows += [eyes[0] + eyes[1]] * n
+    return np.arange(len(rows), dtype=float), np.array(rows, dtype=float)
+
+
+IN, OUT, NEAR = (0, 0), (80, 0), (40, 0)
+
+
+def test_policy_defaults_reject_on_first_sample_outside():
+    policy = rejection_policy(50, CENTER)
+    assert policy.check(*trial((5, IN, IN), (3, OUT, OUT))) == ("gaze", 5, 80.0, 0.0)
+    policy.reset()
+    assert policy.check(*trial((5, IN, IN), (500, None, None))) is None
+
+
+def test_policy_min_duration():
+    policy = rejection_policy(50, CENTER, {"min_duration": 30})
+    assert policy.check(*trial((10, IN, IN), (30, OUT, OUT), (10, IN, IN))) is None
+    policy.reset()
+    assert policy.check(*trial((10, IN, IN), (31, OUT, OUT)))[:2] == ("gaze", 40)
+
+
+@pytest.mark.parametrize("block", [1, 7, 100])
+def test_policy_state_carries_across_blocks(block):
+    times, samples = trial((10, IN, IN), (20, OUT, OUT), (15, None, None), (20, OUT, OUT))
+    policy = rejection_policy(50, CENTER, {"min_duration": 30})
+    expected = policy.check(times, samples)
+    # a blink pauses the violation that started at 10 instead of ending it
+    assert expected[:2] == ("gaze", 45)
+
+    policy.reset()
+    for start in range(0, len(times), block):
+        found = policy.check(times[start : start + block], samples[start : start + block])
+        if found is not None:
+            break
+    assert found == expected
+
+
+def test_policy_max_loss():
+    policy = rejection_policy(50, CENTER, {"max_loss": 50})
+    assert policy.check(*trial((10, IN, IN), (50, None, None), (10, IN, IN), (50, None, None))) is None
+    policy.reset()
+    assert policy.check(*trial((10, IN, IN), (51, None, None))) == ("loss", 60, None, None)
+
+
+def test_policy_release_hysteresis():
+    segments = ((10, OUT, OUT), (10, NEAR, NEAR), (20, OUT, OUT))
+    # back within the window but not within half its radius: the violation goes on
+    held = rejection_policy(50, CENTER, {"min_duration": 15, "release": 0.5})
+    assert held.check(*trial(*segments))[:2] == ("gaze", 20)
+    released = rejection_policy(50, CENTER, {"min_duration": 15})
+    assert released.check(*trial(*segments))[:2] == ("gaze", 35)
+
+
+@pytest.mark.parametrize(
+    "eye, left, right, expected",
+    [
+        ("average", OUT, IN, None),
+        ("average", OUT, None, (80.0, 0.0)),
+        ("either", IN, OUT, (80.0, 0.0)),
+        ("either", OUT, None, (80.0, 0.0)),
+        ("both", OUT, IN, None),
+        ("both", OUT, (0, 90), (80.0, 0.0)),
+        ("left", OUT, IN, (80.0, 0.0)),
+        ("right", OUT, IN, None),
+    ],
+)
+def test_policy_eyes(eye, left, right, expected):
+    policy = rejection_policy(50, CENTER, {"eye": eye})
+    found = policy.check(*trial((3, IN, IN), (3, left, right)))
+    assert (found and found[2:]) == expected
+
+
+def test_policy_reset_forgets_a_violation():
+    policy = rejection_policy(50, CENTER, {"min_duration": 10})
+    times, samples = trial((8, OUT, OUT))
+    assert policy.check(times, samples) is None
+    policy.reset()
+    assert policy.check(times + 8, samples) is None
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{"eye": "nose"}, {"min_duration": -1}, {"max_loss": -5}, {"release": 0}, {"release": 1.5}],
+)
+def test_policy_rejects_bad_options(options):
+    with pytest.raises(ValueError):
+        rejection_policy(50, CENTER, options)
+
+
+def oracle_check(policy, times, samples):
+    """RejectionPolicy.check as a plain per-sample state machine."""
+    gaze, dist_sq = policy._checked(samples)
+    for i, t in enumerate(times.tolist()):
+        if np.isnan(dist_sq[i]):
+            # a blink pauses a violation in progress rather than ending it
+            if policy.loss_start is None:
+                policy.loss_start = t
+            if policy.max_loss is not None and t - policy.loss_start >= policy.max_loss:
+                return "loss", t, None, None
+            continue
+        policy.loss_start = None
+        if dist_sq[i] > policy.gaze_check.max_dist_sq:
+            if policy.violation_start is None:
+                policy.violation_start = t
+            if t - policy.violation_start >= policy.min_duration:
+                return "gaze", t, float(gaze[i, 0]), float(gaze[i, 1])
+        elif dist_sq[i] <= policy.release_sq:
+            policy.violation_start = None
+    return None
+
+
+def random_trial(seed, n=1000):
+    """Fixation with blinks, excursions and drift near the window edge, per eye."""
+    rng = np.random.default_rng(seed)
+    segments = []
+    while sum(segment[0] for segment in segments) < n:
+        kind = rng.choice(["in", "near", "out", "blink", "one"], p=[0.4, 0.2, 0.2, 0.1, 0.1])
+        length = int(rng.integers(1, 40))
+        offsets = {"in": (0, 0), "near": (40, 0), "out": (80, 0)}
+        if kind == "blink":
+            segments.append((length, None, None))
+        elif kind == "one":
+            segments.append((length, OUT if rng.random() < 0.5 else None, IN))
+        else:
+            segments.append((length, offsets[kind], offsets[kind]))
+    return trial(*segments)
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"min_duration": 20},
+        {"min_duration": 30, "max_loss": 25, "release": 0.5},
+        {"eye": "either", "min_duration": 10, "max_loss": 60},
+        {"eye": "both", "min_duration": 5},
+        {"eye": "left", "max_loss": 15, "release": 0.7},
+    ],
+)
+@pytest.mark.parametrize("block", [1, 13, 500])
+def test_policy_matches_the_per_sample_oracle(seed, options, block):
+    times, samples = random_trial(seed)
+    policy = rejection_policy(50, CENTER, options)
+    oracle = rejection_policy(50, CENTER, options)
+    for start in range(0, len(times), block):
+        chunk = times[start : start + block], samples[start : start + block]
+        found = policy.check(*chunk)
+        assert found == oracle_check(oracle, *chunk)
+        assert (policy.violation_start, policy.loss_start) == (oracle.violation_start, oracle.loss_start)
+        if found is not None:
+            # windows are re-armed with a reset after rejecting
+            policy.reset()
+            oracle.reset()
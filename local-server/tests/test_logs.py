@@ -0,0 +1,11 @@
+import logging
+
+from logs import start_logging
+
+
+def test_start_logging_twice_adds_one_handler():
+    first = start_logging("INFO", name="eyelink-test")
+    second = start_logging("DEBUG", name="eyelink-test")
+    assert first is second
+    assert len(second.handlers) == 1
+    assert second.level == logging.DEBUG
@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+import pytest
+
+from recorder import SampleRecorder, read_log
+from samples import SAMPLE_COLUMNS
+
+
+def rows(start, n):
+    out = np.zeros((n, len(SAMPLE_COLUMNS)))
+    out[:, 0] = np.arange(start, start + n)
+    return out
+
+
+def test_file_is_closed_when_a_read_fails(tmp_path):
+    reads = []
+
+    def read(cursor):
+        reads.append(cursor)
+        if len(reads) > 2:
+            raise RuntimeError("actor stopped")
+        return rows(cursor, 10), cursor + 10
+
+    recorder = SampleRecorder(read, os.path.join(tmp_path, "s01"), interval=0)
+    recorder.message(3.0, "SYNC 5")
+    recorder.running = True
+    with pytest.raises(RuntimeError, match="actor stopped"):
+        recorder._run()
+
+    assert recorder.file is None
+    samples, messages = read_log(recorder.path)
+    assert samples[:, 0].tolist() == list(range(20))
+    assert messages == [(3.0, "SYNC 5")]
@@ -0,0 +1,92 @@
+import numpy as np
+
+from samples import SAMPLE_COLUMNS, TIME, SampleRing
+
+
+def rows(start, n):
+    out = np.zeros((n, len(SAMPLE_COLUMNS)))
+    out[:, TIME] = np.arange(start, start + n)
+    return out
+
+
+def test_since_returns_rows_after_cursor():
+    ring = SampleRing(capacity=8)
+    ring.extend(rows(0, 5))
+    got, cursor = ring.since(2)
+    assert cursor == 5
+    assert got[:, TIME].tolist() == [2, 3, 4]
+    assert len(ring.since(cursor)[0]) == 0
+
+
+def test_since_across_wraparound():
+    ring = SampleRing(capacity=8)
+    ring.extend(rows(0, 6))
+    ring.extend(rows(6, 6))
+    got, cursor = ring.since(5)
+    assert cursor == 12
+    assert got[:, TIME].tolist() == [5, 6, 7, 8, 9, 10, 11]
+
+
+def test_lagging_reader_gets_newest_capacity_rows():
+    ring = SampleRing(capacity=4)
+    ring.extend(rows(0, 10))
+    got, cursor = ring.since(0)
+    assert got[:, TIME].tolist() == [6, 7, 8, 9]
+    # the cursor still moves past what the reader missed
+    assert cursor - 0 - len(got) == 6
+
+
+def test_block_larger_than_capacity_keeps_its_tail():
+    ring = SampleRing(capacity=4)
+    ring.extend(rows(0, 3))
+    ring.extend(rows(3, 7))
+    assert ring.count == 10
+    assert ring.since(0)[0][:, TIME].tolist() == [6, 7, 8, 9]
+
+
+def test_dropped_counts_each_overwritten_row_once():
+    ring = SampleRing(capacity=4)
+    ring.attach()
+    ring.extend(rows(0, 10))
+    # three readers that all missed the same rows
+    for _ in range(3):
+        ring.since(0)
+    assert ring.dropped == 6
+
+
+def test_dropped_ignores_rows_a_reader_already_got():
+    ring = SampleRing(capacity=4)
+    ring.attach()
+    ring.extend(rows(0, 4))
+    ring.since(0)
+    ring.extend(rows(4, 4))
+    assert ring.dropped == 0
+    ring.extend(rows(8, 2))
+    # rows 4 and 5 were never read before being overwritten
+    assert ring.dropped == 2
+
+
+def test_newest_does_not_count_as_read():
+    ring = SampleRing(capacity=4)
+    ring.attach()
+    ring.extend(rows(0, 4))
+    assert ring.newest(2)[:, TIME].tolist() == [2, 3]
+    ring.extend(rows(4, 4))
+    assert ring.dropped == 4
+
+
+def test_rows_nobody_reads_are_not_dropped():
+    ring = SampleRing(capacity=4)
+    # drained between trials with no task running
+    ring.extend(rows(0, 10))
+    assert ring.dropped == 0
+
+    cursor = ring.attach()
+    ring.extend(rows(10, 6))
+    assert ring.dropped == 2
+    rows_read, cursor = ring.since(cursor)
+    assert rows_read[:, TIME].tolist() == [12, 13, 14, 15]
+
+    ring.detach()
+    ring.extend(rows(16, 10))
+    assert ring.dropped == 2
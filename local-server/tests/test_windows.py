@@ -0,0 +1,97 @@
+import numpy as np
+
+from gaze import rejection_policy
+from windows import MonitorWindows, Window
+
+CENTER = (960, 540)
+
+
+def block(start, end, outside=()):
+    """Binocular samples at 1 kHz from `start` to `end` ms, at the center except at the `outside` times."""
+    times = np.arange(start, end, dtype=float)
+    samples = np.tile(np.array(CENTER * 2, dtype=float), (len(times), 1))
+    for t in outside:
+        samples[int(t) - start, [0, 2]] += 100
+    return times, samples
+
+
+def window(id="a", **options):
+    return Window(id, rejection_policy(50, CENTER, options))
+
+
+def rejections(violations):
+    return [(w.id, reason, t) for w, reason, t, x, y in violations]
+
+
+def test_blocks_are_split_at_change_times():
+    windows = MonitorWindows()
+    windows.schedule(50, "a", "start", window())
+    # gaze leaves the window before it starts and after it does
+    assert rejections(windows.check(*block(0, 100, outside=(20, 60)))) == [("a", "gaze", 60)]
+
+
+def test_pause_and_stop_take_effect_at_their_time():
+    windows = MonitorWindows()
+    windows.schedule(0, "a", "start", window("a"))
+    windows.schedule(0, "b", "start", window("b"))
+    windows.schedule(30, "a", "pause")
+    windows.schedule(30, "b", "stop")
+    assert windows.check(*block(0, 100, outside=(40,))) == []
+    assert "b" not in windows.windows
+
+    windows.schedule(100, "a", "resume")
+    assert rejections(windows.check(*block(100, 200, outside=(150,)))) == [("a", "gaze", 150)]
+
+
+def test_rejecting_pauses_until_resumed():
+    windows = MonitorWindows()
+    windows.schedule(0, "a", "start", window())
+    assert rejections(windows.check(*block(0, 100, outside=(10, 20)))) == [("a", "gaze", 10)]
+    assert not windows.windows["a"].active
+    assert windows.check(*block(100, 200, outside=(110,))) == []
+
+    windows.schedule(200, "a", "resume")
+    assert rejections(windows.check(*block(200, 300, outside=(250,)))) == [("a", "gaze", 250)]
+
+
+def test_update_starts_a_violation_over():
+    windows = MonitorWindows()
+    windows.schedule(0, "a", "start", window(min_duration=30))
+    windows.schedule(50, "a", "update", window(min_duration=30))
+    # gaze is outside from 30 on, without the update it would reject at 60
+    assert rejections(windows.check(*block(0, 100, outside=range(30, 100)))) == [("a", "gaze", 80)]
+
+
+def test_late_start_rechecks_recent_samples():
+    windows = MonitorWindows()
+    assert windows.check(*block(0, 100, outside=(80,))) == []
+    # a start meant for 70 that arrives after samples up to 99 were checked
+    windows.schedule(70, "a", "start", window())
+    assert rejections(windows.check(*block(100, 110))) == [("a", "gaze", 80)]
+
+
+def test_late_start_only_covers_the_history():
+    windows = MonitorWindows(history=50)
+    for start in range(0, 300, 100):
+        windows.check(*block(start, start + 100, outside=(50,) if start == 0 else ()))
+    windows.schedule(0, "a", "start", window())
+    # the block with the violation at 50 is more than 50 ms older than the last sample
+    assert windows.check(*block(300, 310)) == []
+
+
+def test_idle_applies_changes_without_samples():
+    windows = MonitorWindows()
+    windows.schedule(10, "a", "start", window())
+    windows.schedule(20, "a", "stop")
+    windows.idle(15)
+    assert "a" in windows.windows
+    windows.idle(25)
+    assert windows.windows == {}
+
+
+def test_changes_at_the_same_time_apply_in_order():
+    windows = MonitorWindows()
+    windows.schedule(10, "a", "start", window())
+    windows.schedule(10, "a", "pause")
+    windows.idle(10)
+    assert not windows.windows["a"].active
@@ -0,0 +1,129 @@
+import heapq
+from collections import deque
+
+import numpy as np
+
+# ms of checked samples kept, so a window switched on by a late message still covers its start
+HISTORY_MS = 500
+
+
+class Window:
+    def __init__(self, id, policy, stop_recording=False):
+        self.id = id
+        self.policy = policy
+        self.stop_recording = stop_recording
+        self.active = True
+
+
+class MonitorWindows:
+    """Fixation windows of one client, started, paused, updated and stopped by ID.
+
+    Every change carries the tracker time it is meant for (the client's frame time
+    mapped onto the tracker clock), and blocks of samples are split at those times:
+    samples before a change are checked with the windows as they were, samples after it
+    as they are now. A window that is started or re-armed by a message arriving after
+    samples past its time were already checked gets those samples re-checked from the
+    last HISTORY_MS of samples, so it covers exactly the frames it was meant for.
+
+    Changes are queued with `schedule` from any thread and applied by the thread calling
+    `check`. A window that rejects is paused until it is resumed or started again.
+    """
+
+    def __init__(self, history=HISTORY_MS):
+        self.windows = {}
+        self.incoming = deque()  # changes from the handlers, the deque is safe across threads
+        self.changes = []  # heap of (time, seq, id, action, window)
+        self.seq = 0
+        self.history = history
+        self.recent = deque()  # recently checked (times, samples) blocks
+        self.last_time = -np.inf
+
+    def schedule(self, t, id, action, window=None):
+        """Queues `action` ("start", "pause", "resume", "update" or "stop") on window `id`
+        at tracker time `t`; start and update come with the new Window."""
+        self.incoming.append((t, id, action, window))
+
+    def _pull(self):
+        while self.incoming:
+            t, id, action, window = self.incoming.popleft()
+            heapq.heappush(self.changes, (t, self.seq, id, action, window))
+            self.seq += 1
+
+    def _apply(self, id, action, window):
+        if action == "start":
+            self.windows[id] = window
+        elif action == "stop":
+            self.windows.pop(id, None)
+        elif id in self.windows:
+            current = self.windows[id]
+            if action == "update":
+                # new geometry or policy, a violation in progress starts over
+                window.active = current.active
+                self.windows[id] = window
+            elif action == "pause":
+                current.active = False
+            elif action == "resume" and not current.active:
+                current.policy.reset()
+                current.active = True
+        return self.windows.get(id)
+
+    def _check_window(self, window, times, samples, violations):
+        if not window.active or not len(times):
+            return
+        rejection = window.policy.check(times, samples)
+        if rejection is not None:
+            window.active = False
+            violations.append((window, *rejection))
+
+    def _since(self, t):
+        if not self.recent:
+            return np.empty(0), np.empty((0, 4))
+        times = np.concatenate([block[0] for block in self.recent])
+        samples = np.concatenate([block[1] for block in self.recent])
+        start = np.searchsorted(times, t, side="left")
+        return times[start:], samples[start:]
+
+    def _apply_late(self, violations):
+        # changes for a time that has already been checked
+        while self.changes and self.changes[0][0] <= self.last_time:
+            t, _, id, action, window = heapq.heappop(self.changes)
+            window = self._apply(id, action, window)
+            if action in ("start", "resume", "update") and window is not None:
+                self._check_window(window, *self._since(t), violations)
+
+    def check(self, times, samples):
+        """Checks (N,) times and (N, 4) binocular samples against every active window.
+
+        Returns:
+            list of (Window, reason, time, x, y) for the windows that rejected, see
+            RejectionPolicy.check.
+        """
+        violations = []
+        self._pull()
+        self._apply_late(violations)
+        if not len(times):
+            return violations
+
+        start = 0
+        while self.changes and self.changes[0][0] <= times[-1]:
+            t, _, id, action, window = heapq.heappop(self.changes)
+            split = max(int(np.searchsorted(times, t, side="left")), start)
+            for current in list(self.windows.values()):
+                self._check_window(current, times[start:split], samples[start:split], violations)
+            start = split
+            self._apply(id, action, window)
+        for current in list(self.windows.values()):
+            self._check_window(current, times[start:], samples[start:], violations)
+
+        self.recent.append((times, samples))
+        self.last_time = times[-1]
+        while self.recent and self.recent[0][0][-1] < self.last_time - self.history:
+            self.recent.popleft()
+        return violations
+
+    def idle(self, now):
+        """Applies changes up to tracker time `now` while no samples come in (not recording)."""
+        self._pull()
+        while self.changes and self.changes[0][0] <= now:
+            t, _, id, action, window = heapq.heappop(self.changes)
+            self._apply(id, action, window)
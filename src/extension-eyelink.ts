@@ -5,27 +5,323 @@ import { io, Socket } from "socket.io-client";
 
 import { version } from "../package.json";
 
+// viewing geometry of a rig, distances in mm
+export interface MonitorProfile {
+  distance: number;
+  width: number;
+  height?: number;
+  resolution: [number, number];
+}
+
+// areas of interest in screen pixels, x/y of a rect is its top left corner
+// dwell (ms) fires onDwell once gaze has stayed in the AOI that long
+export type AOI =
+  | {
+      id: string;
+      shape?: "rect";
+      x: number;
+      y: number;
+      width: number;
+      height: number;
+      dwell?: number;
+    }
+  | {
+      id: string;
+      shape: "circle";
+      x: number;
+      y: number;
+      radius: number;
+      dwell?: number;
+    }
+  | {
+      id: string;
+      shape: "polygon";
+      points: [number, number][];
+      dwell?: number;
+    };
+
+export interface AOIEvent {
+  id: string;
+  time: number;
+  dwell?: number;
+}
+
+export interface AOICallbacks {
+  onEnter?: (data: AOIEvent) => void;
+  onExit?: (data: AOIEvent) => void;
+  onDwell?: (data: AOIEvent) => void;
+}
+
+export type EyeEventName =
+  | "fixationStart"
+  | "fixationEnd"
+  | "saccadeStart"
+  | "saccadeEnd"
+  | "blinkStart"
+  | "blinkEnd";
+
+// times in ms (tracker clock), positions in screen pixels, amplitude in degrees
+export interface EyeEvent {
+  time: number;
+  x?: number;
+  y?: number;
+  duration?: number;
+  amplitude?: number;
+  peakVelocity?: number;
+}
+
+export type EyeEventCallbacks = Partial<
+  Record<EyeEventName, (event: EyeEvent) => void>
+>;
+
+export interface EventDetectionOptions {
+  // "ivt": velocity threshold, "idt": dispersion threshold
+  method?: "ivt" | "idt";
+  // ivt thresholds in deg/s and deg/s^2, default to the tracker's parser settings
+  velocity_threshold?: number;
+  acceleration_threshold?: number;
+  // idt dispersion in degrees and minimum fixation duration in ms
+  dispersion?: number;
+  min_duration?: number;
+  // ms after which detection stops
+  duration?: number;
+}
+
+export interface RejectionPolicy {
+  // which gaze is checked: the average of both eyes, "either" eye outside rejects,
+  // only "both" eyes outside rejects, or a single eye
+  eye?: "average" | "either" | "both" | "left" | "right";
+  // ms gaze has to stay outside the window before the trial is rejected
+  min_duration?: number;
+  // ms of missing data (blinks, track loss) tolerated before the trial is rejected,
+  // missing data never rejects if unset
+  max_loss?: number;
+  // fraction of the window radius gaze has to return within to end a violation
+  release?: number;
+}
+
+export interface MonitorWindowOptions {
+  // window center in screen pixels, defaults to the screen center
+  center?: [number, number];
+  // window radius in degrees of visual angle
+  eyeMaxDist?: number;
+  policy?: RejectionPolicy;
+  // stop recording when the window rejects, like realtimeEyeTrack does
+  stop_recording?: boolean;
+}
+
+export interface WindowViolation {
+  id: string;
+  // gaze relative to the window center in pixels, null for data loss
+  x: number | null;
+  y: number | null;
+  reason: "gaze" | "loss";
+  // tracker time of the sample that rejected
+  time: number;
+}
+
+// one binary frame of the live gaze stream
+export interface GazeFrame {
+  seq: number;
+  count: number;
+  // tracker time of each sample in ms
+  time: Float64Array;
+  // left x, left y, right x, right y per sample in pixels, NaN if the eye is missing
+  gaze: Float32Array;
+}
+
+export interface GazeStreamOptions {
+  // frames per second pushed by the server
+  rate?: number;
+  // how samples are reduced: every factor-th, the mean of each factor samples,
+  // or only the newest sample in each frame
+  policy?: "decimate" | "mean" | "latest";
+  factor?: number;
+}
+
+// frame layout: uint32 seq, uint16 count, uint16 reserved, then count float64
+// times and count * 4 float32 gaze values, all little endian
+export function decodeGazeFrame(data: ArrayBuffer | ArrayBufferView): GazeFrame {
+  // copy views (e.g. node Buffers) so the typed arrays below are aligned
+  const buffer: ArrayBufferLike =
+    data instanceof ArrayBuffer
+      ? data
+      : data.buffer.slice(data.byteOffset, data.byteOffset + data.byteLength);
+  const view = new DataView(buffer);
+  const count = view.getUint16(4, true);
+  return {
+    seq: view.getUint32(0, true),
+    count,
+    time: new Float64Array(buffer, 8, count),
+    gaze: new Float32Array(buffer, 8 + 8 * count, 4 * count),
+  };
+}
+
 interface InitParams {
   hostname: string;
   port: number;
   record: boolean;
   dummy: boolean;
+  // booth whose tracker this experiment uses, clients of one session share its tracker
+  session?: string;
+  // EDF file and tracked eye, used by the client that opens the session
+  edf_filename?: string;
+  eye?: "LEFT" | "RIGHT" | "BOTH";
+  // name of a profile configured on the server, or the geometry itself
+  monitor?: string | MonitorProfile;
+  // clock sync round trips per sync, and ms between resyncs (0 to only sync once)
+  clock_sync_pings?: number;
+  clock_sync_interval?: number;
+  // keep recording between trials, which are marked with TRIALID/TRIAL_RESULT
+  // messages; recording stops with stopRecording(), calibration or endSession()
+  continuous_recording?: boolean;
+}
+
+// latencies in ms
+export interface LatencySummary {
+  count: number;
+  mean?: number;
+  min?: number;
+  p50?: number;
+  p90?: number;
+  p99?: number;
+  max?: number;
+}
+
+// server health, sent as serverStatus and served at /metrics
+export interface ServerStatus {
+  uptime: number;
+  clients: number;
+  // handler.<event> and loop.<task> durations
+  latency_ms: Record<string, LatencySummary>;
+  // samples_dropped.<task>: samples a task fell too far behind to read
+  counters: Record<string, number>;
+  tasks: Record<string, number>;
+  sessions: Record<
+    string,
+    {
+      state: string;
+      recording: boolean;
+      clients: number;
+      actor_queue: number;
+      samples_received: number;
+      samples_missing: number;
+      samples_overwritten: number;
+      message_delay_ms?: LatencySummary;
+      status_pending?: number;
+      recorder?: { written: number; lost: number; pending: number };
+      link?: "connected" | "disconnected" | "busy";
+    }
+  >;
+}
+
+export interface ClockStats {
+  // server clock - performance.now(), in ms
+  offset: number | null;
+  rtt: number | null;
+  roundTrip: LatencySummary;
+  oneWay: LatencySummary;
+}
+
+interface ClockPingReply {
+  t0: number;
+  t1: number;
+  t2: number;
+  tracker: number | null;
+}
+
+// gaze quality of one trial, added to its data row (positions in px, deviation in deg)
+export interface TrialGazeStats {
+  gaze_samples: number;
+  gaze_lost_pct: number | null;
+  gaze_mean_x: number | null;
+  gaze_mean_y: number | null;
+  gaze_sd_x: number | null;
+  gaze_sd_y: number | null;
+  gaze_max_deviation: number | null;
+  gaze_fixations: number;
+  gaze_blinks: number;
+  gaze_blink_ms: number;
+}
+
+export interface SessionInfo {
+  session: string;
+  edf_filename: string;
+  eye: "LEFT" | "RIGHT" | "BOTH";
+}
+
+export interface EndedSessionInfo extends SessionInfo {
+  // name of the copy on the server, its size in bytes and where to download it
+  file: string;
+  size: number;
+  url: string;
+}
+
+export interface EndSessionOptions {
+  // save the EDF file in the browser's downloads as well
+  download?: boolean;
+  // called with the bytes received from the Host PC so far
+  onProgress?: (received: number) => void;
 }
 
 export interface EyeLinkExtensionInterface extends JsPsychExtension {
   initialize: (params: InitParams) => Promise<void>;
+  openSession: (edf_filename?: string, eye?: string) => Promise<SessionInfo>;
+  endSession: (options?: EndSessionOptions) => Promise<EndedSessionInfo>;
   on_load: () => Promise<void>;
-  on_finish: () => Promise<void>;
+  startRecording: () => Promise<void>;
+  stopRecording: () => void;
+  on_finish: () => Promise<TrialGazeStats | Record<string, never>>;
   sendEventCode: (eventCode: number) => void;
+  syncClock: () => Promise<void>;
+  getClockStats: () => Promise<ClockStats>;
+  toTrackerTime: (time: number) => number | null;
   sendTrialStatus: (status: string) => void;
   realtimeEyeTrack: (
     duration: number,
     callback_function: () => void,
     eyeMaxDist?: number,
+    policy?: RejectionPolicy,
+  ) => void;
+  stopRealtimeEyeTrack: () => void;
+  startWindow: (
+    id: string,
+    options?: MonitorWindowOptions,
+    onViolation?: (violation: WindowViolation) => void,
+  ) => void;
+  pauseWindow: (id: string) => void;
+  resumeWindow: (id: string) => void;
+  updateWindow: (id: string, options: MonitorWindowOptions) => void;
+  stopWindow: (id: string) => void;
+  clearWindows: () => void;
+  setAOIs: (
+    aois: AOI[],
+    callbacks?: AOICallbacks,
+    options?: { duration?: number; dwell?: number },
+  ) => void;
+  clearAOIs: () => void;
+  startEventDetection: (
+    callbacks: EyeEventCallbacks,
+    options?: EventDetectionOptions,
   ) => void;
+  stopEventDetection: () => void;
+  subscribeGaze: (
+    callback: (frame: GazeFrame) => void,
+    options?: GazeStreamOptions,
+  ) => void;
+  unsubscribeGaze: () => void;
   socket: Socket;
 }
 
+const EYE_EVENTS: EyeEventName[] = [
+  "fixationStart",
+  "fixationEnd",
+  "saccadeStart",
+  "saccadeEnd",
+  "blinkStart",
+  "blinkEnd",
+];
+
 /**
  * **{extension-eyelink}**
  *
@@ -46,6 +342,22 @@ class EyeLinkExtension implements EyeLinkExtensionInterface {
   //@ts-expect-error notassigned
   socket: Socket;
 
+  // http(s) address of the server, for downloads
+  private serverUrl = "";
+
+  // tracker time - performance.now(), from the last clock sync
+  private trackerOffset: number | null = null;
+  private clockSyncPings = 10;
+  private continuousRecording = false;
+  // TRIALID of the current trial
+  private trialId = 0;
+
+  // violation callbacks of the monitoring windows, by window ID
+  private windowCallbacks = new Map<
+    string,
+    (violation: WindowViolation) => void
+  >();
+
   constructor(private jsPsych: JsPsych) {}
 
   // set initial state of the extension
@@ -53,11 +365,48 @@ class EyeLinkExtension implements EyeLinkExtensionInterface {
   initialize = (params: InitParams): Promise<void> => {
     return new Promise((resolve, reject) => {
       // connect to host
-      this.socket = io(`${params.hostname}:${params.port}`);
-      this.socket.on("connect", () => {
+      const host = `${params.hostname}:${params.port}`;
+      this.serverUrl = /^https?:\/\//.test(host)
+        ? host
+        : `${window.location.protocol === "https:" ? "https:" : "http:"}//${host}`;
+      this.socket = io(host, {
+        auth: {
+          session: params.session ?? "default",
+          monitor: params.monitor ?? "default",
+        },
+      });
+      this.socket.on("sessionProgress", (data: { step: string }) => {
+        console.log(`EyeLink session: ${data.step}`);
+      });
+      this.socket.on("connect", async () => {
         console.log("Connected to EyeLink server");
+        // the tracker is connected on demand, so the server is up before it is ready
+        try {
+          const session = await this.openSession(
+            params.edf_filename,
+            params.eye,
+          );
+          console.log(
+            `EyeLink session ${session.session} ready, recording to ${session.edf_filename}`,
+          );
+        } catch (err) {
+          console.error("Could not open EyeLink session:", err);
+          reject(err);
+          return;
+        }
+        // the server forgets the offset of a socket when it disconnects, so resync on reconnect
+        await this.syncClock();
         resolve();
       });
+
+      this.clockSyncPings = params.clock_sync_pings ?? 10;
+      this.continuousRecording = params.continuous_recording ?? false;
+      const interval = params.clock_sync_interval ?? 60000;
+      if (interval > 0) {
+        setInterval(() => {
+          if (this.socket.connected) this.syncClock();
+        }, interval);
+      }
       this.socket.on("connect_error", (err: Error) => {
         document.body.innerHTML = `<h1>Could not connect to EyeLink server</h1><h2>Please make sure the EyeLink server is running and reachable at ${params.hostname}:${params.port}</h2>`;
 
@@ -67,70 +416,443 @@ class EyeLinkExtension implements EyeLinkExtensionInterface {
     });
   };
 
+  /*
+   * asks the server to connect and configure this session's tracker, resolves once it is
+   * ready. If another client already opened the session, its EDF file and eye are kept.
+   */
+  public openSession = (
+    edf_filename = "TEST.edf",
+    eye = "BOTH",
+  ): Promise<SessionInfo> => {
+    return new Promise((resolve, reject) => {
+      const onReady = (info: SessionInfo) => {
+        this.socket.off("sessionError", onError);
+        resolve(info);
+      };
+      const onError = (data: { error: string }) => {
+        this.socket.off("sessionReady", onReady);
+        reject(new Error(data.error));
+      };
+      this.socket.once("sessionReady", onReady);
+      this.socket.once("sessionError", onError);
+      this.socket.emit("open_session", { edf_filename, eye });
+    });
+  };
+
+  /*
+   * ends the session: the server stops recording, closes the EDF file on the Host PC and
+   * copies it to its data directory, then disconnects the tracker. Resolves with where the
+   * copy is once it is complete. With download, the browser also saves the file, streamed
+   * straight to disk by the browser's download manager.
+   */
+  public endSession = (
+    options: EndSessionOptions = {},
+  ): Promise<EndedSessionInfo> => {
+    return new Promise((resolve, reject) => {
+      const onProgress = (data: { received: number }) => {
+        options.onProgress?.(data.received);
+      };
+      const cleanup = () => {
+        this.socket.off("edfProgress", onProgress);
+        this.socket.off("sessionEnded", onEnded);
+        this.socket.off("sessionError", onError);
+      };
+      const onEnded = (info: EndedSessionInfo) => {
+        cleanup();
+        if (options.download) {
+          const link = document.createElement("a");
+          link.href = this.serverUrl + info.url;
+          link.download = info.file;
+          document.body.appendChild(link);
+          link.click();
+          link.remove();
+        }
+        resolve(info);
+      };
+      const onError = (data: { error: string }) => {
+        cleanup();
+        reject(new Error(data.error));
+      };
+      this.socket.on("edfProgress", onProgress);
+      this.socket.once("sessionEnded", onEnded);
+      this.socket.once("sessionError", onError);
+      this.socket.emit("stopRecording");
+      this.socket.emit("end_session", (ack: { ok: boolean; error?: string }) => {
+        if (!ack.ok) onError({ error: ack.error ?? "Could not end session" });
+      });
+    });
+  };
+
   // runs BEFORE plugin.trial() is loaded
   on_start = () => {};
 
   // runs after plugin.trial() loaded but before executing
-  on_load = (): Promise<void> => {
-    return new Promise((resolve) => {
-      const message = `block ${this.jsPsych.evaluateTimelineVariable("block") + 1}, trial ${this.jsPsych.evaluateTimelineVariable("trial") + 1}`;
-      this.sendTrialStatus(message);
+  on_load = async (): Promise<void> => {
+    const message = `block ${this.jsPsych.evaluateTimelineVariable("block") + 1}, trial ${this.jsPsych.evaluateTimelineVariable("trial") + 1}`;
+    this.sendTrialStatus(message);
 
-      this.socket.emit("startRecording");
-      // 100ms delay suggested by eyelink to avoid port codes being truncated
-      this.jsPsych.pluginAPI.setTimeout(() => {
-        resolve();
-      }, 100);
+    this.trialId += 1;
+    this.socket.emit("trial_start", {
+      id: this.trialId,
+      t: performance.now(),
     });
+    // resolves once samples are coming in, so port codes sent from here on are recorded;
+    // a continuous recording only starts a block if it isn't recording already
+    await this.startRecording();
+    this.socket.emit("start_trial_stats");
   };
 
-  // runs after trial finishes but before finish_trial()
-  on_finish = (): Promise<void> => {
+  // runs after trial finishes but before finish_trial(), resolves with the trial's gaze statistics
+  on_finish = (): Promise<TrialGazeStats | Record<string, never>> => {
+    // make sure a monitor started during this trial can't fire during the next one
+    this.stopRealtimeEyeTrack();
+    this.clearWindows();
+    this.clearAOIs();
+    this.stopEventDetection();
+    this.socket.emit("trial_end", { result: 0, t: performance.now() });
+    if (this.continuousRecording) {
+      return this.getTrialStats();
+    }
     return new Promise((resolve) => {
-      this.jsPsych.pluginAPI.setTimeout(() => {
+      this.jsPsych.pluginAPI.setTimeout(async () => {
+        // statistics cover the recording up to just before it stops
+        const stats = await this.getTrialStats();
         // 100ms delay before we stop recording
         this.socket.emit("stopRecording");
-        resolve();
+        resolve(stats);
       }, 100);
     });
   };
 
+  /*
+   * starts recording and resolves once the server reports samples are coming in
+   * (or after a timeout, with a warning). With continuous_recording, a block that is
+   * already running keeps going
+   */
+  public startRecording = async (): Promise<void> => {
+    try {
+      const reply = await this.socket
+        .timeout(5000)
+        .emitWithAck("startRecording", {
+          continuous: this.continuousRecording,
+        });
+      if (!reply.ok) {
+        console.error("Could not start recording:", reply.error);
+      }
+    } catch {
+      console.warn("The EyeLink server didn't confirm that recording started");
+    }
+  };
+
+  // ends a recording block, e.g. before a break in continuous recording
+  public stopRecording = (): void => {
+    this.socket.emit("stopRecording");
+  };
+
+  private getTrialStats = async (): Promise<
+    TrialGazeStats | Record<string, never>
+  > => {
+    try {
+      const reply = await this.socket
+        .timeout(1000)
+        .emitWithAck("stop_trial_stats");
+      return reply.ok ? reply.stats : {};
+    } catch {
+      console.warn("No gaze statistics for this trial");
+      return {};
+    }
+  };
+
   /*
    * call this function when you want to start realtime eyetracking
-   * Eyetracking logic is handled by the server, currently can't be interrupted
-   * and you must specify a static duration to record for
+   * Eyetracking logic is handled by the server and runs for `duration` ms,
+   * or until stopRealtimeEyeTrack() is called
    */
   public realtimeEyeTrack = (
     duration: number,
     callback_function: () => void,
     eyeMaxDist: number = 1.25,
+    policy: RejectionPolicy = {},
   ): void => {
     // Remove any existing listener to prevent memory leaks
     this.socket.off("eyeMovementDetected");
 
     // start realtime eyetracking
-    this.socket.emit("realtime_eyetrack", {
-      duration,
-      eyeMaxDist,
-    });
+    this.socket.emit(
+      "realtime_eyetrack",
+      {
+        duration,
+        eyeMaxDist,
+        policy,
+      },
+      (response: { ok: boolean; error?: string }) => {
+        if (!response.ok) {
+          console.error("Could not start realtime eyetracking:", response.error);
+        }
+      },
+    );
 
     this.socket.on(
       "eyeMovementDetected",
-      (data: { x: number; y: number }): void => {
+      (data: {
+        x: number | null;
+        y: number | null;
+        reason: "gaze" | "loss";
+        time: number;
+      }): void => {
         console.log("Eye movement detected:", data);
         this.jsPsych.data.addProperties({
           eyeMovementDetected: true,
           eyeMovementX: data.x,
           eyeMovementY: data.y,
+          eyeMovementReason: data.reason,
         });
         callback_function();
       },
     );
   };
 
+  // cancel a running realtime eyetracking monitor early
+  public stopRealtimeEyeTrack = (): void => {
+    this.socket.off("eyeMovementDetected");
+    this.socket.emit("stop_realtime_eyetrack");
+  };
+
+  /*
+   * monitoring windows are checked by one sampler on the server and switched
+   * on and off by ID. Every change is stamped with performance.now(), so call
+   * these in the frame they belong to; the server applies them to the samples
+   * recorded from that time on. A window that rejects calls its onViolation
+   * callback and stays paused until it is resumed
+   */
+  public startWindow = (
+    id: string,
+    options: MonitorWindowOptions = {},
+    onViolation?: (violation: WindowViolation) => void,
+  ): void => {
+    if (this.windowCallbacks.size === 0) {
+      this.socket.off("windowViolation");
+      this.socket.on("windowViolation", (data: WindowViolation) => {
+        this.windowCallbacks.get(data.id)?.(data);
+      });
+    }
+    this.windowCallbacks.set(id, onViolation ?? (() => {}));
+    this.changeWindow("start_window", { id, ...options });
+  };
+
+  public pauseWindow = (id: string): void => {
+    this.changeWindow("pause_window", { id });
+  };
+
+  public resumeWindow = (id: string): void => {
+    this.changeWindow("resume_window", { id });
+  };
+
+  public updateWindow = (id: string, options: MonitorWindowOptions): void => {
+    this.changeWindow("update_window", { id, ...options });
+  };
+
+  public stopWindow = (id: string): void => {
+    this.windowCallbacks.delete(id);
+    this.changeWindow("stop_window", { id });
+  };
+
+  public clearWindows = (): void => {
+    if (this.windowCallbacks.size === 0) return;
+    this.windowCallbacks.clear();
+    this.socket.off("windowViolation");
+    this.socket.emit("clear_windows", { t: performance.now() });
+  };
+
+  private changeWindow(event: string, data: { id: string }): void {
+    this.socket.emit(
+      event,
+      { ...data, t: performance.now() },
+      (response: { ok: boolean; error?: string }) => {
+        if (!response.ok) {
+          console.error("Could not change monitoring window:", response.error);
+        }
+      },
+    );
+  }
+
+  /*
+   * start hit-testing gaze against a set of areas of interest
+   * replaces any AOIs set before, and runs until clearAOIs() is called, the
+   * trial ends or the optional duration (ms) runs out
+   */
+  public setAOIs = (
+    aois: AOI[],
+    callbacks: AOICallbacks = {},
+    options: { duration?: number; dwell?: number } = {},
+  ): void => {
+    this.removeAOIListeners();
+    if (callbacks.onEnter) this.socket.on("aoiEnter", callbacks.onEnter);
+    if (callbacks.onExit) this.socket.on("aoiExit", callbacks.onExit);
+    if (callbacks.onDwell) this.socket.on("aoiDwell", callbacks.onDwell);
+
+    this.socket.emit(
+      "set_aois",
+      { aois, ...options },
+      (response: { ok: boolean; error?: string }) => {
+        if (!response.ok) {
+          console.error("Could not set AOIs:", response.error);
+        }
+      },
+    );
+  };
+
+  public clearAOIs = (): void => {
+    this.removeAOIListeners();
+    this.socket.emit("clear_aois");
+  };
+
+  private removeAOIListeners(): void {
+    this.socket.off("aoiEnter");
+    this.socket.off("aoiExit");
+    this.socket.off("aoiDwell");
+  }
+
+  /*
+   * detect fixations, saccades and blinks on the server as samples arrive
+   * only the events given a callback are sent, saccadeStart typically arrives
+   * a few ms after onset. Runs until stopEventDetection() is called, the trial
+   * ends or the optional duration (ms) runs out
+   */
+  public startEventDetection = (
+    callbacks: EyeEventCallbacks,
+    options: EventDetectionOptions = {},
+  ): void => {
+    this.removeEyeEventListeners();
+    const events = Object.keys(callbacks) as EyeEventName[];
+    for (const name of events) {
+      this.socket.on(name, callbacks[name]!);
+    }
+
+    this.socket.emit(
+      "start_event_detection",
+      { events, ...options },
+      (response: { ok: boolean; error?: string }) => {
+        if (!response.ok) {
+          console.error("Could not start event detection:", response.error);
+        }
+      },
+    );
+  };
+
+  public stopEventDetection = (): void => {
+    this.removeEyeEventListeners();
+    this.socket.emit("stop_event_detection");
+  };
+
+  private removeEyeEventListeners(): void {
+    for (const name of EYE_EVENTS) {
+      this.socket.off(name);
+    }
+  }
+
+  /*
+   * NTP-style clock sync with the server: a few clock_ping round trips, keeping
+   * the offset from the one with the shortest round trip, which is least
+   * affected by queueing. The server uses it to timestamp event codes with the
+   * time they were sent rather than the time they arrived.
+   */
+  public syncClock = async (): Promise<void> => {
+    let best: {
+      offset: number;
+      rtt: number;
+      trackerOffset: number | null;
+    } | null = null;
+    const roundTrips: number[] = [];
+
+    for (let i = 0; i < this.clockSyncPings; i++) {
+      const t0 = performance.now();
+      let reply: ClockPingReply;
+      try {
+        reply = await this.socket
+          .timeout(1000)
+          .emitWithAck("clock_ping", { t0 });
+      } catch {
+        continue;
+      }
+      const t3 = performance.now();
+
+      const rtt = t3 - t0 - (reply.t2 - reply.t1);
+      const offset = (reply.t1 - t0 + (reply.t2 - t3)) / 2;
+      roundTrips.push(rtt);
+      if (best === null || rtt < best.rtt) {
+        best = {
+          offset,
+          rtt,
+          trackerOffset:
+            reply.tracker === null ? null : reply.tracker - reply.t1 + offset,
+        };
+      }
+    }
+
+    if (best === null) {
+      console.warn("Clock sync with EyeLink server failed");
+      return;
+    }
+    this.trackerOffset = best.trackerOffset;
+    this.socket.emit("clock_sync", {
+      offset: best.offset,
+      rtt: best.rtt,
+      roundTrips,
+    });
+  };
+
+  // round-trip and one-way latency histograms the server keeps for this client
+  public getClockStats = (): Promise<ClockStats> => {
+    return this.socket.emitWithAck("clock_stats");
+  };
+
+  // converts a performance.now() time to tracker time, null before the first sync
+  public toTrackerTime = (time: number): number | null => {
+    return this.trackerOffset === null ? null : time + this.trackerOffset;
+  };
+
+  /*
+   * receive live gaze samples as binary frames, e.g. for gaze-contingent
+   * displays or an experimenter dashboard. Keeps running across trials until
+   * unsubscribeGaze() is called
+   */
+  public subscribeGaze = (
+    callback: (frame: GazeFrame) => void,
+    options: GazeStreamOptions = {},
+  ): void => {
+    this.socket.off("gazeFrame");
+    this.socket.on("gazeFrame", (data: ArrayBuffer) => {
+      callback(decodeGazeFrame(data));
+    });
+
+    this.socket.emit(
+      "gaze_subscribe",
+      options,
+      (response: { ok: boolean; error?: string }) => {
+        if (!response.ok) {
+          console.error("Could not subscribe to gaze stream:", response.error);
+        }
+      },
+    );
+  };
+
+  public unsubscribeGaze = (): void => {
+    this.socket.off("gazeFrame");
+    this.socket.emit("gaze_unsubscribe");
+  };
+
+  // called with the server's periodic serverStatus, null stops listening
+  public onServerStatus = (
+    callback: ((status: ServerStatus) => void) | null,
+  ): void => {
+    this.socket.off("serverStatus");
+    if (callback) this.socket.on("serverStatus", callback);
+  };
+
   // this function should be used for port codes
   public sendEventCode(eventCode: number): void {
-    this.socket.emit("event", { code: eventCode });
+    this.socket.emit("event", { code: eventCode, t: performance.now() });
   }
 
   // this function should be used for the trial status label in the eyetracker
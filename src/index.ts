@@ -1,3 +1,28 @@
-export { default as EyeLinkExtension } from "./extension-eyelink";
-export type { EyeLinkExtensionInterface } from "./extension-eyelink";
+export {
+  default as EyeLinkExtension,
+  decodeGazeFrame,
+} from "./extension-eyelink";
+export type {
+  AOI,
+  AOICallbacks,
+  AOIEvent,
+  ClockStats,
+  EndSessionOptions,
+  EndedSessionInfo,
+  EventDetectionOptions,
+  EyeEvent,
+  EyeEventCallbacks,
+  EyeEventName,
+  EyeLinkExtensionInterface,
+  GazeFrame,
+  GazeStreamOptions,
+  LatencySummary,
+  MonitorProfile,
+  MonitorWindowOptions,
+  RejectionPolicy,
+  ServerStatus,
+  SessionInfo,
+  TrialGazeStats,
+  WindowViolation,
+} from "./extension-eyelink";
 export { default as EyeLinkPlugin } from "./plugin-eyelink-display";
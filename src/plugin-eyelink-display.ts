@@ -37,6 +37,12 @@ const info = <const>{
       default: [1280, 720],
       description: "Screen resolution [width, height] in pixels",
     },
+    camera_encoding: {
+      type: ParameterType.STRING,
+      default: "zlib",
+      description:
+        "How camera setup images are sent: raw, zlib or png. zlib and png are smaller but take longer to decode",
+    },
   },
   data: {
     /** name of this trial */
@@ -50,6 +56,289 @@ const info = <const>{
 
 type Info = typeof info;
 
+// opcodes of the binary calibration display stream, see local-server/caldisplay.py
+const OP = {
+  SETUP: 1,
+  EXIT: 2,
+  CLEAR: 3,
+  DRAW_TARGET: 4,
+  ERASE_TARGET: 5,
+  SETUP_IMAGE: 6,
+  EXIT_IMAGE: 7,
+  IMAGE_TITLE: 8,
+  PALETTE: 9,
+  IMAGE_FRAME: 10,
+  DRAW_LINE: 11,
+  DRAW_LOZENGE: 12,
+  BEEP: 13,
+} as const;
+
+// batch header: uint8 version, uint32 sequence number, uint16 command count
+const BATCH_HEADER_SIZE = 7;
+const CAMERA_ENCODINGS = ["raw", "zlib", "png"] as const;
+type CameraEncoding = (typeof CAMERA_ENCODINGS)[number];
+
+// crosshair colors by pylink color index (CR_HAIR_COLOR, PUPIL_HAIR_COLOR, ...)
+const CROSSHAIR_COLORS: Record<number, string> = {
+  1: "#FFFFFF",
+  2: "#FFFFFF",
+  3: "#00FF00",
+  4: "#FF0000",
+  5: "#FF0000",
+};
+
+interface DisplayHandler {
+  setup: () => void;
+  exit: () => void;
+  clear: () => void;
+  drawTarget: (x: number, y: number) => void;
+  eraseTarget: () => void;
+  setupImage: (width: number, height: number) => void;
+  exitImage: () => void;
+  imageTitle: (text: string) => void;
+  palette: (rgb: Uint8Array) => void;
+  imageFrame: (
+    frame: number,
+    width: number,
+    height: number,
+    encoding: CameraEncoding,
+    data: Uint8Array<ArrayBuffer>,
+  ) => Promise<void>;
+  drawLine: (
+    x1: number,
+    y1: number,
+    x2: number,
+    y2: number,
+    color: number,
+  ) => void;
+  drawLozenge: (
+    x: number,
+    y: number,
+    w: number,
+    h: number,
+    color: number,
+  ) => void;
+}
+
+// runs every command of one display batch, in order; camera frames may decode
+// asynchronously, so later commands (the crosshairs) wait for them
+async function applyDisplayBatch(
+  data: ArrayBuffer,
+  handler: DisplayHandler,
+): Promise<void> {
+  const bytes = new Uint8Array(data);
+  const view = new DataView(data);
+  const count = view.getUint16(5, true);
+  let offset = BATCH_HEADER_SIZE;
+
+  for (let i = 0; i < count; i++) {
+    const op = view.getUint8(offset);
+    offset += 1;
+    switch (op) {
+      case OP.SETUP:
+        handler.setup();
+        break;
+      case OP.EXIT:
+        handler.exit();
+        break;
+      case OP.CLEAR:
+        handler.clear();
+        break;
+      case OP.DRAW_TARGET:
+        handler.drawTarget(
+          view.getInt16(offset, true),
+          view.getInt16(offset + 2, true),
+        );
+        offset += 4;
+        break;
+      case OP.ERASE_TARGET:
+        handler.eraseTarget();
+        break;
+      case OP.SETUP_IMAGE:
+        handler.setupImage(
+          view.getUint16(offset, true),
+          view.getUint16(offset + 2, true),
+        );
+        offset += 4;
+        break;
+      case OP.EXIT_IMAGE:
+        handler.exitImage();
+        break;
+      case OP.IMAGE_TITLE: {
+        const length = view.getUint16(offset, true);
+        const text = bytes.subarray(offset + 2, offset + 2 + length);
+        handler.imageTitle(new TextDecoder().decode(text));
+        offset += 2 + length;
+        break;
+      }
+      case OP.PALETTE: {
+        const n = view.getUint16(offset, true);
+        handler.palette(bytes.subarray(offset + 2, offset + 2 + 3 * n));
+        offset += 2 + 3 * n;
+        break;
+      }
+      case OP.IMAGE_FRAME: {
+        // uint32 frame, uint16 width, uint16 height, uint8 encoding, uint32 length
+        const length = view.getUint32(offset + 9, true);
+        await handler.imageFrame(
+          view.getUint32(offset, true),
+          view.getUint16(offset + 4, true),
+          view.getUint16(offset + 6, true),
+          CAMERA_ENCODINGS[view.getUint8(offset + 8)] ?? "raw",
+          bytes.subarray(offset + 13, offset + 13 + length),
+        );
+        offset += 13 + length;
+        break;
+      }
+      case OP.DRAW_LINE:
+      case OP.DRAW_LOZENGE: {
+        const args = [0, 2, 4, 6].map((o) =>
+          view.getInt16(offset + o, true),
+        ) as [number, number, number, number];
+        const color = view.getUint8(offset + 8);
+        if (op === OP.DRAW_LINE) {
+          handler.drawLine(...args, color);
+        } else {
+          handler.drawLozenge(...args, color);
+        }
+        offset += 9;
+        break;
+      }
+      case OP.BEEP:
+        offset += 1;
+        break;
+      default:
+        throw new Error(`Unknown display command ${op}`);
+    }
+  }
+}
+
+// live camera image shown during camera setup, drawn from palette-indexed frames
+class CameraImage {
+  private container: HTMLDivElement;
+  private canvas: HTMLCanvasElement;
+  private title: HTMLDivElement;
+  private context: CanvasRenderingContext2D;
+  private image: ImageData | null = null;
+  private pixels: Uint32Array | null = null;
+  // RGBA of each palette index, packed for little endian pixel writes
+  private palette = new Uint32Array(256);
+
+  constructor(parent: HTMLElement, private scale: number = 3) {
+    this.container = document.createElement("div");
+    this.container.style.cssText =
+      "position: absolute; left: 50%; top: 50%; transform: translate(-50%, -50%); display: none; text-align: center;";
+    this.canvas = document.createElement("canvas");
+    this.canvas.style.imageRendering = "pixelated";
+    this.title = document.createElement("div");
+    this.title.style.color = "#FFFFFF";
+    this.container.append(this.canvas, this.title);
+    parent.append(this.container);
+    this.context = this.canvas.getContext("2d")!;
+  }
+
+  setup = (width: number, height: number): void => {
+    this.canvas.width = width;
+    this.canvas.height = height;
+    this.canvas.style.width = `${width * this.scale}px`;
+    this.canvas.style.height = `${height * this.scale}px`;
+    this.image = this.context.createImageData(width, height);
+    this.pixels = new Uint32Array(this.image.data.buffer);
+    this.container.style.display = "block";
+  };
+
+  exit = (): void => {
+    this.container.style.display = "none";
+  };
+
+  setTitle = (text: string): void => {
+    this.title.textContent = text;
+  };
+
+  setPalette = (rgb: Uint8Array): void => {
+    for (let i = 0; i < rgb.length / 3; i++) {
+      this.palette[i] =
+        (0xff << 24) |
+        (rgb[3 * i + 2]! << 16) |
+        (rgb[3 * i + 1]! << 8) |
+        rgb[3 * i]!;
+    }
+  };
+
+  // blits one frame of palette indices (or a palette PNG) to the canvas
+  drawFrame = async (
+    width: number,
+    height: number,
+    encoding: CameraEncoding,
+    data: Uint8Array<ArrayBuffer>,
+  ): Promise<void> => {
+    if (
+      !this.image ||
+      this.image.width !== width ||
+      this.image.height !== height
+    ) {
+      this.setup(width, height);
+    }
+
+    if (encoding === "png") {
+      // the browser decodes PNGs natively, palette included
+      const bitmap = await createImageBitmap(
+        new Blob([data], { type: "image/png" }),
+      );
+      this.context.drawImage(bitmap, 0, 0);
+      bitmap.close();
+      return;
+    }
+
+    let indices: Uint8Array = data;
+    if (encoding === "zlib") {
+      const stream = new Blob([data])
+        .stream()
+        .pipeThrough(new DecompressionStream("deflate"));
+      indices = new Uint8Array(await new Response(stream).arrayBuffer());
+    }
+    const pixels = this.pixels!;
+    const n = Math.min(indices.length, pixels.length);
+    for (let i = 0; i < n; i++) {
+      pixels[i] = this.palette[indices[i]!]!;
+    }
+    this.context.putImageData(this.image!, 0, 0);
+  };
+
+  // crosshairs are drawn over the finished image, in camera image pixels
+  drawCrosshairLine = (
+    x1: number,
+    y1: number,
+    x2: number,
+    y2: number,
+    color: number,
+  ): void => {
+    this.context.strokeStyle = CROSSHAIR_COLORS[color] ?? "#FFFFFF";
+    this.context.beginPath();
+    this.context.moveTo(x1, y1);
+    this.context.lineTo(x2, y2);
+    this.context.stroke();
+  };
+
+  drawLozenge = (
+    x: number,
+    y: number,
+    w: number,
+    h: number,
+    color: number,
+  ): void => {
+    const radius = Math.min(w, h) / 2;
+    this.context.strokeStyle = CROSSHAIR_COLORS[color] ?? "#FFFFFF";
+    this.context.beginPath();
+    this.context.roundRect(x, y, w, h, radius);
+    this.context.stroke();
+  };
+
+  dispose = (): void => {
+    this.container.remove();
+  };
+}
+
 // fabric canvas for displaying objects
 // graphics go here
 class EyeLinkCanvas extends Canvas {
@@ -93,6 +382,7 @@ class EyeLinkCanvas extends Canvas {
     });
   }
 
+  // callers render once they are done changing the canvas
   clearScreen = (pattern: RegExp | null = null): void => {
     if (pattern) {
       this.getObjects().forEach((o) => {
@@ -109,39 +399,40 @@ class EyeLinkCanvas extends Canvas {
         }
       });
     }
-    this.renderAll();
   };
 
   drawCalibrationTarget = (x: number, y: number): void => {
-    const target = new Group([
-      new Circle({
-        left: x,
-        top: y,
-        fill: "#FFF",
-        radius: 22,
-        originX: "center",
-        originY: "center",
-      }),
-      new Circle({
-        left: x,
-        top: y,
-        fill: "#000",
-        radius: 20,
-        originX: "center",
-        originY: "center",
-      }),
-      new Circle({
-        left: x,
-        top: y,
-        fill: "#FFF",
-        radius: 8,
-        originX: "center",
-        originY: "center",
-      }),
-    ]);
+    const target = new Group(
+      [
+        new Circle({
+          left: x,
+          top: y,
+          fill: "#FFF",
+          radius: 22,
+          originX: "center",
+          originY: "center",
+        }),
+        new Circle({
+          left: x,
+          top: y,
+          fill: "#000",
+          radius: 20,
+          originX: "center",
+          originY: "center",
+        }),
+        new Circle({
+          left: x,
+          top: y,
+          fill: "#FFF",
+          radius: 8,
+          originX: "center",
+          originY: "center",
+        }),
+      ],
+      { id: "calibrationTarget" },
+    );
 
     this.add(target);
-    this.renderAll();
   };
 
   textScreen = (
@@ -161,7 +452,6 @@ class EyeLinkCanvas extends Canvas {
     });
     this.add(textObj);
     this.centerObject(textObj);
-    this.renderAll();
   };
 }
 
@@ -196,7 +486,7 @@ class EyeLinkPlugin implements JsPsychPlugin<Info> {
     if (!trial.command) {
       throw new Error("Trial command is required");
     }
-    socket.emit(trial.command);
+    socket.emit(trial.command, { camera_encoding: trial.camera_encoding });
     console.log(`Sent command: ${trial.command}`);
 
     // set up keyboard listener to send ALL keypresses to eyelink
@@ -208,63 +498,89 @@ class EyeLinkPlugin implements JsPsychPlugin<Info> {
       persist: true,
     });
 
+    const camera = new CameraImage(
+      display_element.querySelector<HTMLElement>("#wm-canvas-wrapper") ??
+        display_element,
+    );
+
     // Cleanup function to remove all listeners
     const cleanupListeners = () => {
-      socket.off("drawCalTarget");
-      socket.off("eraseCalTarget");
-      socket.off("setupCalDisplay");
-      socket.off("clearCalDisplay");
-      socket.off("exitCalDisplay");
+      socket.off("calDisplay");
       if (OKeyListener) {
         this.jsPsych.pluginAPI.cancelKeyboardResponse(OKeyListener);
       }
       this.jsPsych.pluginAPI.cancelKeyboardResponse(keyListener);
     };
 
-    // this is the main command that will draw the calibration/validation target
-    socket.on("drawCalTarget", (data: { x: number; y: number }) => {
-      canvas.clearScreen(/.+/);
-      console.log("drawCalTarget event received", data);
-      canvas.drawCalibrationTarget(data.x, data.y);
-    });
+    const display: DisplayHandler = {
+      // this is the command that starts calibration/validation
+      setup: () => {
+        if (OKeyListener) {
+          this.jsPsych.pluginAPI.cancelKeyboardResponse(OKeyListener);
+        }
+        canvas.clearScreen(/.+/);
+        canvas.clearScreen();
+      },
 
-    socket.on("eraseCalTarget", () => {
-      console.log("eraseCalTarget event received");
-      canvas.clearScreen(/calibrationTarget/);
-    });
+      // when done with calibration/validation
+      exit: () => {
+        canvas.clearScreen(/.+/);
+        canvas.clearScreen();
+        camera.exit();
 
-    // this is the command that starts calibration/validation
-    socket.on("setupCalDisplay", () => {
-      if (OKeyListener) {
-        this.jsPsych.pluginAPI.cancelKeyboardResponse(OKeyListener);
-      }
-      console.log("setupCalDisplay event received");
-      canvas.clearScreen();
-    });
-    socket.on("clearCalDisplay", () => {
-      console.log("clearCalDisplay event received");
-      canvas.clearScreen(/calibrationTarget/);
-    });
+        canvas.textScreen("C: calibrate, V: validate, O: output/record");
 
-    // when done with calibration/validation
-    socket.on("exitCalDisplay", () => {
-      console.log("exitCalDisplay event received");
-      canvas.clearScreen();
+        OKeyListener = this.jsPsych.pluginAPI.getKeyboardResponse({
+          callback_function: () => {
+            // disable listeners and continue
+            cleanupListeners();
+            this.jsPsych.pluginAPI.clearAllTimeouts();
+            canvas.clearScreen();
+            canvas.dispose();
+            camera.dispose();
 
-      canvas.textScreen("C: calibrate, V: validate, O: output/record");
+            this.jsPsych.finishTrial({ command: trial.command });
+          },
+          valid_responses: ["o"],
+        });
+      },
 
-      OKeyListener = this.jsPsych.pluginAPI.getKeyboardResponse({
-        callback_function: () => {
-          // disable listeners and continue
-          cleanupListeners();
-          this.jsPsych.pluginAPI.clearAllTimeouts();
-          canvas.clearScreen();
-          canvas.dispose();
+      clear: () => canvas.clearScreen(/calibrationTarget/),
 
-          this.jsPsych.finishTrial({ command: trial.command });
-        },
-        valid_responses: ["o"],
-      });
+      // this is the main command that will draw the calibration/validation target
+      drawTarget: (x, y) => {
+        canvas.clearScreen(/.+/);
+        canvas.drawCalibrationTarget(x, y);
+      },
+
+      eraseTarget: () => canvas.clearScreen(/calibrationTarget/),
+
+      setupImage: (width, height) => {
+        canvas.clearScreen(/.+/);
+        camera.setup(width, height);
+      },
+      exitImage: () => camera.exit(),
+      imageTitle: (text) => camera.setTitle(text),
+      palette: (rgb) => camera.setPalette(rgb),
+      imageFrame: async (frame, width, height, encoding, data) => {
+        await camera.drawFrame(width, height, encoding, data);
+        // lets the server know this client keeps up, it drops frames otherwise
+        socket.emit("camera_ack", frame);
+      },
+      drawLine: (x1, y1, x2, y2, color) =>
+        camera.drawCrosshairLine(x1, y1, x2, y2, color),
+      drawLozenge: (x, y, w, h, color) =>
+        camera.drawLozenge(x, y, w, h, color),
+    };
+
+    // the server sends everything drawn during one tracker frame as one
+    // binary batch, so the canvas is only rendered once per frame
+    let pending = Promise.resolve();
+    socket.on("calDisplay", (data: ArrayBuffer) => {
+      pending = pending
+        .then(() => applyDisplayBatch(data, display))
+        .then(() => canvas.requestRenderAll())
+        .catch((err) => console.error("Could not draw display batch:", err));
     });
   }
 }